@@ -0,0 +1,65 @@
+"""
+weatherBot adapters
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import requests
+import requests.adapters
+import tweepy.binder
+
+
+class KeepAliveAdapter(requests.adapters.HTTPAdapter):
+    """
+    An HTTPAdapter that keeps its connection pool open when the session it is mounted on is closed.
+    tweepy 3.10 creates and closes a new requests.Session for every API call, so mounting this adapter on those
+    sessions lets calls reuse the same keep-alive connections.
+    """
+
+    def close(self):
+        """
+        Ignore the close from a short lived session, use reset to actually drop the pooled connections
+        """
+
+    def reset(self):
+        """
+        Close every pooled connection, new ones are opened on the next request
+        """
+        super().close()
+
+
+class _PooledRequests:
+    """
+    Stand-in for the requests module used by tweepy.binder. Every session it creates has the adapter mounted.
+    """
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self, adapter):
+        """
+        :type adapter: requests.adapters.HTTPAdapter
+        """
+        self.adapter = adapter
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+    def Session(self):  # pylint: disable=invalid-name
+        """
+        :return: requests.Session with the adapter mounted for HTTPS
+        """
+        session = requests.Session()
+        session.mount('https://', self.adapter)
+        return session
+
+
+def install_adapter(adapter):
+    """
+    Make every tweepy API call go through the given adapter. tweepy has no hook for this, so the requests module
+    seen by tweepy.binder is swapped for one that mounts the adapter on each session it creates.
+    :type adapter: requests.adapters.HTTPAdapter
+    """
+    if isinstance(tweepy.binder.requests, _PooledRequests):
+        tweepy.binder.requests.adapter = adapter
+    else:
+        tweepy.binder.requests = _PooledRequests(adapter)
@@ -0,0 +1,1228 @@
+#!/usr/bin/env python3
+
+"""
+weatherBot benchmarks
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+# pylint: disable=too-many-lines
+
+import argparse
+import copy
+import functools
+import gzip
+import http.server
+import json
+import os
+import platform
+import random
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from datetime import timedelta
+from unittest import mock
+
+import forecastio
+import pytz
+import requests.adapters
+import tweepy
+import yaml
+
+import adapters
+import clients
+import models
+import nowcast
+import outbox
+import snapshot
+import state
+import templates
+import utils
+import weatherBot
+
+# fixtures that hold a complete, valid Dark Sky response
+FIXTURES = ['us.json', 'ca.json', 'uk2.json', 'si.json', 'us_alert.json', 'ca_alert.json', 'us_cincinnati.json',
+            'optional_fields.json']
+
+
+def load_fixtures():
+    """
+    :return: list of dicts, the decoded JSON of each fixture in FIXTURES
+    """
+    fixtures = []
+    for name in FIXTURES:
+        with open(os.path.join('fixtures', name), 'r', encoding='utf-8') as file_stream:
+            fixtures.append(json.load(file_stream))
+    return fixtures
+
+
+def load_strings(path='strings.yml'):
+    """
+    :type path: str
+    :param path: path to a strings YAML file
+    :return: dict of strings
+    """
+    with open(path, 'r', encoding='utf-8') as file_stream:
+        return yaml.safe_load(file_stream)
+
+
+def fixture_forecast(data):
+    """
+    Build a forecastio Forecast from decoded JSON without making a request
+    :type data: dict
+    :return: forecastio.models.Forecast
+    """
+    return forecastio.models.Forecast(data, None, None)
+
+
+def make_jobs(count, weatherbot_strings):
+    """
+    Build the jobs used by weatherBot.run_cycle for count locations. Each location's lat is its index, which is used
+    to pick a fixture.
+    :type count: int
+    :type weatherbot_strings: dict
+    :return: list of (settings, wb_string, throttles) tuples
+    """
+    now = pytz.utc.localize(datetime.utcnow())
+    jobs = []
+    for i in range(count):
+        settings = weatherBot.default_location_settings()
+        settings['id'] = 'location-{0}'.format(i)
+        settings['location'] = models.WeatherLocation(lat=i, lng=0, name=settings['id'])
+        jobs.append((settings, models.WeatherBotString(weatherbot_strings), state.Throttles({'default': now})))
+    return jobs
+
+
+def bench_fan_out(options):
+    """
+    Measure how long one cycle takes as the number of locations grows. Each Dark Sky request is replaced by a sleep
+    of options.latency seconds followed by a fixture, and tweets are discarded.
+    :type options: argparse.Namespace
+    :return: list of dicts, one per number of locations
+    """
+    fixtures = load_fixtures()
+    weatherbot_strings = load_strings()
+    workers = options.workers or weatherBot.CONFIG['basic']['workers']
+
+    def get_forecast_object(lat, lng, units='us', lang='en'):
+        # pylint: disable=unused-argument
+        time.sleep(options.latency)
+        return fixture_forecast(fixtures[int(lat) % len(fixtures)])
+
+    rows = []
+    single = None
+    with mock.patch('weatherBot.get_forecast_object', get_forecast_object), mock.patch('weatherBot.do_tweet'):
+        for count in options.locations:
+            jobs = make_jobs(count, weatherbot_strings)
+            now = pytz.utc.localize(datetime.utcnow())
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                start = time.perf_counter()
+                weatherBot.run_cycle(pool, jobs, now)
+                elapsed = time.perf_counter() - start
+            if single is None:
+                # the first run is used as the cost of a single location processed on its own
+                single = elapsed / count
+            rows.append({
+                'locations': count,
+                'workers': workers,
+                'cycle_s': elapsed,
+                'serial_estimate_s': single * count,
+                'speedup': single * count / elapsed
+            })
+    return rows
+
+
+class StandInTwitterHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers every POST like a successful statuses/update call, keeping connections alive
+    """
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, avoid waiting on a delayed ACK between them
+    disable_nagle_algorithm = True
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        StandInTwitterHandler.connections += 1
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        Read the request body and reply with a minimal status
+        """
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps({'id': 1, 'text': 'benchmark'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """
+        Keep the benchmark output clean
+        """
+
+
+class StandInMixin:
+    """
+    Sends requests meant for Twitter to the stand-in server over plain HTTP instead
+    """
+    # pylint: disable=too-few-public-methods
+    base_url = ''
+
+    def send(self, request, **kwargs):
+        """
+        :type request: requests.PreparedRequest
+        """
+        request.url = self.base_url + request.path_url
+        return super().send(request, **kwargs)
+
+
+class StandInAdapter(StandInMixin, requests.adapters.HTTPAdapter):
+    """
+    Drops its connections whenever tweepy closes its session, like tweepy does on its own
+    """
+
+
+class StandInKeepAliveAdapter(StandInMixin, adapters.KeepAliveAdapter):
+    """
+    Keeps its connections open between tweepy calls
+    """
+
+
+class ThreadingServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    Answers each request on its own thread, the same as http.server.ThreadingHTTPServer from Python 3.7
+    """
+    # pylint: disable=too-few-public-methods
+    daemon_threads = True
+
+
+def start_server(handler):
+    """
+    Start a local HTTP server on a random port in a background thread
+    :type handler: type
+    :param handler: http.server.BaseHTTPRequestHandler subclass
+    :return: ThreadingServer, call shutdown and server_close when done
+    """
+    server = ThreadingServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_tweet_reuse(options):
+    """
+    Compare tweets per second when building a new tweepy.API for every tweet against reusing one from
+    clients.TwitterClients. Tweets go to a local stand-in server over plain HTTP, so TLS handshakes, which
+    make a new connection much more expensive against the real Twitter API, are not included.
+    :type options: argparse.Namespace
+    :return: list of dicts, one without and one with reuse
+    """
+    server = start_server(StandInTwitterHandler)
+    StandInMixin.base_url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    account = clients.Account('key', 'secret', 'token', 'token secret')
+    rows = []
+    try:
+        for reuse in (False, True):
+            StandInTwitterHandler.connections = 0
+            if reuse:
+                twitter = clients.TwitterClients(StandInKeepAliveAdapter())
+            else:
+                adapters.install_adapter(StandInAdapter())
+            start = time.perf_counter()
+            for i in range(options.tweets):
+                if reuse:
+                    api = twitter.get(account)
+                else:
+                    auth = tweepy.OAuthHandler(account.consumer_key, account.consumer_secret)
+                    auth.set_access_token(account.access_token, account.access_token_secret)
+                    api = tweepy.API(auth)
+                api.update_status(status='benchmark {0}'.format(i))
+            elapsed = time.perf_counter() - start
+            if reuse:
+                twitter.close()
+            rows.append({
+                'reuse': reuse,
+                'tweets': options.tweets,
+                'connections': StandInTwitterHandler.connections,
+                'seconds': elapsed,
+                'tweets_per_s': options.tweets / elapsed
+            })
+    finally:
+        server.shutdown()
+        server.server_close()
+    return rows
+
+
+class StandInDarkSkyHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers forecast requests with the fixtures, leaving out excluded blocks and gzipping when asked to
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    fixtures = []
+    sent_bytes = 0
+    lock = threading.Lock()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Reply with the fixture picked by the latitude in the path
+        """
+        url = urllib.parse.urlsplit(self.path)
+        lat = url.path.rsplit('/', 1)[-1].split(',')[0]
+        data = dict(self.fixtures[int(float(lat)) % len(self.fixtures)])
+        for block in urllib.parse.parse_qs(url.query).get('exclude', [''])[0].split(','):
+            data.pop(block, None)
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.lock:
+            StandInDarkSkyHandler.sent_bytes += len(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """
+        Keep the benchmark output clean
+        """
+
+
+def bench_darksky_fetch(options):
+    """
+    Compare fetching forecasts like forecastio.load_forecast, with a new connection and the full payload every time,
+    against clients.DarkSkyClient with its pooled session and excluded blocks. Forecasts come from a local stand-in
+    server over plain HTTP.
+    :type options: argparse.Namespace
+    :return: list of dicts, one for each way of fetching
+    """
+    StandInDarkSkyHandler.fixtures = load_fixtures()
+    server = start_server(StandInDarkSkyHandler)
+    base_url = 'http://127.0.0.1:{0}/forecast/'.format(server.server_address[1])
+    darksky = clients.DarkSkyClient(base_url=base_url)
+    exclude = weatherBot.get_excluded_blocks()
+    rows = []
+    try:
+        for pooled in (False, True):
+            StandInDarkSkyHandler.sent_bytes = 0
+            start = time.perf_counter()
+            for i in range(options.fetches):
+                if pooled:
+                    darksky.load_forecast('key', i, 0, exclude=exclude)
+                else:
+                    forecastio.manual('{0}key/{1},0?units=us&lang=en'.format(base_url, i))
+            elapsed = time.perf_counter() - start
+            rows.append({
+                'pooled': pooled,
+                'exclude': ','.join(exclude) if pooled else '',
+                'fetches': options.fetches,
+                'bytes_per_fetch': StandInDarkSkyHandler.sent_bytes / options.fetches,
+                'ms_per_fetch': elapsed / options.fetches * 1000
+            })
+    finally:
+        darksky.close()
+        server.shutdown()
+        server.server_close()
+    return rows
+
+
+def make_throttles(entries, locations, now):
+    """
+    Build a cache in the layout of the pickled cache file holding the given number of throttles
+    :type entries: int
+    :param entries: total number of throttles
+    :type locations: int
+    :param locations: number of locations the throttles are spread across
+    :type now: datetime.datetime
+    :return: dict with 'throttles' and 'locations' keys
+    """
+    old_cache = {'throttles': {'default': now}, 'locations': {}}
+    for i in range(entries - 1):
+        location_id = 'location-{0}'.format(i % locations)
+        old_cache['locations'].setdefault(location_id, {})['alert-{0}'.format(i)] = now
+    return old_cache
+
+
+def bench_state(options):
+    """
+    Compare the pickled cache file, which is loaded and saved in full every cycle, against state.StateStore, which
+    only writes the throttles that changed. Each cycle changes options.changes throttles of one location. Loading is
+    the time until one location's throttles can be used.
+    :type options: argparse.Namespace
+    :return: list of dicts, one for each way of saving
+    """
+    now = pytz.utc.localize(datetime.utcnow())
+    old_cache = make_throttles(options.entries, options.state_locations, now)
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, '.wbcache.p')
+        weatherBot.set_cache(old_cache, file=path)
+        start = time.perf_counter()
+        weatherBot.get_cache(file=path)
+        load = time.perf_counter() - start
+        start = time.perf_counter()
+        for cycle in range(options.cycles):
+            loaded = weatherBot.get_cache(file=path)
+            throttles = loaded['locations']['location-{0}'.format(cycle % options.state_locations)]
+            for i in range(options.changes):
+                throttles['change-{0}'.format(i)] = now + timedelta(minutes=cycle)
+            weatherBot.set_cache(loaded, file=path)
+        elapsed = time.perf_counter() - start
+        rows.append({
+            'backend': 'pickle',
+            'entries': options.entries,
+            'load_ms': load * 1000,
+            'ms_per_cycle': elapsed / options.cycles * 1000,
+            'written_per_cycle': sum(len(throttles) for throttles in loaded['locations'].values()) + 1
+        })
+
+        path = os.path.join(directory, '.wbstate.db')
+        store = state.StateStore(path)
+        store.import_cache(old_cache)
+        store.close()
+        start = time.perf_counter()
+        store = state.StateStore(path)
+        store.throttles('location-0')
+        load = time.perf_counter() - start
+        written = 0
+        start = time.perf_counter()
+        for cycle in range(options.cycles):
+            throttles = store.throttles('location-{0}'.format(cycle % options.state_locations)).conditions
+            for i in range(options.changes):
+                throttles['change-{0}'.format(i)] = now + timedelta(minutes=cycle)
+            written += store.flush()
+        elapsed = time.perf_counter() - start
+        store.close()
+        rows.append({
+            'backend': 'sqlite',
+            'entries': options.entries,
+            'load_ms': load * 1000,
+            'ms_per_cycle': elapsed / options.cycles * 1000,
+            'written_per_cycle': written / options.cycles
+        })
+    return rows
+
+
+def scan_expire(throttles, now):
+    """
+    Expire throttles by scanning every key, like weatherBot.cleanse_throttles did before the expiry heap
+    :type throttles: dict
+    :type now: datetime.datetime
+    """
+    to_delete = [key for key, expires in throttles.items() if expires <= now]
+    for key in to_delete:
+        if key != 'default':
+            del throttles[key]
+
+
+def bench_throttle_expiry(options):
+    """
+    Compare expiring throttles by scanning every key against the expiry heap in state.ExpiringDict. options.throttles
+    alerts expire one minute apart, and each cycle moves the clock forward one minute, so one alert expires and one
+    new alert is added per cycle.
+    :type options: argparse.Namespace
+    :return: list of dicts, one for each way of expiring
+    """
+    now = pytz.utc.localize(datetime.utcnow())
+    rows = []
+    for heap in (False, True):
+        entries = {'alert-{0}'.format(i): now + timedelta(minutes=i) for i in range(options.throttles)}
+        entries['default'] = now
+        throttles = state.ExpiringDict(entries) if heap else entries
+        start = time.perf_counter()
+        for cycle in range(options.cycles):
+            cycle_now = now + timedelta(minutes=cycle)
+            if heap:
+                throttles.expire(cycle_now, keep=('default',))
+            else:
+                scan_expire(throttles, cycle_now)
+            added = options.throttles + cycle
+            throttles['alert-{0}'.format(added)] = now + timedelta(minutes=added)
+        elapsed = time.perf_counter() - start
+        rows.append({
+            'heap': heap,
+            'throttles': options.throttles,
+            'us_per_cycle': elapsed / options.cycles * 1000000,
+            'remaining': len(throttles)
+        })
+    return rows
+
+
+def bench_render(options):
+    """
+    Compare rendering every template in set_weather against rendering only the templates that are picked. Each
+    location sets its weather and picks a normal and a special condition once per cycle, like weatherBot.tweet_logic
+    and a scheduled tweet.
+    :type options: argparse.Namespace
+    :return: list of dicts, one per number of locations and way of rendering
+    """
+    weatherbot_strings = load_strings()
+    location = models.WeatherLocation(lat=0, lng=0, name='benchmark')
+    weather = [models.WeatherData(fixture_forecast(data), location) for data in load_fixtures()]
+    rows = []
+    for count in options.locations:
+        for lazy in (False, True):
+            wb_strings = [models.WeatherBotString(weatherbot_strings, lazy=lazy) for _ in range(count)]
+            start = time.perf_counter()
+            for i, wb_string in enumerate(wb_strings):
+                wb_string.set_weather(weather[i % len(weather)])
+                wb_string.normal()
+                wb_string.special()
+            elapsed = time.perf_counter() - start
+            rows.append({
+                'locations': count,
+                'lazy': lazy,
+                'ms_per_cycle': elapsed * 1000,
+                'us_per_location': elapsed / count * 1000000
+            })
+    return rows
+
+
+def flatten_templates(texts):
+    """
+    :type texts: list or dict
+    :param texts: list of templates, or lists nested in dicts like special_conditions and precipitations
+    :return: list of every template
+    """
+    if isinstance(texts, dict):
+        return [text for value in texts.values() for text in flatten_templates(value)]
+    return list(texts)
+
+
+def bench_templates(options):
+    """
+    Compare rendering every template in the strings file with str.format against templates.Template
+    :type options: argparse.Namespace
+    :return: list of dicts, one for each way of rendering
+    """
+    weatherbot_strings = load_strings()
+    weatherbot_strings['expires_alerts'] = weatherbot_strings['alerts']['expires']
+    weatherbot_strings['no_expires_alerts'] = weatherbot_strings['alerts']['no_expires']
+    jobs = []
+    for kind, fields in templates.FIELDS.items():
+        values = {field: field.upper() for field in fields}
+        jobs.extend((text, templates.compile_template(text, fields), values)
+                    for text in flatten_templates(weatherbot_strings[kind]))
+    rows = []
+    for compiled in (False, True):
+        if compiled:
+            calls = [functools.partial(template.render, values) for _, template, values in jobs]
+        else:
+            calls = [functools.partial(text.format, **values) for text, _, values in jobs]
+        start = time.perf_counter()
+        for _ in range(options.renders):
+            for call in calls:
+                call()
+        elapsed = time.perf_counter() - start
+        renders = options.renders * len(jobs)
+        rows.append({
+            'compiled': compiled,
+            'templates': len(jobs),
+            'renders': renders,
+            'renders_per_s': renders / elapsed
+        })
+    return rows
+
+
+# plain dicts of units, copied by legacy_get_units
+LEGACY_UNITS = {code: dict(units) for code, units in utils.UNITS.items()}
+
+
+def legacy_get_units(unit):
+    """
+    utils.get_units as it was, building a new dict every call. Copying a plain dict is a little faster than the chain
+    of comparisons and the dict literal it used to build, so this slightly flatters it.
+    :type unit: str
+    :return: dict
+    """
+    return LEGACY_UNITS.get(unit, LEGACY_UNITS['si']).copy()
+
+
+def legacy_get_wind_direction(degrees):
+    """
+    utils.get_wind_direction as it was, walking a chain of comparisons
+    :type degrees: str, float
+    :param degrees: integer for degrees of wind
+    :type: str
+    :return: wind direction in shorthand form
+    """
+    try:
+        degrees = int(degrees)
+    except ValueError:
+        return ''
+    direction = ''
+    if degrees < 23 or degrees >= 338:
+        direction = 'N'
+    elif degrees < 68:
+        direction = 'NE'
+    elif degrees < 113:
+        direction = 'E'
+    elif degrees < 158:
+        direction = 'SE'
+    elif degrees < 203:
+        direction = 'S'
+    elif degrees < 248:
+        direction = 'SW'
+    elif degrees < 293:
+        direction = 'W'
+    elif degrees < 338:
+        direction = 'NW'
+    return direction
+
+
+def legacy_precipitation_intensity(precip_intensity, unit):
+    """
+    utils.precipitation_intensity as it was, comparing against every intensity from the heaviest
+    :type precip_intensity: float
+    :param precip_intensity: currently precipIntensity
+    :type unit: str
+    :param unit: unit for precipIntensity rate ('in/h' or 'mm/h')
+    :return: str of precipitation rate. Note: this is appended to and used in special event times
+    """
+    intensities = utils.PRECIPITATION_INTENSITIES
+
+    if precip_intensity >= intensities[unit]['heavy'][1]:
+        return intensities[unit]['heavy'][0]
+    if precip_intensity >= intensities[unit]['moderate'][1]:
+        return intensities[unit]['moderate'][0]
+    if precip_intensity >= intensities[unit]['light'][1]:
+        return intensities[unit]['light'][0]
+    if precip_intensity >= intensities[unit]['very-light'][1]:
+        return intensities[unit]['very-light'][0]
+    return 'none'
+
+
+def bench_utils(options):
+    """
+    Microbenchmark each utils lookup helper over options.lookups inputs, calling it as it was, calling it with the
+    lookup tables, and calling its vectorized form once for every input
+    :type options: argparse.Namespace
+    :return: list of dicts, one for each helper and way of calling it
+    """
+    # pylint: disable=too-many-locals
+    rand = random.Random(0)
+    units = [rand.choice(('us', 'si', 'ca', 'uk2')) for _ in range(options.lookups)]
+    degrees = [rand.uniform(0, 360) for _ in range(options.lookups)]
+    rates = [rand.choice((0, 0, 0, rand.uniform(0, 0.6))) for _ in range(options.lookups)]
+    helpers = (
+        ('get_units', units, legacy_get_units, utils.get_units, utils.get_units_list),
+        ('get_wind_direction', degrees, legacy_get_wind_direction, utils.get_wind_direction,
+         utils.get_wind_directions),
+        ('precipitation_intensity', rates, functools.partial(legacy_precipitation_intensity, unit='in/h'),
+         functools.partial(utils.precipitation_intensity, unit='in/h'),
+         functools.partial(utils.precipitation_intensities, unit='in/h'))
+    )
+    rows = []
+    for name, inputs, legacy, table, vectorized in helpers:
+        for form, helper in (('legacy', legacy), ('table', table), ('vectorized', vectorized)):
+            start = time.perf_counter()
+            if form == 'vectorized':
+                helper(inputs)
+            else:
+                for value in inputs:
+                    helper(value)
+            elapsed = time.perf_counter() - start
+            rows.append({
+                'helper': name,
+                'form': form,
+                'lookups': len(inputs),
+                'ns_per_lookup': elapsed / len(inputs) * 1000000000
+            })
+    return rows
+
+
+def legacy_next_fire_time(timezone_id, tweet_time, after):
+    """
+    utils.next_fire_time as it was, looking up the timezone and localizing the time again every call
+    :type timezone_id: str
+    :type tweet_time: utils.Time
+    :type after: datetime.datetime
+    :return: datetime.datetime in utc timezone
+    """
+    timezone = pytz.timezone(timezone_id)
+    day = after.astimezone(timezone).date()
+    fire_dt = utils.local_fire_time(timezone, day, tweet_time)
+    while fire_dt <= after:
+        day += timedelta(days=1)
+        fire_dt = utils.local_fire_time(timezone, day, tweet_time)
+    return fire_dt
+
+
+def bench_fire_times(options):
+    """
+    Schedule the forecast and two conditions tweets of options.schedule_locations locations, spread across a few
+    timezones, for options.days days, computing each tweet's next fire time after it fires. The days cross the US
+    and European DST transitions in the spring.
+    :type options: argparse.Namespace
+    :return: list of dicts, one computing each fire time from scratch and one with the shared table
+    """
+    timezones = ['America/Chicago', 'America/New_York', 'Europe/Copenhagen', 'Europe/London', 'Asia/Tokyo']
+    tweet_times = [utils.Time(hour=6, minute=0), utils.Time(hour=7, minute=0), utils.Time(hour=12, minute=0)]
+    start_dt = pytz.utc.localize(datetime(2019, 3, 5))
+    rows = []
+    for table in (False, True):
+        next_fire_time = utils.next_fire_time if table else legacy_next_fire_time
+        utils.get_fire_times.cache_clear()
+        # the latest fire time of each location's tweets, every one is due once a day like in weatherBot.main
+        fire_dts = {(i, tweet_time): start_dt for i in range(options.schedule_locations) for tweet_time in tweet_times}
+        start = time.perf_counter()
+        for _ in range(options.days):
+            for i, tweet_time in fire_dts:
+                fire_dts[i, tweet_time] = next_fire_time(timezones[i % len(timezones)], tweet_time,
+                                                         fire_dts[i, tweet_time])
+        elapsed = time.perf_counter() - start
+        count = len(fire_dts) * options.days
+        rows.append({
+            'table': table,
+            'locations': options.schedule_locations,
+            'fire_times': count,
+            'us_per_fire_time': elapsed / count * 1000000
+        })
+    return rows
+
+
+class LegacyWeatherData:
+    """
+    models.WeatherData as it was before it was built straight from the JSON, which keeps the whole
+    forecastio.models.Forecast and wraps every alert up front
+    """
+
+    # pylint: disable=too-many-instance-attributes,invalid-name,too-few-public-methods
+    def __init__(self, forecast, location):
+        # the whole forecast was kept alive for json()
+        self.forecast_object = forecast
+        currently = forecast.currently
+        self.units = utils.get_units(forecast.json['flags']['units'])
+        if hasattr(currently(), 'windBearing'):
+            self.windBearing = utils.get_wind_direction(currently().windBearing)
+        else:
+            self.windBearing = 'unknown direction'
+        self.windSpeed = currently().windSpeed
+        self.apparentTemperature = currently().apparentTemperature
+        self.temp = currently().temperature
+        self.humidity = round(currently().humidity * 100)
+        self.precipIntensity = currently().precipIntensity
+        self.precipProbability = currently().precipProbability
+        self.precipType = currently().precipType if hasattr(currently(), 'precipType') else 'none'
+        self.summary = currently().summary
+        self.icon = currently().icon
+        self.location = location
+        self.timezone = forecast.json['timezone']
+        self.forecast = forecast.daily().data[0]
+        self.minutely = forecast.minutely() if 'minutely' in forecast.json else None
+        self.alerts = [models.WeatherAlert(alert) for alert in forecast.alerts()]
+        self.valid = True
+
+
+def bench_memory(options):
+    """
+    Measure the memory held by options.objects live weather data objects built from the fixtures, with the old
+    forecastio based representation and with models.WeatherData built from the JSON. Every object gets its own
+    decoded response without the blocks that are excluded from requests, like a fetch would, and reads the fields a
+    tweet uses.
+    :type options: argparse.Namespace
+    :return: list of dicts, one for each representation
+    """
+    fixtures = load_fixtures()
+    for data in fixtures:
+        for block in weatherBot.get_excluded_blocks():
+            data.pop(block, None)
+    texts = [json.dumps(data) for data in fixtures]
+    location = models.WeatherLocation(lat=0, lng=0, name='benchmark')
+    rows = []
+    for compact in (False, True):
+        tracemalloc.start()
+        start = time.perf_counter()
+        objects = []
+        for i in range(options.objects):
+            data = json.loads(texts[i % len(texts)])
+            weather_data = models.WeatherData(data, location) if compact else \
+                LegacyWeatherData(fixture_forecast(data), location)
+            # pylint: disable=pointless-statement
+            (weather_data.temp, weather_data.summary, weather_data.humidity, weather_data.forecast.summary,
+             weather_data.alerts)
+            objects.append(weather_data)
+        elapsed = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rows.append({
+            'representation': 'json slots' if compact else 'forecastio',
+            'objects': len(objects),
+            'kb_live': current / 1024,
+            'kb_peak': peak / 1024,
+            'bytes_per_object': current / len(objects),
+            'us_per_object': elapsed / len(objects) * 1000000
+        })
+        del objects
+    return rows
+
+
+def bench_nowcast(options):
+    """
+    Measure the lookahead for options.nowcasts locations, loading the minutely and hourly blocks of a fixture into
+    rows and classifying every row one at a time and, if NumPy is installed, in one vectorized pass. Each way
+    classifies once before it is timed, so importing NumPy is not counted.
+    :type options: argparse.Namespace
+    :return: list of dicts, one for each way of classifying
+    """
+    with open(os.path.join('fixtures', 'us_cincinnati.json'), 'r', encoding='utf-8') as file_stream:
+        data = json.load(file_stream)
+    units = models.get_units('us')
+    horizon = 24 * 60
+    rows = []
+    for vectorized in (False, True) if nowcast.numpy is not None else (False,):
+        nowcast.classify(nowcast.load_series(data, horizon), units, vectorized=vectorized)
+        start = time.perf_counter()
+        series = [nowcast.load_series(data, horizon) for _ in range(options.nowcasts)]
+        loaded = time.perf_counter()
+        for points in series:
+            nowcast.classify(points, units, vectorized=vectorized)
+        classified = time.perf_counter()
+        rows.append({
+            'classify': 'numpy' if vectorized else 'python',
+            'locations': options.nowcasts,
+            'points': len(series[0]),
+            'load_us': (loaded - start) / options.nowcasts * 1000000,
+            'classify_us': (classified - loaded) / options.nowcasts * 1000000
+        })
+    return rows
+
+
+def bench_classify_batch(options):
+    """
+    Compare classifying the special condition of options.batch locations with a loop calling
+    WeatherBotString.special for each location, against classifying them as one batch, one location at a time and, if
+    NumPy is installed, in one vectorized pass. The locations are spread across the fixtures, mixing unit systems.
+    Each way runs once on a batch of its own before it is timed, so first use costs like importing NumPy are not
+    counted.
+    :type options: argparse.Namespace
+    :return: list of dicts, one for each way of classifying
+    """
+    fixtures = [data for data in load_fixtures() if 'currently' in data]
+    location = models.WeatherLocation(lat=0, lng=0, name='benchmark')
+    weather_datas = [models.WeatherData(fixtures[i % len(fixtures)], location) for i in range(options.batch)]
+    wb_string = models.WeatherBotString(load_strings())
+    warm_up = [models.WeatherData(data, location) for data in fixtures]
+    for weather_data in warm_up:
+        wb_string.set_weather(weather_data)
+        wb_string.special()
+    warm_up_batch = nowcast.make_batch(warm_up)
+    start = time.perf_counter()
+    for weather_data in weather_datas:
+        wb_string.set_weather(weather_data)
+        wb_string.special()
+    elapsed = time.perf_counter() - start
+    rows = [{'classify': 'special loop', 'locations': options.batch, 'ms': elapsed * 1000,
+             'us_per_location': elapsed / options.batch * 1000000}]
+    start = time.perf_counter()
+    batch = nowcast.make_batch(weather_datas)
+    built = time.perf_counter() - start
+    rows.append({'classify': 'make batch', 'locations': options.batch, 'ms': built * 1000,
+                 'us_per_location': built / options.batch * 1000000})
+    for vectorized in (False, True) if nowcast.numpy is not None else (False,):
+        nowcast.classify_batch(warm_up_batch, vectorized=vectorized)
+        start = time.perf_counter()
+        nowcast.classify_batch(batch, vectorized=vectorized)
+        elapsed = time.perf_counter() - start
+        rows.append({
+            'classify': 'numpy batch' if vectorized else 'python batch',
+            'locations': options.batch,
+            'ms': elapsed * 1000,
+            'us_per_location': elapsed / options.batch * 1000000
+        })
+    return rows
+
+
+class SlowTwitterAPI:
+    """
+    Stand-in tweepy.API that takes a fixed time to post each status
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, latency):
+        """
+        :type latency: float
+        :param latency: seconds each status takes to post
+        """
+        self.latency = latency
+        self.posted = 0
+
+    def update_status(self, **status):
+        """
+        Post a status after waiting the latency
+        :return: dict, the status
+        """
+        time.sleep(self.latency)
+        self.posted += 1
+        return status
+
+    def send(self, account, status):  # pylint: disable=unused-argument
+        """
+        Post a status queued in the outbox
+        """
+        self.update_status(**status)
+
+
+def bench_outbox(options):
+    """
+    Compare how long checking the weather is held up by posting tweets right away against queueing them in the outbox.
+    Each tweet takes --post-latency seconds to post, the time it takes Twitter to answer.
+    :type options: argparse.Namespace
+    :return: list of dicts, one posting right away and one queueing
+    """
+    location = models.WeatherLocation(45.585, -95.91, 'Morris, MN')
+    account = clients.Account('key', 'secret', 'token', 'token secret')
+    rows = []
+    for queued in (False, True):
+        api = SlowTwitterAPI(options.post_latency)
+        queue = None
+        if queued:
+            queue = outbox.Outbox(api.send, clients.is_retryable_error)
+            queue.start()
+        with mock.patch('weatherBot.get_tweepy_api', return_value=api), mock.patch('weatherBot.OUTBOX', queue), \
+                mock.patch('clients.env_account', return_value=account):
+            start = time.perf_counter()
+            for i in range(options.queued):
+                weatherBot.queue_tweet('benchmark {0}'.format(i), location, True, False, hashtag='#benchmark')
+            blocked = time.perf_counter() - start
+            while api.posted < options.queued:
+                time.sleep(0.001)
+            elapsed = time.perf_counter() - start
+        if queued:
+            queue.close()
+        rows.append({
+            'queued': queued,
+            'tweets': options.queued,
+            'blocked_ms': blocked * 1000,
+            'blocked_per_tweet_ms': blocked * 1000 / options.queued,
+            'posted_after_s': elapsed
+        })
+    return rows
+
+
+def time_call(call, number, repeat):
+    """
+    :type call: function
+    :type number: int
+    :param number: calls in each run
+    :type repeat: int
+    :param repeat: runs
+    :return: float, nanoseconds per call in the fastest run, which is the least disturbed by anything else running
+    """
+    return min(timeit.Timer(call).repeat(repeat=repeat, number=number)) / number * 1000000000
+
+
+def bench_stages(options):
+    """
+    Time each stage a location goes through every cycle on its own: decoding each fixture, building the WeatherData,
+    setting the weather, picking the special, normal, and forecast strings, and tweet_logic with posting mocked out.
+    Saving and loading the pickled cache, and flushing a changed throttle to the state database, are timed too. Each
+    stage runs options.stage_calls times in each of options.repeat runs. Compare the results between commits with
+    --json and --compare.
+    :type options: argparse.Namespace
+    :return: list of dicts, one for each stage
+    """
+    # pylint: disable=too-many-locals
+    number = options.stage_calls
+    rows = []
+
+    def add(stage, call):
+        rows.append({'stage': stage, 'calls': number, 'ns_per_op': time_call(call, number, options.repeat)})
+
+    texts = {}
+    for name in FIXTURES:
+        with open(os.path.join('fixtures', name), 'r', encoding='utf-8') as file_stream:
+            texts[name] = file_stream.read()
+        add('json_decode ' + name, functools.partial(json.loads, texts[name]))
+    data = json.loads(texts['us_alert.json'])
+    location = models.WeatherLocation(lat=45.585, lng=-95.91, name='Morris, MN')
+    add('weather_data', functools.partial(models.WeatherData, data, location))
+    wb_string = models.WeatherBotString(load_strings())
+    # every call gets a new WeatherData, so reading its fields the first time is counted like in a cycle
+    fresh = iter([models.WeatherData(data, location) for _ in range(number * options.repeat)])
+    add('set_weather', lambda: wb_string.set_weather(next(fresh)))
+    weather_data = models.WeatherData(data, location)
+    wb_string.set_weather(weather_data)
+    add('special', wb_string.special)
+    add('normal', wb_string.normal)
+    add('forecast', wb_string.forecast)
+    now = pytz.utc.localize(datetime.utcnow())
+    throttles = state.Throttles({'default': now})
+    with mock.patch('weatherBot.queue_tweet'):
+        # the first call tweets the alerts, later calls find them throttled like most cycles do
+        weatherBot.tweet_logic(weather_data, wb_string, weatherBot.default_location_settings(), throttles)
+        add('tweet_logic', functools.partial(weatherBot.tweet_logic, weather_data, wb_string,
+                                             weatherBot.default_location_settings(), throttles))
+    old_cache = make_throttles(options.cache_entries, 10, now)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, '.wbcache.p')
+        add('set_cache', functools.partial(weatherBot.set_cache, old_cache, path))
+        add('get_cache', functools.partial(weatherBot.get_cache, path))
+        store = state.StateStore(os.path.join(directory, '.wbstate.db'))
+        store.import_cache(old_cache)
+        flushed = store.throttles('location-0')
+
+        def flush():
+            flushed.conditions['default'] = pytz.utc.localize(datetime.utcnow())
+            store.flush()
+
+        add('state_flush', flush)
+        store.close()
+    return rows
+
+
+# directory of weatherBot, where the interpreters started by the startup benchmark import it from
+HERE = os.path.dirname(os.path.abspath(__file__))
+# run in a new interpreter, prints the seconds from before the first import until the first cycle was handled
+FIRST_CYCLE = """
+import time
+start = time.perf_counter()
+import replay
+replay.replay({conf!r}, replay.load_responses([{fixture!r}]), days=1 / 1440, locations=1)
+print(time.perf_counter() - start)
+"""
+
+
+def import_times(module):
+    """
+    Import a module in a new interpreter with python -X importtime
+    :type module: str
+    :return: tuple of the microseconds the import took, and a dict of the microseconds each module it imported
+             directly took, including everything they imported
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True, cwd=HERE)
+    children = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0 and name.strip() == module:
+            return int(cumulative), children
+        if depth == 0:
+            # the modules imported before this one, like site, are not counted
+            children = {}
+        elif depth == 1:
+            children[name.strip()] = int(cumulative)
+    raise ValueError('{0} was not imported'.format(module))
+
+
+def bench_startup(options):
+    """
+    Time cold starts in a new interpreter each run: importing weatherBot and replay measured with python -X importtime,
+    the modules weatherBot imports that take the longest, and the time until a replay of one location has handled its
+    first cycle, which includes the imports, loading the conf and strings, and the first poll. Each is the fastest of
+    options.repeat runs.
+    :type options: argparse.Namespace
+    :return: list of dicts, one for each stage
+    """
+    rows = []
+    for module in ('weatherBot', 'replay'):
+        runs = [import_times(module) for _ in range(options.repeat)]
+        rows.append({'stage': 'import ' + module, 'runs': options.repeat,
+                     'ns_per_op': min(total for total, _ in runs) * 1000})
+        if module == 'weatherBot':
+            children = {name: min(imported[name] for _, imported in runs if name in imported) * 1000
+                        for name in runs[0][1]}
+            for name in sorted(children, key=children.get, reverse=True)[:options.top]:
+                rows.append({'stage': 'weatherBot imports ' + name, 'runs': options.repeat,
+                             'ns_per_op': children[name]})
+    code = FIRST_CYCLE.format(conf=os.path.abspath(options.conf), fixture=os.path.join(HERE, 'fixtures', 'us.json'))
+    seconds = min(float(subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True,
+                                       check=True, cwd=HERE).stdout.split()[-1])
+                  for _ in range(options.repeat))
+    rows.append({'stage': 'first cycle', 'runs': options.repeat, 'ns_per_op': seconds * 1000000000})
+    return rows
+
+
+def bench_strings(options):
+    """
+    Time loading strings.yml: parsing it with PyYAML and checking every template, which is done when it changed,
+    against reading its snapshot, which is done every other start. Building a WeatherBotString, once for each location,
+    is timed with the tables copied like copy.deepcopy did and like models.copy_tables does now.
+    :type options: argparse.Namespace
+    :return: list of dicts, one for each stage
+    """
+    number = max(1, options.stage_calls // 100)
+    rows = []
+
+    def add(stage, call, calls=number):
+        rows.append({'stage': stage, 'calls': calls, 'ns_per_op': time_call(call, calls, options.repeat)})
+
+    with open('strings.yml', 'rb') as file_stream:
+        data = file_stream.read()
+    add('yaml parse', functools.partial(models.parse_strings, data))
+    tables = models.parse_strings(data)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'strings.snapshot')
+        snapshot.write_snapshot(path, snapshot.snapshot_key(data), tables)
+        add('snapshot load', functools.partial(snapshot.load, 'strings.yml', path, models.parse_strings))
+    add('deepcopy tables', functools.partial(copy.deepcopy, tables), options.stage_calls)
+    add('copy_tables', functools.partial(models.copy_tables, tables), options.stage_calls)
+    add('WeatherBotString', functools.partial(models.WeatherBotString, tables), options.stage_calls)
+    return rows
+
+
+def git_commit():
+    """
+    :return: str, short hash of the commit the benchmarks run on, or None if it is not a git checkout
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(baseline, results, threshold):
+    """
+    Compare every row timed in nanoseconds per operation against the row with the same label in a baseline run. A row
+    is labelled by its first column, like the stage.
+    :type baseline: dict
+    :param baseline: results of an earlier run, as written with --json
+    :type results: dict
+    :param results: results of this run, in the same layout
+    :type threshold: float
+    :param threshold: percent slower than the baseline that counts as a regression
+    :return: list of dicts, one for each row found in both runs
+    """
+    rows = []
+    for name, current_rows in results['benchmarks'].items():
+        before = {next(iter(row.values())): row for row in baseline['benchmarks'].get(name, [])
+                  if 'ns_per_op' in row}
+        for row in current_rows:
+            label = next(iter(row.values()))
+            if 'ns_per_op' not in row or label not in before:
+                continue
+            old, new = before[label]['ns_per_op'], row['ns_per_op']
+            delta = (new - old) / old * 100 if old else 0.0
+            rows.append({
+                'benchmark': name,
+                'row': label,
+                'baseline_ns': old,
+                'current_ns': new,
+                'delta_pct': delta,
+                'regressed': delta > threshold
+            })
+    return rows
+
+
+BENCHMARKS = {
+    'classify_batch': bench_classify_batch,
+    'darksky_fetch': bench_darksky_fetch,
+    'fan_out': bench_fan_out,
+    'fire_times': bench_fire_times,
+    'memory': bench_memory,
+    'nowcast': bench_nowcast,
+    'outbox': bench_outbox,
+    'render': bench_render,
+    'stages': bench_stages,
+    'startup': bench_startup,
+    'state': bench_state,
+    'strings': bench_strings,
+    'templates': bench_templates,
+    'throttle_expiry': bench_throttle_expiry,
+    'tweet_reuse': bench_tweet_reuse,
+    'utils': bench_utils
+}
+
+
+def print_rows(name, rows):
+    """
+    Print benchmark results as a plain text table
+    :type name: str
+    :type rows: list
+    :param rows: list of dicts sharing the same keys
+    """
+    print(name)
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    print('  '.join('{0:>18}'.format(column) for column in columns))
+    for row in rows:
+        cells = []
+        for column in columns:
+            value = row[column]
+            cells.append('{0:>18.4f}'.format(value) if isinstance(value, float) else '{0:>18}'.format(str(value)))
+        print('  '.join(cells))
+    print()
+
+
+def main():
+    """
+    Run the benchmarks given on the command line, or all of them if none are given.
+    """
+    parser = argparse.ArgumentParser(description='weatherBot benchmarks')
+    parser.add_argument('names', metavar='name', nargs='*',
+                        help='benchmarks to run: ' + ', '.join(sorted(BENCHMARKS)))
+    parser.add_argument('--conf', default='weatherBot.conf', help='configuration file to benchmark with')
+    parser.add_argument('--workers', type=int, default=0, help='size of the worker pool, defaults to the conf file')
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated seconds per Dark Sky request')
+    parser.add_argument('--locations', type=int, nargs='+', default=[1, 10, 50, 100, 250, 500],
+                        help='numbers of locations to benchmark')
+    parser.add_argument('--fetches', type=int, default=500, help='forecasts to fetch from the stand-in Dark Sky server')
+    parser.add_argument('--tweets', type=int, default=500, help='tweets to post to the stand-in Twitter server')
+    parser.add_argument('--entries', type=int, default=10000, help='throttles stored for the state benchmark')
+    parser.add_argument('--state-locations', type=int, default=100, help='locations the throttles are spread across')
+    parser.add_argument('--changes', type=int, default=2, help='throttles changed each cycle')
+    parser.add_argument('--cycles', type=int, default=100, help='cycles to run for the state and throttle benchmarks')
+    parser.add_argument('--objects', type=int, default=1000, help='live weather data objects for the memory benchmark')
+    parser.add_argument('--renders', type=int, default=1000, help='times to render every template')
+    parser.add_argument('--batch', type=int, default=10000, help='locations for the batch classify benchmark')
+    parser.add_argument('--lookups', type=int, default=100000, help='inputs for each helper in the utils benchmark')
+    parser.add_argument('--schedule-locations', type=int, default=100,
+                        help='locations for the fire times benchmark')
+    parser.add_argument('--days', type=int, default=60, help='days of scheduled tweets for the fire times benchmark')
+    parser.add_argument('--nowcasts', type=int, default=500, help='locations for the nowcast benchmark')
+    parser.add_argument('--queued', type=int, default=20, help='tweets to post for the outbox benchmark')
+    parser.add_argument('--post-latency', type=float, default=0.1, help='simulated seconds to post each tweet')
+    parser.add_argument('--throttles', type=int, default=100000, help='throttles for the throttle expiry benchmark')
+    parser.add_argument('--stage-calls', type=int, default=1000, help='calls of each stage in each run')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each stage, the fastest is kept')
+    parser.add_argument('--top', type=int, default=5, help='slowest imports of weatherBot shown by the startup '
+                                                          'benchmark')
+    parser.add_argument('--cache-entries', type=int, default=100, help='throttles in the cache for the stages')
+    parser.add_argument('--json', metavar='PATH', help='also write the results to a JSON file')
+    parser.add_argument('--compare', metavar='PATH', help='compare the results to a JSON file written with --json, '
+                                                          'exiting with 1 if any stage regressed')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent slower than the compared results that counts as a regression')
+    options = parser.parse_args()
+    unknown = set(options.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks: ' + ', '.join(sorted(unknown)))
+    weatherBot.load_config(os.path.abspath(options.conf))
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'benchmarks': {}
+    }
+    for name in options.names or sorted(BENCHMARKS):
+        results['benchmarks'][name] = BENCHMARKS[name](options)
+        print_rows(name, results['benchmarks'][name])
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as file_stream:
+            json.dump(results, file_stream, indent=2)
+    if options.compare:
+        with open(options.compare, 'r', encoding='utf-8') as file_stream:
+            baseline = json.load(file_stream)
+        compared = compare_results(baseline, results, options.threshold)
+        print_rows('compared to {0}'.format(baseline.get('commit') or options.compare), compared)
+        if any(row['regressed'] for row in compared):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
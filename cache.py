@@ -0,0 +1,167 @@
+"""
+weatherBot cache
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    """
+    A fetch in progress that other callers for the same key wait on
+    """
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ForecastCache:
+    """
+    Cache of forecasts keyed by coordinates rounded to a number of decimal places, units, and language, so locations
+    that are close to each other share a single fetch. Entries are kept for ttl seconds, and the least recently used
+    entry is evicted once there are more than size entries. Concurrent callers for the same key wait on one fetch
+    instead of each making their own, and are counted as merged as well as hits. A ttl of 0 disables caching, but
+    concurrent callers are still merged. Merging can be turned off when fetches never run at the same time, such as in
+    a replay, to skip its bookkeeping.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, ttl=60, precision=3, size=1000, clock=time.monotonic, merge=True):
+        """
+        :type ttl: float
+        :param ttl: seconds an entry is kept for
+        :type precision: int
+        :param precision: decimal places coordinates are rounded to, 3 is about 100 meters of latitude
+        :type size: int
+        :param size: most entries kept at once
+        :type clock: function
+        :param clock: returns the current time in seconds
+        :type merge: bool
+        :param merge: whether concurrent callers for the same key wait on one fetch
+        """
+        # pylint: disable=too-many-arguments
+        self.ttl = ttl
+        self.precision = precision
+        self.size = size
+        self.clock = clock
+        self.merge = merge
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.merged = 0
+        self.__entries = OrderedDict()
+        self.__flights = {}
+        self.__lock = threading.Lock()
+
+    def key(self, lat, lng, units, lang):
+        """
+        :type lat: float
+        :type lng: float
+        :type units: str
+        :type lang: str
+        :return: tuple used as the cache key
+        """
+        return round(lat, self.precision), round(lng, self.precision), units, lang
+
+    def get(self, lat, lng, units, lang, fetch):
+        """
+        Return the cached forecast for the key, or call fetch to get it. If fetch returns None, nothing is cached.
+        Any exception raised by fetch is raised for every caller waiting on it.
+        :type lat: float
+        :type lng: float
+        :type units: str
+        :type lang: str
+        :type fetch: function
+        :param fetch: takes no arguments and returns a forecast
+        :return: the forecast, or None
+        """
+        # pylint: disable=too-many-arguments
+        key = self.key(lat, lng, units, lang)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            flight = None
+            leader = True
+            if self.merge:
+                flight = self.__flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.__flights[key] = _Flight()
+            if leader:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.merged += 1
+        if flight is None:
+            value = fetch()
+            with self.__lock:
+                self.__store(key, value)
+            return value
+        if leader:
+            return self.__fetch(key, flight, fetch)
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def __fetch(self, key, flight, fetch):
+        """
+        Call fetch for the key, store the result, and wake up every caller waiting on the flight
+        """
+        try:
+            flight.value = fetch()
+            return flight.value
+        except Exception as err:
+            flight.error = err
+            raise
+        finally:
+            with self.__lock:
+                del self.__flights[key]
+                self.__store(key, flight.value)
+            flight.done.set()
+
+    def __store(self, key, value):
+        """
+        Keep a fetched forecast for ttl seconds, evicting the least recently used entries over size. Called with the
+        lock held.
+        """
+        if value is not None and self.ttl > 0:
+            self.__entries[key] = (self.clock() + self.ttl, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.size:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove every entry
+        """
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__entries)
+
+    def stats(self):
+        """
+        :return: dict of counters and the number of entries
+        """
+        with self.__lock:
+            return {
+                'entries': len(self.__entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'merged': self.merged
+            }
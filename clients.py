@@ -0,0 +1,262 @@
+"""
+weatherBot clients
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import lazy
+
+# only imported once a client talks to Twitter or Dark Sky, the adapters subclass requests classes
+adapters = lazy.lazy_import('adapters')
+forecastio = lazy.lazy_import('forecastio')
+requests = lazy.lazy_import('requests')
+tweepy = lazy.lazy_import('tweepy')
+
+Account = namedtuple('Account', ['consumer_key', 'consumer_secret', 'access_token', 'access_token_secret'])
+FetchStats = namedtuple('FetchStats', ['wire_bytes', 'json_bytes', 'seconds'])
+
+# Twitter error codes for bad or expired credentials
+AUTH_ERROR_CODES = (32, 89, 215)
+# Twitter error codes for rate limits, over capacity, internal errors, and the daily status limit
+RETRYABLE_ERROR_CODES = (88, 130, 131, 185)
+
+
+def env_account():
+    """
+    Return the Twitter account using the keys/tokens/secrets in the environmental variables
+    :return: Account namedtuple
+    """
+    return Account(consumer_key=os.getenv('WEATHERBOT_CONSUMER_KEY'),
+                   consumer_secret=os.getenv('WEATHERBOT_CONSUMER_SECRET'),
+                   access_token=os.getenv('WEATHERBOT_ACCESS_TOKEN'),
+                   access_token_secret=os.getenv('WEATHERBOT_ACCESS_TOKEN_SECRET'))
+
+
+def account_id(account):
+    """
+    :type account: Account
+    :return: str, id of the account that is safe to save and log, a hash of its access token
+    """
+    return hashlib.sha256((account.access_token or '').encode('utf-8')).hexdigest()[:16]
+
+
+def is_connection_error(err):
+    """
+    :type err: tweepy.TweepError
+    :return: bool, True if the request never got a response from Twitter
+    """
+    return err.response is None and str(err.reason).startswith('Failed to send request')
+
+
+def is_auth_error(err):
+    """
+    :type err: tweepy.TweepError
+    :return: bool, True if Twitter rejected the credentials used for the request
+    """
+    if err.api_code in AUTH_ERROR_CODES:
+        return True
+    return err.response is not None and err.response.status_code == 401
+
+
+def is_retryable_error(err):
+    """
+    :type err: Exception
+    :return: bool, True if a tweet that failed with err may succeed if it is sent again later
+    """
+    if not isinstance(err, tweepy.TweepError):
+        return False
+    if is_connection_error(err) or err.api_code in RETRYABLE_ERROR_CODES:
+        return True
+    return err.response is not None and (err.response.status_code == 429 or err.response.status_code >= 500)
+
+
+class TwitterClients:
+    """
+    Registry of long lived tweepy.API objects, one per account. Every account shares a single pool of keep-alive
+    connections to Twitter. An account's API is only rebuilt after an auth error, and the pool is only reset after a
+    connection error. Since tweepy has no per-API session hook, only one registry should be used at a time.
+    """
+
+    def __init__(self, adapter=None):
+        """
+        :type adapter: adapters.KeepAliveAdapter
+        :param adapter: adapter holding the connection pool, one is created on first use if not given
+        """
+        self.__adapter = adapter
+        self.builds = 0
+        self.__apis = {}
+        self.__lock = threading.Lock()
+        self.__installed = False
+
+    @property
+    def adapter(self):
+        """
+        :return: the adapter holding the connection pool, created on first use
+        """
+        if self.__adapter is None:
+            self.__adapter = adapters.KeepAliveAdapter()
+        return self.__adapter
+
+    def get(self, account):
+        """
+        Return the tweepy.API for the account, building it on first use
+        :type account: Account
+        :return: tweepy.API
+        """
+        with self.__lock:
+            if not self.__installed:
+                adapters.install_adapter(self.adapter)
+                self.__installed = True
+            api = self.__apis.get(account)
+            if api is None:
+                auth = tweepy.OAuthHandler(account.consumer_key, account.consumer_secret)
+                auth.set_access_token(account.access_token, account.access_token_secret)
+                api = tweepy.API(auth)
+                self.__apis[account] = api
+                self.builds += 1
+            return api
+
+    def report_error(self, account, err):
+        """
+        Drop the account's API after an auth error, or reset the connection pool after a connection error, so the
+        next call starts fresh. Any other error leaves everything in place.
+        :type account: Account
+        :type err: tweepy.TweepError
+        """
+        if is_auth_error(err):
+            with self.__lock:
+                self.__apis.pop(account, None)
+        elif is_connection_error(err):
+            with self.__lock:
+                self.__apis.pop(account, None)
+            if isinstance(self.adapter, adapters.KeepAliveAdapter):
+                self.adapter.reset()
+
+    def close(self):
+        """
+        Forget every API and close all pooled connections
+        """
+        with self.__lock:
+            self.__apis.clear()
+        if self.__adapter is None:
+            return
+        if isinstance(self.__adapter, adapters.KeepAliveAdapter):
+            self.__adapter.reset()
+        else:
+            self.__adapter.close()
+
+
+class DarkSkyClient:
+    """
+    Fetches forecasts from the Dark Sky API over one persistent session with a pool of keep-alive connections.
+    Responses are requested gzipped, and blocks that are not needed can be excluded to shrink each payload.
+    The size and latency of every fetch is recorded.
+    """
+    # pylint: disable=too-many-instance-attributes
+    base_url = 'https://api.darksky.net/forecast/'
+
+    def __init__(self, base_url=None, pool_size=10, timeout=30):
+        """
+        :type base_url: str
+        :param base_url: URL up to the key, defaults to the Dark Sky API
+        :type pool_size: int
+        :param pool_size: most connections kept alive at once, should match the number of workers
+        :type timeout: float
+        :param timeout: seconds to wait for a response
+        """
+        if base_url is not None:
+            self.base_url = base_url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.__session = None
+        self.fetches = 0
+        self.wire_bytes = 0
+        self.json_bytes = 0
+        self.seconds = 0.0
+        self.__lock = threading.Lock()
+
+    @property
+    def session(self):
+        """
+        :return: requests.Session asking for gzip, with a pool of pool_size connections to base_url, created on first
+                 use
+        """
+        with self.__lock:
+            if self.__session is None:
+                session = requests.Session()
+                session.headers['Accept-Encoding'] = 'gzip'
+                session.mount(self.base_url, requests.adapters.HTTPAdapter(pool_connections=1,
+                                                                           pool_maxsize=self.pool_size))
+                self.__session = session
+            return self.__session
+
+    def load_forecast(self, key, lat, lng, units='us', lang='en', exclude=None):
+        """
+        Fetch the forecast at the given location. Raises requests exceptions like forecastio.load_forecast.
+        :type key: str
+        :param key: Dark Sky API key
+        :type lat: float
+        :type lng: float
+        :type units: str
+        :param units: units standard, ex 'us', 'ca', 'uk2', 'si', 'auto'
+        :type lang: str
+        :param lang: language, ex: 'en', 'de'
+        :type exclude: list
+        :param exclude: blocks to leave out of the response, ex: ['hourly', 'minutely']
+        :return: forecastio.models.Forecast
+        """
+        # pylint: disable=too-many-arguments
+        params = {'units': units, 'lang': lang}
+        if exclude:
+            params['exclude'] = ','.join(exclude)
+        url = '{base}{key}/{lat},{lng}'.format(base=self.base_url, key=key, lat=lat, lng=lng)
+        start = time.perf_counter()
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        stats = FetchStats(wire_bytes=response.raw.tell(), json_bytes=len(response.content),
+                           seconds=time.perf_counter() - start)
+        self.record(stats)
+        logging.debug('Fetched forecast for %s,%s: %d bytes (%d decoded) in %.3fs', lat, lng, stats.wire_bytes,
+                      stats.json_bytes, stats.seconds)
+        return forecastio.models.Forecast(data, response, response.headers)
+
+    def record(self, stats):
+        """
+        Add the stats of a fetch to the running totals
+        :type stats: FetchStats
+        """
+        with self.__lock:
+            self.fetches += 1
+            self.wire_bytes += stats.wire_bytes
+            self.json_bytes += stats.json_bytes
+            self.seconds += stats.seconds
+
+    def stats(self):
+        """
+        :return: dict with the number of fetches, and the mean bytes and latency per fetch
+        """
+        with self.__lock:
+            fetches = max(self.fetches, 1)
+            return {
+                'fetches': self.fetches,
+                'wire_bytes_per_fetch': self.wire_bytes / fetches,
+                'json_bytes_per_fetch': self.json_bytes / fetches,
+                'seconds_per_fetch': self.seconds / fetches
+            }
+
+    def close(self):
+        """
+        Close all pooled connections
+        """
+        with self.__lock:
+            if self.__session is not None:
+                self.__session.close()
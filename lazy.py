@@ -0,0 +1,57 @@
+"""
+weatherBot lazy
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is imported the first time one of its attributes is used. Every attribute is read from
+    the real module, so anything that patches the real module, like a test, is seen through the stand-in. The import
+    is done under a lock, so worker threads that use the module for the first time at once import it only once.
+    """
+
+    def __init__(self, name):
+        """
+        :type name: str
+        :param name: name of the module to import, ex: 'tweepy'
+        """
+        super().__init__(name)
+        self.__module = None
+        self.__lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        module = self.__module
+        if module is None:
+            with self.__lock:
+                if self.__module is None:
+                    self.__module = importlib.import_module(self.__name__)
+                module = self.__module
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return '<lazy module {0!r}>'.format(self.__name__)
+
+
+def lazy_import(name):
+    """
+    Import a module the first time it is used instead of right away, so code that never uses it does not pay for
+    importing it. A module that was already imported is returned as is.
+    :type name: str
+    :param name: name of the module, ex: 'numpy' or 'http.server'
+    :return: the module, a LazyModule, or None if the module is not installed
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if importlib.util.find_spec(name) is None:
+        return None
+    return LazyModule(name)
@@ -0,0 +1,148 @@
+"""
+weatherBot logs
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime
+from datetime import timezone
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats each record as one line of JSON, so the log can be read by tools that ingest JSON lines
+    """
+
+    def format(self, record):
+        """
+        :type record: logging.LogRecord
+        :return: str, JSON object with the time in UTC, level, logger, thread, and message of the record, and its
+                 traceback if it has one. Records from a RecordQueueHandler carry the traceback as exc_text.
+        """
+        line = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line['exc_info'] = record.exc_text
+        return json.dumps(line, ensure_ascii=False)
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that keeps the traceback of a record apart from its message. QueueHandler.prepare folds the
+    traceback into the message, so a JSONFormatter could not write it on its own. The traceback is formatted into
+    exc_text instead, which every Formatter adds after the message.
+    """
+
+    def prepare(self, record):
+        """
+        :type record: logging.LogRecord
+        :return: logging.LogRecord, a copy with its message merged with its arguments, and the traceback in
+                 exc_text, so nothing that may change or can not be pickled is queued
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class BackgroundLogger:
+    """
+    Writes log records on a background thread. The logger only gets a QueueHandler, which puts each record on a queue
+    instead of writing it, so a slow disk or console never holds up whoever logged. A QueueListener takes the records
+    off the queue and hands them to the real handlers, each filtering by its own level.
+    """
+
+    def __init__(self, handlers, logger=None):
+        """
+        :type handlers: list
+        :param handlers: logging.Handler objects that write the records
+        :type logger: logging.Logger
+        :param logger: logger to take the records from, defaults to the root logger
+        """
+        self.handlers = handlers
+        self.logger = logger if logger is not None else logging.getLogger()
+        # queue.SimpleQueue is only in Python 3.7+
+        self.queue = queue.Queue()
+        self.handler = RecordQueueHandler(self.queue)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+
+    def start(self):
+        """
+        Start the background thread, then send the logger's records to it
+        """
+        self.listener.start()
+        self.logger.addHandler(self.handler)
+
+    def stop(self):
+        """
+        Stop sending the logger's records to the background thread, then wait for it to write every queued record
+        and close the handlers
+        """
+        self.logger.removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
+
+
+def initialize_logger(log_enabled, log_pathname, level='debug', max_bytes=10485760, backups=5, json_path=None):
+    """
+    Initialize and start the logger. Logs to console, and if enabled, to a file at the given path that is rotated
+    once it reaches max_bytes. Records are written on a background thread, so logging never waits on the disk.
+    The logger's level is the lowest level any handler writes, so debug records that nothing writes are never built.
+    :type log_enabled: bool
+    :param log_enabled: whether or not to write a log file
+    :type log_pathname: str
+    :param log_pathname: full path of where to write the log
+    :type level: str
+    :param level: lowest level written to the console, ex: 'debug', 'info', 'warning'
+    :type max_bytes: int
+    :param max_bytes: size the log files are rotated at, 0 to never rotate them
+    :type backups: int
+    :param backups: rotated log files kept, ex: weatherBot.log.1
+    :type json_path: str
+    :param json_path: full path of a log file with one JSON object per line, or None to not write one
+    :return: logs.BackgroundLogger, stop it to write every queued record before exiting
+    """
+    # pylint: disable=too-many-arguments
+    formatter = logging.Formatter('%(asctime)s %(levelname)-8s %(message)s')
+    # Console handler
+    console = logging.StreamHandler()
+    console.setLevel(level.upper())
+    console.setFormatter(formatter)
+    handlers = [console]
+    # Log file handlers
+    if log_enabled:
+        log = logging.handlers.RotatingFileHandler(log_pathname, 'a', maxBytes=max_bytes, backupCount=backups,
+                                                   encoding='utf-8')
+        log.setLevel(logging.INFO)
+        log.setFormatter(formatter)
+        handlers.append(log)
+    if json_path:
+        json_log = logging.handlers.RotatingFileHandler(json_path, 'a', maxBytes=max_bytes, backupCount=backups,
+                                                        encoding='utf-8')
+        json_log.setLevel(logging.INFO)
+        json_log.setFormatter(JSONFormatter())
+        handlers.append(json_log)
+    logger = logging.getLogger()
+    logger.setLevel(min(handler.level for handler in handlers))
+    writer = BackgroundLogger(handlers, logger)
+    writer.start()
+    logger.info('Starting weatherBot with Python %s', sys.version)
+    return writer
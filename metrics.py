@@ -0,0 +1,352 @@
+"""
+weatherBot metrics
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+import lazy
+
+# only imported when the server is started
+http_server = lazy.lazy_import('http.server')
+socketserver = lazy.lazy_import('socketserver')
+
+# upper bounds of the buckets of histograms of seconds
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# upper bounds of the buckets of histograms of bytes
+BYTES_BUCKETS = (1024, 4096, 16384, 32768, 65536, 131072, 262144, 1048576)
+# every metric weatherBot records, see Registry
+DEFINITIONS = [
+    ('weatherbot_cycle_seconds', 'histogram', 'Seconds to handle the events that were due at the same time.'),
+    ('weatherbot_forecast_seconds', 'histogram',
+     'Seconds to get the forecast of a location, from Dark Sky or the forecast cache.'),
+    ('weatherbot_forecast_errors_total', 'counter', 'Forecasts of a location that could not be fetched.'),
+    ('weatherbot_payload_bytes', 'histogram', 'Bytes of each response fetched from Dark Sky for a location.',
+     BYTES_BUCKETS),
+    ('weatherbot_parse_seconds', 'histogram', 'Seconds to build the weather data of a location from its forecast.'),
+    ('weatherbot_render_seconds', 'histogram', 'Seconds to set the weather and pick the text of a location.'),
+    ('weatherbot_tweet_seconds', 'histogram', 'Seconds to post a tweet of a location to Twitter, by outcome.'),
+    ('weatherbot_throttles', 'gauge', 'Throttles and tweeted alerts kept for a location.'),
+    ('weatherbot_state_flush_seconds', 'histogram', 'Seconds to save the throttles changed in a cycle.'),
+    ('weatherbot_darksky_fetches_total', 'counter', 'Forecasts fetched from Dark Sky.'),
+    ('weatherbot_forecast_cache_entries', 'gauge', 'Forecasts kept in the forecast cache.'),
+    ('weatherbot_forecast_cache_hits_total', 'counter', 'Forecasts found in the forecast cache.'),
+    ('weatherbot_forecast_cache_misses_total', 'counter', 'Forecasts not found in the forecast cache.'),
+    ('weatherbot_forecast_fetches_merged_total', 'counter',
+     'Forecasts that waited on a fetch already in flight for the same coordinates, units, and language.'),
+    ('weatherbot_outbox_depth', 'gauge', 'Tweets waiting in the tweet queue.'),
+    ('weatherbot_reloads_total', 'counter', 'Reloads of the conf and strings files, by outcome.'),
+    ('weatherbot_poll_interval_minutes', 'gauge', 'Minutes until a location is polled again.'),
+    ('weatherbot_polls_saved', 'gauge', 'Polls adaptive polling saved against polling every refresh.'),
+    ('weatherbot_darksky_budget_remaining', 'gauge', 'Dark Sky calls left today in the adaptive polling budget.')
+]
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(labels):
+    """
+    :type labels: tuple
+    :param labels: (name, value) pairs
+    :return: str, the labels in the text format, ex: '{location="default"}', or '' without labels
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                              .replace('\n', '\\n'))
+                          for name, value in labels) + '}'
+
+
+def format_value(value):
+    """
+    :type value: float
+    :return: str, the value in the text format
+    """
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    A counter, gauge, or histogram with a sample for each set of labels it was given
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, name, kind, help_text, buckets=SECONDS_BUCKETS):
+        """
+        :type name: str
+        :type kind: str
+        :param kind: 'counter', 'gauge', or 'histogram'
+        :type help_text: str
+        :type buckets: tuple
+        :param buckets: sorted upper bounds of the buckets, only used by histograms
+        """
+        if kind not in ('counter', 'gauge', 'histogram'):
+            raise ValueError('unknown metric type: ' + kind)
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # labels to a value, or for histograms to [count in each bucket, sum, count]
+        self.samples = {}
+
+    def lines(self):
+        """
+        :return: list of str, the metric in the text format
+        """
+        lines = ['# HELP {0} {1}'.format(self.name, self.help_text), '# TYPE {0} {1}'.format(self.name, self.kind)]
+        for labels, sample in self.samples.items():
+            if self.kind != 'histogram':
+                lines.append('{0}{1} {2}'.format(self.name, format_labels(labels), format_value(sample)))
+                continue
+            counts, total, count = sample
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels(labels + (('le', format_value(bound)),))
+                lines.append('{0}_bucket{1} {2}'.format(self.name, bucket_labels, cumulative))
+            lines.append('{0}_sum{1} {2}'.format(self.name, format_labels(labels), format_value(total)))
+            lines.append('{0}_count{1} {2}'.format(self.name, format_labels(labels), count))
+        return lines
+
+
+class Untimed:
+    """
+    What a disabled Registry.time returns, the with block is given its labels without being timed
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('labels',)
+
+    def __init__(self, labels):
+        """
+        :type labels: dict
+        """
+        self.labels = labels
+
+    def __enter__(self):
+        return self.labels
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class Registry:
+    """
+    Counters, gauges, and histograms of what weatherBot is doing, rendered in the Prometheus text format. Every metric
+    is declared up front, then updated with labels given as keyword arguments, ex:
+    registry.observe('weatherbot_parse_seconds', 0.002, location='default'). Collectors are called before rendering,
+    to set gauges from stats that are kept elsewhere. A disabled registry ignores every update, for runs where nothing
+    is scraped, such as a replay.
+    """
+
+    def __init__(self, definitions=(), enabled=True):
+        """
+        :type definitions: list
+        :param definitions: (name, kind, help text) or (name, kind, help text, buckets) of each metric
+        :type enabled: bool
+        :param enabled: whether updates are recorded
+        """
+        self.enabled = enabled
+        self.__metrics = {}
+        self.__collectors = []
+        self.__lock = threading.Lock()
+        for definition in definitions:
+            self.declare(*definition)
+
+    def declare(self, name, kind, help_text, buckets=SECONDS_BUCKETS):
+        """
+        :type name: str
+        :type kind: str
+        :param kind: 'counter', 'gauge', or 'histogram'
+        :type help_text: str
+        :type buckets: tuple
+        :param buckets: sorted upper bounds of the buckets, only used by histograms
+        """
+        with self.__lock:
+            self.__metrics[name] = Metric(name, kind, help_text, buckets)
+
+    def add_collector(self, collect):
+        """
+        :type collect: function
+        :param collect: called with the registry before every render
+        """
+        with self.__lock:
+            self.__collectors.append(collect)
+
+    def inc(self, name, value=1, **labels):
+        """
+        Add to a counter
+        :type name: str
+        :type value: float
+        """
+        if not self.enabled:
+            return
+        key = tuple(labels.items())
+        with self.__lock:
+            samples = self.__metrics[name].samples
+            samples[key] = samples.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """
+        Set a gauge, or a counter kept elsewhere
+        :type name: str
+        :type value: float
+        """
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.__metrics[name].samples[tuple(labels.items())] = value
+
+    def observe(self, name, value, **labels):
+        """
+        Count a value in a histogram
+        :type name: str
+        :type value: float
+        """
+        if not self.enabled:
+            return
+        key = tuple(labels.items())
+        with self.__lock:
+            metric = self.__metrics[name]
+            sample = metric.samples.get(key)
+            if sample is None:
+                sample = metric.samples[key] = [[0] * (len(metric.buckets) + 1), 0, 0]
+            sample[0][bisect.bisect_left(metric.buckets, value)] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    def time(self, name, **labels):
+        """
+        Observe the seconds the with block took in a histogram. The labels are yielded as a dict, so the block can
+        change them, ex: to the outcome of what it timed.
+        :type name: str
+        :return: context manager
+        """
+        if not self.enabled:
+            return Untimed(labels)
+        return self.__time(name, labels)
+
+    @contextlib.contextmanager
+    def __time(self, name, labels):
+        """
+        :type name: str
+        :type labels: dict
+        """
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self):
+        """
+        :return: str, every metric in the Prometheus text format
+        """
+        for collect in list(self.__collectors):
+            collect(self)
+        with self.__lock:
+            lines = []
+            for metric in self.__metrics.values():
+                lines.extend(metric.lines())
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """
+    Serves the metrics of a registry at /metrics over HTTP from a background thread
+    """
+
+    def __init__(self, registry, host='127.0.0.1', port=9187):
+        """
+        :type registry: Registry
+        :type host: str
+        :param host: address to listen on, the default only accepts local connections
+        :type port: int
+        :param port: port to listen on, 0 picks a free port
+        """
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.__server = None
+        self.__thread = None
+
+    def start(self):
+        """
+        Start listening, updating port if a free port was picked
+        """
+        registry = self.registry
+
+        class Handler(http_server.BaseHTTPRequestHandler):
+            """
+            Answers GET /metrics with the rendered registry
+            """
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """
+                Send the metrics, or a 404 for any other path
+                """
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                """
+                Log requests at debug instead of writing them to stderr
+                """
+                logging.debug('Metrics: ' + format, *args)
+
+        class Server(socketserver.ThreadingMixIn, http_server.HTTPServer):
+            """
+            Answers each request on its own thread, the same as http.server.ThreadingHTTPServer from Python 3.7
+            """
+            # pylint: disable=too-few-public-methods
+            daemon_threads = True
+
+        self.__server = Server((self.host, self.port), Handler)
+        self.port = self.__server.server_address[1]
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name='metrics', daemon=True)
+        self.__thread.start()
+        logging.info('Serving metrics at http://%s:%d/metrics', self.host, self.port)
+
+    def stop(self):
+        """
+        Stop listening and wait for the background thread to finish
+        """
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__thread.join()
+            self.__server = None
+            self.__thread = None
+
+
+def start_metrics(registry, metrics_settings, collector=None):
+    """
+    Serve the registry over HTTP in the background
+    :type registry: Registry
+    :type metrics_settings: dict
+    :param metrics_settings: CONFIG['metrics']
+    :type collector: function
+    :param collector: collector(registry) sets metrics kept elsewhere before each scrape, or None
+    :return: MetricsServer, or None if metrics are disabled
+    """
+    if not metrics_settings['enabled']:
+        return None
+    if collector is not None:
+        registry.add_collector(collector)
+    server = MetricsServer(registry, host=metrics_settings['host'], port=metrics_settings['port'])
+    server.start()
+    return server
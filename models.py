@@ -5,18 +5,26 @@ Copyright 2015-2019 Brian Mitchell under the MIT license
 See the GitHub repository: https://github.com/BrianMitchL/weatherBot
 """
 
+import logging
 import random
+import sys
 from collections import namedtuple
-from copy import deepcopy
 from datetime import datetime, timedelta
 from hashlib import sha256
 
 import pytz
-from forecastio.utils import PropertyUnavailable
 
+import nowcast
+import snapshot
+import templates
 import utils
+from lazy import lazy_import
+
+# only imported when the strings are parsed, WeatherBotString takes an argument named lazy
+yaml = lazy_import('yaml')
 
 Condition = namedtuple('Condition', ['type', 'text'])
+INFINITY = float('inf')
 
 
 class BadForecastDataError(Exception):
@@ -25,6 +33,13 @@ class BadForecastDataError(Exception):
     """
 
 
+class PropertyUnavailable(AttributeError):
+    """
+    Raised when a field is missing from a data point, like forecastio.utils.PropertyUnavailable, which is also an
+    AttributeError, so forecastio does not have to be imported to read a response
+    """
+
+
 class WeatherLocation:
     """
     This is for storing a weather location. The intended use is for quickly accessing the lat, lng, and name.
@@ -55,22 +70,97 @@ class WeatherLocation:
         return self.__str__()
 
 
+class DataPoint:
+    """
+    Read only attribute access to a data point dict from the Dark Sky API, ex: point.summary. Like forecastio, time,
+    sunriseTime, and sunsetTime are naive UTC datetimes, sunriseTime and sunsetTime are None when missing, utime is
+    the UNIX time, and any other missing field raises PropertyUnavailable.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('_data',)
+    # fields converted to datetimes, the same as forecastio does
+    times = ('time', 'sunriseTime', 'sunsetTime')
+
+    def __init__(self, data):
+        """
+        :type data: dict
+        """
+        self._data = data
+
+    def __getattr__(self, name):
+        if name in self.times:
+            timestamp = self._data.get(name)
+            if timestamp is None and name == 'time':
+                raise PropertyUnavailable('Property \'time\' is not valid or is not available')
+            return None if timestamp is None else datetime.utcfromtimestamp(int(timestamp))
+        if name == 'utime':
+            name = 'time'
+        try:
+            return self._data[name]
+        except KeyError:
+            raise PropertyUnavailable('Property \'{0}\' is not valid or is not available'.format(name)) from None
+
+
+class AlertPoint(DataPoint):
+    """
+    Read only attribute access to an alert dict from the Dark Sky API. Times are left as UNIX times, like
+    forecastio.models.Alert.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ()
+    times = ()
+
+
+class DataBlock:
+    """
+    A block of data points from the Dark Sky API, such as minutely. Data points are wrapped when data is first read.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('summary', 'icon', '_data', '_points')
+
+    def __init__(self, data):
+        """
+        :type data: dict
+        """
+        self.summary = data.get('summary')
+        self.icon = data.get('icon')
+        self._data = data.get('data', [])
+        self._points = None
+
+    @property
+    def data(self):
+        """
+        :return: list of DataPoint
+        """
+        if self._points is None:
+            self._points = [DataPoint(point) for point in self._data]
+            self._data = None
+        return self._points
+
+
 class WeatherAlert:
     """
     This is for storing weather alerts. The fields are very similar to a ForecastAlert.
     """
+    __slots__ = ('title', 'time', 'expires', 'uri', 'severity', '_sha')
+
     def __init__(self, alert):
         """
-        :type alert: forecastio.models.Alert
+        :type alert: forecastio.models.Alert or dict
+        :param alert: alert object, or the alert dict from the Dark Sky API
         """
+        if isinstance(alert, dict):
+            alert = AlertPoint(alert)
         self.title = alert.title
         self.time = pytz.utc.localize(datetime.utcfromtimestamp(alert.time))
         try:
             self.expires = pytz.utc.localize(datetime.utcfromtimestamp(alert.expires))
-        except PropertyUnavailable:
+        except AttributeError:
+            # PropertyUnavailable from a dict, or from forecastio for a forecastio.models.Alert
             pass
         self.uri = alert.uri
         self.severity = alert.severity
+        self._sha = None
 
     def __str__(self):
         return '<WeatherAlert: {title} at {time}>'.format(title=self.title, time=self.time)
@@ -90,57 +180,111 @@ class WeatherAlert:
         """
         :return: sha256 of alert as a string
         """
-        full_alert = self.title + str(self.time)
-        return sha256(full_alert.encode()).hexdigest()  # a (hopefully) unique id
+        if self._sha is None:
+            full_alert = self.title + str(self.time)
+            self._sha = sha256(full_alert.encode()).hexdigest()  # a (hopefully) unique id
+        return self._sha
+
+
+def get_units(unit):
+    """
+    Shared units dict for the unit format code, every WeatherData with the same units uses the same dict.
+    :type unit: str
+    :return: read only dict containing units for weather measurements, see utils.get_units
+    """
+    return utils.get_units(unit)
+
+
+def _wind_bearing(currently):
+    # Dark Sky doesn't always include 'windBearing'
+    if 'windBearing' in currently:
+        return utils.get_wind_direction(currently['windBearing'])
+    return 'unknown direction'
+
+
+# how each field of WeatherData is read from the currently block the first time it is used
+CURRENTLY_FIELDS = {
+    'windBearing': _wind_bearing,
+    'windSpeed': lambda currently: currently['windSpeed'],
+    'apparentTemperature': lambda currently: currently['apparentTemperature'],
+    'temp': lambda currently: currently['temperature'],
+    'humidity': lambda currently: round(currently['humidity'] * 100),
+    'precipIntensity': lambda currently: currently['precipIntensity'],
+    'precipProbability': lambda currently: currently['precipProbability'],
+    'precipType': lambda currently: currently.get('precipType', 'none'),
+    'summary': lambda currently: currently['summary'],
+    'icon': lambda currently: currently['icon']
+}
 
 
 class WeatherData:
     """
-    This is for storing weather data as returned by the Dark Sky API via the python-forecastio library.
+    This is for storing weather data as returned by the Dark Sky API. It is built straight from the JSON response and
+    only keeps the blocks it uses (currently, today's forecast, alerts, minutely, and hourly), so the rest of the
+    response can be freed. minutely and hourly are only requested when the lookahead is enabled. Fields from the
+    currently block are read the first time they are used, and minutely is wrapped the first time it is used. Alerts
+    are wrapped right away, so a bad alert makes the data invalid. Any field can still be set.
     """
+    # pylint: disable=too-many-instance-attributes
+    __slots__ = ('location', 'valid', 'units', 'timezone', '_currently', '_forecast', '_alerts', '_minutely',
+                 '_hourly', '_flags') + tuple(CURRENTLY_FIELDS) + ('forecast', 'alerts', 'minutely')
 
-    # pylint: disable=too-many-instance-attributes,invalid-name,too-few-public-methods
+    # pylint: disable=invalid-name,too-few-public-methods
     def __init__(self, forecast, location):
         """
         :type location: WeatherLocation
-        :type forecast: forecastio.models.Forecast
-        """
-        self.__forecast = forecast
-
+        :type forecast: forecastio.models.Forecast or dict
+        :param forecast: forecast, or the decoded JSON response from the Dark Sky API
+        """
+        data = forecast if isinstance(forecast, dict) else forecast.json
+        self.location = location
+        self.timezone = None
+        self._flags = self._currently = self._forecast = self._minutely = self._hourly = None
+        self._alerts = []
+        self.alerts = []
         try:
-            if 'darksky-unavailable' in forecast.json['flags']:
+            flags = data['flags']
+            if 'darksky-unavailable' in flags:
                 raise BadForecastDataError('Darksky unavailable')
-            self.units = utils.get_units(forecast.json['flags']['units'])
-            # Dark Sky doesn't always include 'windBearing'
-            if hasattr(forecast.currently(), 'windBearing'):
-                self.windBearing = utils.get_wind_direction(forecast.currently().windBearing)
-            else:
-                self.windBearing = 'unknown direction'
-            self.windSpeed = forecast.currently().windSpeed
-            self.apparentTemperature = forecast.currently().apparentTemperature
-            self.temp = forecast.currently().temperature
-            self.humidity = round(forecast.currently().humidity * 100)
-            self.precipIntensity = forecast.currently().precipIntensity
-            self.precipProbability = forecast.currently().precipProbability
-            if hasattr(forecast.currently(), 'precipType'):
-                self.precipType = forecast.currently().precipType
-            else:
-                self.precipType = 'none'
-            self.summary = forecast.currently().summary
-            self.icon = forecast.currently().icon
-            self.location = location
-            self.timezone = forecast.json['timezone']
-            self.forecast = forecast.daily().data[0]
-            self.minutely = forecast.minutely()  # this will return None in many parts of the world
-            self.alerts = list()
-            for alert in forecast.alerts():
-                self.alerts.append(WeatherAlert(alert))
+            self.units = get_units(flags['units'])
+            self._flags = {'units': flags['units']}
+            self._currently = data['currently']
+            self.timezone = data['timezone']
+            self._forecast = data['daily']['data'][0]
+            # minutely is not available in many parts of the world, and may be excluded from the request
+            self._minutely = data.get('minutely')
+            self._hourly = data.get('hourly')
+            self._alerts = data.get('alerts', [])
+            # check every field now, so a bad response is caught here instead of when a field is first used
+            missing = [name for name in ('windSpeed', 'apparentTemperature', 'temperature', 'humidity',
+                                         'precipIntensity', 'precipProbability', 'summary', 'icon')
+                       if name not in self._currently]
+            if missing:
+                raise BadForecastDataError('Missing ' + ', '.join(missing))
+            # read now, a null humidity makes the response unusable
+            self.humidity = round(self._currently['humidity'] * 100)
+            self.alerts = [WeatherAlert(alert) for alert in self._alerts]
             self.valid = True
-        except (KeyError, TypeError, BadForecastDataError, PropertyUnavailable):
+        except (KeyError, IndexError, TypeError, ValueError, OverflowError, PropertyUnavailable, BadForecastDataError):
             self.valid = False
 
+    def __getattr__(self, name):
+        """
+        Read a field the first time it is used, then keep it
+        """
+        if name in CURRENTLY_FIELDS:
+            value = CURRENTLY_FIELDS[name](self._currently)
+        elif name == 'forecast':
+            value = DataPoint(self._forecast)
+        elif name == 'minutely':
+            value = None if self._minutely is None else DataBlock(self._minutely)
+        else:
+            raise AttributeError('\'WeatherData\' object has no attribute \'{0}\''.format(name))
+        setattr(self, name, value)
+        return value
+
     def __str__(self):
-        time = pytz.utc.localize(self.__forecast.currently().time)
+        time = pytz.utc.localize(datetime.utcfromtimestamp(self._currently['time']))
         return '<WeatherData: {name}({lat},{lng}) at {time}>'.format(name=self.location.name,
                                                                      lat=self.location.lat,
                                                                      lng=self.location.lng,
@@ -148,36 +292,113 @@ class WeatherData:
 
     def json(self):
         """
-        Raw JSON response from the Dark Sky API
-        :return: dict
-        """
-        return self.__forecast.json
+        The parts of the JSON response from the Dark Sky API that are kept, not the whole response. Blocks and
+        fields that are kept are the same as in the response, except that flags only has units and daily only has
+        today's data point. hourly and minutely are only included if they were in the response.
+        :return: dict with flags, timezone, currently, daily, alerts, and any minutely and hourly
+        """
+        data = {
+            'flags': self._flags,
+            'timezone': self.timezone,
+            'currently': self._currently,
+            'daily': {'data': [self._forecast]},
+            'alerts': self._alerts
+        }
+        if self._minutely is not None:
+            data['minutely'] = self._minutely
+        if self._hourly is not None:
+            data['hourly'] = self._hourly
+        return data
+
+
+def trim_forecast(forecast):
+    """
+    Keep only the parts of a response that WeatherData reads, so the rest of the response and the forecastio objects
+    around it can be freed while the forecast is cached
+    :type forecast: forecastio.models.Forecast or dict
+    :param forecast: forecast, or the decoded JSON response from the Dark Sky API
+    :return: dict, the same as WeatherData.json, or the whole response if it is missing a block so WeatherData finds
+             it not valid again
+    """
+    data = forecast if isinstance(forecast, dict) else forecast.json
+    try:
+        flags = data['flags']
+        if 'darksky-unavailable' in flags:
+            return data
+        trimmed = {
+            'flags': {'units': flags['units']},
+            'timezone': data['timezone'],
+            'currently': data['currently'],
+            'daily': {'data': data['daily']['data'][:1]},
+            'alerts': data.get('alerts', [])
+        }
+    except (KeyError, TypeError):
+        return data
+    for block in ('minutely', 'hourly'):
+        if data.get(block) is not None:
+            trimmed[block] = data[block]
+    return trimmed
+
+
+def copy_tables(tables):
+    """
+    Copy the dicts and lists of strings from strings.yml, without copying the strings, which can not change. This
+    is what copy.deepcopy returns for them, without its bookkeeping.
+    :type tables: dict or list
+    :return: dict or list
+    """
+    if isinstance(tables, dict):
+        return {key: copy_tables(value) for key, value in tables.items()}
+    if isinstance(tables, list):
+        return [copy_tables(value) if isinstance(value, (dict, list)) else value for value in tables]
+    return tables
 
 
 class WeatherBotString:
     """
     This is for storing and building strings based on a YAML file. The set_weather method must be used after creating
     a WeatherBotString object in order to set weather information to build alert, condition, and forecast strings.
+    By default strings are rendered lazily: the replacement values for a kind of template are worked out the first
+    time one is used after set_weather, and a template is only formatted once it has been picked. The lists of every
+    rendered string are built the first time they are read. Templates are compiled when the object is created, so a
+    template using a replacement field that is not allowed raises a templates.TemplateError right away instead of when
+    it is tweeted.
     """
     # pylint: disable=too-many-instance-attributes
-    def __init__(self, __strings):
+    def __init__(self, __strings, lazy=True, lookahead=0):
         """
         :param __strings: dict containing fields from strings.yml file or similar
+        :type lazy: bool
+        :param lazy: only format the templates that are used, if False every template is formatted by set_weather
+        :type lookahead: int
+        :param lookahead: minutes of the minutely and hourly forecast to check for special conditions that are about
+                          to start when there are none right now, 0 to only check the current conditions
         """
-        self.__template_forecasts = __strings['forecasts']
+        self.__template_forecasts = templates.compile_all(__strings['forecasts'], 'forecasts')
         self.__template_forecast_endings = __strings['forecast_endings']
-        self.__template_normal_conditions = __strings['normal_conditions']
-        self.__template_special_conditions = __strings['special_conditions']
-        self.__template_expires_alerts = __strings['alerts']['expires']
-        self.__template_no_expires_alerts = __strings['alerts']['no_expires']
-        self.__template_precipitations = __strings['precipitations']
+        self.__template_normal_conditions = templates.compile_all(__strings['normal_conditions'], 'normal_conditions')
+        self.__template_special_conditions = templates.compile_all(__strings['special_conditions'],
+                                                                   'special_conditions')
+        self.__template_expires_alerts = templates.compile_all(__strings['alerts']['expires'], 'expires_alerts')
+        self.__template_no_expires_alerts = templates.compile_all(__strings['alerts']['no_expires'],
+                                                                  'no_expires_alerts')
+        self.__template_precipitations = templates.compile_all(__strings['precipitations'], 'precipitations')
+        # strings files from older versions do not have lookahead strings
+        self.__template_lookahead = templates.compile_all(__strings.get('lookahead', []), 'lookahead')
+        self.lazy = lazy
+        self.lookahead = lookahead
         self.weather_data = None
         self.language = __strings['language']
-        self.forecasts = deepcopy(__strings['forecasts'])
-        self.forecasts_endings = deepcopy(__strings['forecast_endings'])
-        self.normal_conditions = deepcopy(__strings['normal_conditions'])
-        self.special_conditions = deepcopy(__strings['special_conditions'])
-        self.precipitations = deepcopy(__strings['precipitations'])
+        # the rendered strings are written into copies of the lists, the strings themselves are shared
+        self.__forecasts = copy_tables(__strings['forecasts'])
+        self.forecasts_endings = copy_tables(__strings['forecast_endings'])
+        self.__normal_conditions = copy_tables(__strings['normal_conditions'])
+        self.__special_conditions = copy_tables(__strings['special_conditions'])
+        self.__precipitations = copy_tables(__strings['precipitations'])
+        # replacement values for each kind of template, worked out once per set_weather when first used
+        self.__values = {}
+        # rendered lists that are out of date with the current weather
+        self.__stale = set()
 
     def __dict__(self):
         return {
@@ -190,36 +411,110 @@ class WeatherBotString:
             'precipitations': self.precipitations
         }
 
+    @property
+    def forecasts(self):
+        """
+        :return: list of every forecast string, rendered with the current weather
+        """
+        if 'forecasts' in self.__stale:
+            self.update_forecast()
+        return self.__forecasts
+
+    @property
+    def normal_conditions(self):
+        """
+        :return: list of every normal condition string, rendered with the current weather
+        """
+        if 'normal_conditions' in self.__stale:
+            self.update_normal()
+        return self.__normal_conditions
+
+    @property
+    def special_conditions(self):
+        """
+        :return: dict of lists of every special condition string by type, rendered with the current weather
+        """
+        if 'special_conditions' in self.__stale:
+            self.update_special()
+        return self.__special_conditions
+
+    @property
+    def precipitations(self):
+        """
+        :return: dict of dicts of lists of every precipitation string by type and intensity, rendered with the
+                 current weather
+        """
+        if 'precipitations' in self.__stale:
+            self.update_precipitation()
+        return self.__precipitations
+
     def set_weather(self, weather_data):
         """
         :type weather_data: WeatherData
         """
         self.weather_data = weather_data
-        self.update_forecast()
-        self.update_normal()
-        self.update_special()
-        self.update_precipitation()
+        self.__values = {}
+        self.__stale = {'forecasts', 'normal_conditions', 'special_conditions', 'precipitations'}
+        if not self.lazy:
+            self.update_forecast()
+            self.update_normal()
+            self.update_special()
+            self.update_precipitation()
+
+    def __replacements(self, kind):
+        """
+        Replacement values for a kind of template, worked out the first time they are used after set_weather
+        :type kind: str
+        :param kind: 'forecasts', 'normal_conditions', 'special_conditions', or 'precipitations'
+        :return: dict
+        """
+        values = self.__values.get(kind)
+        if values is not None:
+            return values
+        weather_data = self.weather_data
+        units = weather_data.units
+        if kind == 'forecasts':
+            values = {
+                'summary': weather_data.forecast.summary,
+                'summary_lower': weather_data.forecast.summary.lower(),
+                'high': str(round(weather_data.forecast.temperatureMax)) + 'º' + units['temperatureMax'],
+                'low': str(round(weather_data.forecast.temperatureMin)) + 'º' + units['temperatureMin']
+            }
+        elif kind == 'normal_conditions':
+            values = {
+                'summary': weather_data.summary,
+                'temp': str(round(weather_data.temp)) + 'º' + units['temperature'],
+                'location': weather_data.location.name
+            }
+        elif kind == 'special_conditions':
+            values = {
+                'apparent_temp': str(round(weather_data.apparentTemperature)) + 'º' + units['apparentTemperature'],
+                'temp': str(round(weather_data.temp)) + 'º' + units['temperature'],
+                'wind_speed': str(round(weather_data.windSpeed)) + ' ' + units['windSpeed'],
+                'wind_bearing': weather_data.windBearing,
+                'humidity': str(weather_data.humidity),
+                'summary': weather_data.summary,
+                'location': weather_data.location.name
+            }
+        else:
+            values = {'rate': str(weather_data.precipIntensity) + units['precipIntensity']}
+        self.__values[kind] = values
+        return values
 
     def update_forecast(self):
         """
         updates all forecasts' replacement fields
         """
-        summary = self.weather_data.forecast.summary
-        summary_lower = self.weather_data.forecast.summary.lower()
-        units = self.weather_data.units
-        high = str(round(self.weather_data.forecast.temperatureMax)) + 'º' + units['temperatureMax']
-        low = str(round(self.weather_data.forecast.temperatureMin)) + 'º' + units['temperatureMin']
+        values = self.__replacements('forecasts')
         for i, forecast in enumerate(self.__template_forecasts):
-            self.forecasts[i] = forecast.format(summary=summary,
-                                                summary_lower=summary_lower,
-                                                high=high,
-                                                low=low)
+            self.__forecasts[i] = forecast.render(values)
+        self.__stale.discard('forecasts')
 
     def forecast(self):
         """
         :return: random forecast string containing the text for a forecast tweet
         """
-        forecast = random.choice(self.forecasts)
+        forecast = random.choice(self.__template_forecasts).render(self.__replacements('forecasts'))
         if self.__template_forecast_endings:
             forecast += ' ' + random.choice(self.__template_forecast_endings)
         return forecast
@@ -228,41 +523,26 @@ class WeatherBotString:
         """
         updates all normal conditions' replacement fields
         """
-        temp = str(round(self.weather_data.temp)) + 'º' + self.weather_data.units['temperature']
-        summary = self.weather_data.summary
-        location = self.weather_data.location.name
+        values = self.__replacements('normal_conditions')
         for i, normal in enumerate(self.__template_normal_conditions):
-            self.normal_conditions[i] = normal.format(summary=summary,
-                                                      temp=temp,
-                                                      location=location)
+            self.__normal_conditions[i] = normal.render(values)
+        self.__stale.discard('normal_conditions')
 
     def normal(self):
         """
         :return: random normal condition string containing the text for a normal tweet
         """
-        return random.choice(self.normal_conditions)
+        return random.choice(self.__template_normal_conditions).render(self.__replacements('normal_conditions'))
 
     def update_special(self):
         """
         updates all normal conditions' replacement fields
         """
-        units = self.weather_data.units
-        apparent_temp = str(round(self.weather_data.apparentTemperature)) + 'º' + units['apparentTemperature']
-        temp = str(round(self.weather_data.temp)) + 'º' + units['temperature']
-        wind_speed = str(round(self.weather_data.windSpeed)) + ' ' + units['windSpeed']
-        wind_bearing = self.weather_data.windBearing
-        humidity = str(self.weather_data.humidity)
-        summary = self.weather_data.summary
-        location = self.weather_data.location.name
+        values = self.__replacements('special_conditions')
         for condition in self.__template_special_conditions:
             for i, special in enumerate(self.__template_special_conditions[condition]):
-                self.special_conditions[condition][i] = special.format(apparent_temp=apparent_temp,
-                                                                       temp=temp,
-                                                                       wind_speed=wind_speed,
-                                                                       wind_bearing=wind_bearing,
-                                                                       humidity=humidity,
-                                                                       summary=summary,
-                                                                       location=location)
+                self.__special_conditions[condition][i] = special.render(values)
+        self.__stale.discard('special_conditions')
 
     def special(self):
         """
@@ -277,43 +557,59 @@ class WeatherBotString:
         humidity = self.weather_data.humidity
         code = self.weather_data.icon
         weather_type = 'none'
-        if (units['temperature'] == 'F' and apparent_temp <= -30) or \
-                (units['temperature'] == 'C' and apparent_temp <= -34):
+        temperature_unit = units['temperature']
+        if apparent_temp <= utils.WIND_CHILL_TEMPERATURES.get(temperature_unit, -INFINITY):
             weather_type = 'wind-chill'
         elif precip.type != 'none':
             return precip
         elif 'medium-wind' in code:
             weather_type = 'medium-wind'
-        elif 'heavy-wind' in code or \
-                (units['windSpeed'] == 'mph' and wind_speed >= 35.0) or \
-                (units['windSpeed'] == 'km/h' and wind_speed >= 56.0) or \
-                (units['windSpeed'] == 'm/s' and wind_speed >= 15.0):
+        elif 'heavy-wind' in code or wind_speed >= utils.HEAVY_WIND_SPEEDS.get(units['windSpeed'], INFINITY):
             weather_type = 'heavy-wind'
         elif 'fog' in code:
             weather_type = 'fog'
-        elif (units['temperature'] == 'F' and temp <= -20) or (units['temperature'] == 'C' and temp <= -28):
+        elif temp <= utils.COLD_TEMPERATURES.get(temperature_unit, -INFINITY):
             weather_type = 'cold'
-        elif (units['temperature'] == 'F' and temp >= 110) or (units['temperature'] == 'C' and temp >= 43):
+        elif temp >= utils.SUPER_HOT_TEMPERATURES.get(temperature_unit, INFINITY):
             weather_type = 'super-hot'
-        elif (units['temperature'] == 'F' and temp >= 100) or (units['temperature'] == 'C' and temp >= 37):
+        elif temp >= utils.HOT_TEMPERATURES.get(temperature_unit, INFINITY):
             weather_type = 'hot'
-        elif humidity <= 25:
+        elif humidity <= utils.DRY_HUMIDITY:
             weather_type = 'dry'
 
+        if weather_type == 'none' and self.lookahead:
+            return self.__lookahead()
         if weather_type == 'none':
             return Condition(type='normal', text='')
-        return Condition(type=weather_type, text=random.choice(self.special_conditions[weather_type]))
+        text = random.choice(self.__template_special_conditions[weather_type]).render(
+            self.__replacements('special_conditions'))
+        return Condition(type=weather_type, text=text)
+
+    def __lookahead(self):
+        """
+        :return: Condition namedtuple for the first special condition expected within the lookahead, with the same
+                 type as when it is happening so they share a throttle, or a normal Condition if none is expected
+        """
+        if not self.__template_lookahead:
+            return Condition(type='normal', text='')
+        expected = nowcast.lookahead(self.weather_data.json(), self.weather_data.units, self.lookahead)
+        if expected is None:
+            return Condition(type='normal', text='')
+        text = random.choice(self.__template_lookahead).render({'condition': expected.type.replace('-', ' '),
+                                                                 'minutes': str(expected.minutes),
+                                                                 'location': self.weather_data.location.name})
+        return Condition(type=expected.type, text=text)
 
     def update_precipitation(self):
         """
         updates all precipitation replacement fields
         """
-        rate = str(self.weather_data.precipIntensity)
-        rate += self.weather_data.units['precipIntensity']
+        values = self.__replacements('precipitations')
         for precip_type in self.__template_precipitations:
             for precip_intensity in self.__template_precipitations[precip_type]:
                 for i, precip in enumerate(self.__template_precipitations[precip_type][precip_intensity]):
-                    self.precipitations[precip_type][precip_intensity][i] = precip.format(rate=rate)
+                    self.__precipitations[precip_type][precip_intensity][i] = precip.render(values)
+        self.__stale.discard('precipitations')
 
     def precipitation(self):
         """
@@ -326,7 +622,8 @@ class WeatherBotString:
         # Consider 80% chance and above as fact
         if probability >= 0.80 and precip_type != 'none' and intensity != 'none':
             detailed_type = intensity + '-' + precip_type
-            text = random.choice(self.precipitations[precip_type][intensity])
+            text = random.choice(self.__template_precipitations[precip_type][intensity]).render(
+                self.__replacements('precipitations'))
             return Condition(type=detailed_type, text=text)
         return Condition(type='none', text='')
 
@@ -338,14 +635,63 @@ class WeatherBotString:
         """
         # https://docs.python.org/3.3/library/datetime.html#strftime-and-strptime-behavior
         str_format = '%a, %b %d at %X %Z'
-        time = alert.time.astimezone(pytz.timezone(timezone_id)).strftime(str_format)
+        timezone = utils.get_timezone(timezone_id)
+        time = alert.time.astimezone(timezone).strftime(str_format)
         try:
-            expires = alert.expires.astimezone(pytz.timezone(timezone_id)).strftime(str_format)
-            return random.choice(self.__template_expires_alerts).format(title=alert.title,
-                                                                        time=time,
-                                                                        expires=expires,
-                                                                        uri=alert.uri)
+            expires = alert.expires.astimezone(timezone).strftime(str_format)
+            return random.choice(self.__template_expires_alerts).render({'title': alert.title,
+                                                                         'time': time,
+                                                                         'expires': expires,
+                                                                         'uri': alert.uri})
         except AttributeError:
-            return random.choice(self.__template_no_expires_alerts).format(title=alert.title,
-                                                                           time=time,
-                                                                           uri=alert.uri)
+            return random.choice(self.__template_no_expires_alerts).render({'title': alert.title,
+                                                                            'time': time,
+                                                                            'uri': alert.uri})
+
+
+def check_strings(data):
+    """
+    Parse the contents of the strings YAML file and compile every string
+    :type data: bytes
+    :param data: contents of the strings YAML file
+    :return: dict of strings, raises yaml.YAMLError or templates.TemplateError if they are not valid
+    """
+    weatherbot_strings = yaml.safe_load(data)
+    WeatherBotString(weatherbot_strings)
+    return weatherbot_strings
+
+
+def parse_strings(data):
+    """
+    Parse the contents of the strings YAML file and compile every string, exiting if either fails
+    :type data: bytes
+    :param data: contents of the strings YAML file
+    :return: dict of strings
+    """
+    try:
+        return check_strings(data)
+    except yaml.YAMLError as err:
+        logging.error(err, exc_info=True)
+        logging.error('Could not read YAML file, please correct, run yamllint, and try again.')
+        sys.exit()
+    except templates.TemplateError as err:
+        logging.error(err)
+        logging.error('Could not compile a string in the YAML file, please correct it and try again.')
+        sys.exit()
+
+
+def load_strings(path, snapshot_path=None, parse=parse_strings):
+    """
+    Load the strings YAML file, exiting if it can not be read. When a snapshot path is given, the parsed and compiled
+    strings are saved there, and loaded from there without parsing the YAML file again until it changes.
+    :type path: str
+    :param path: path to the strings YAML file
+    :type snapshot_path: str
+    :param snapshot_path: path to the snapshot of the strings, or None to always parse the YAML file
+    :type parse: function
+    :param parse: parses the contents of the YAML file, check_strings raises instead of exiting
+    :return: dict of strings
+    """
+    weatherbot_strings = snapshot.load(path, snapshot_path, parse)
+    logging.debug(weatherbot_strings)
+    return weatherbot_strings
@@ -0,0 +1,304 @@
+"""
+weatherBot nowcast
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import functools
+import itertools
+from collections import namedtuple
+
+import lazy
+import utils
+
+# NumPy is optional, and only imported the first time a vectorized helper is used
+numpy = lazy.lazy_import('numpy')
+
+Nowcast = namedtuple('Nowcast', ['type', 'minutes'])
+
+# precipitation types that have strings in strings.yml
+PRECIP_TYPES = ('rain', 'snow', 'sleet', 'hail')
+# precipitation intensities from the lightest to the heaviest
+INTENSITIES = ('very-light', 'light', 'moderate', 'heavy')
+# every condition a data point can be classified as, by code
+CONDITIONS = ('none', 'wind-chill', 'medium-wind', 'heavy-wind', 'fog', 'cold', 'super-hot', 'hot', 'dry') + \
+    tuple(intensity + '-' + precip_type for precip_type in PRECIP_TYPES for intensity in INTENSITIES)
+# code of the first precipitation condition, the code of each is FIRST_PRECIP + type * 4 + intensity
+FIRST_PRECIP = CONDITIONS.index('very-light-rain')
+# columns of each row of a series
+COLUMNS = ('minutes', 'temperature', 'apparent_temperature', 'wind_speed', 'humidity', 'precip_intensity',
+           'precip_probability', 'precip_type', 'medium_wind', 'heavy_wind', 'fog')
+# columns of a batch of locations, the columns of a row after minutes, then the code of the unit system
+BATCH_COLUMNS = COLUMNS[1:] + ('units',)
+# unit systems a batch can mix, by code
+UNIT_SYSTEMS = ('us', 'si', 'ca', 'uk2')
+# condition types of a batch by code, the same as models.WeatherBotString.special gives
+BATCH_TYPES = ('normal',) + CONDITIONS[1:]
+# rows at or above which classify uses NumPy by default. Below it, classifying one row at a time is faster, since
+# building the array costs more than it saves. A Dark Sky forecast has at most about 110 minutely and hourly points.
+# Measured with benchmark.py nowcast on Python 3.11 and NumPy 2.4.
+VECTORIZE_ROWS = 200
+NAN = float('nan')
+INFINITY = float('inf')
+
+ConditionBatch = namedtuple('ConditionBatch', BATCH_COLUMNS)
+
+
+def point_row(point, now, precipitation=True, weather=True):
+    """
+    Flatten a Dark Sky data point into a row of floats, in the order of COLUMNS. Missing values are NaN, which never
+    meet a threshold.
+    :type point: dict
+    :param point: data point from the minutely or hourly block
+    :type now: int
+    :param now: UNIX time of the currently block
+    :type precipitation: bool
+    :param precipitation: False to leave out the precipitation columns
+    :type weather: bool
+    :param weather: False to leave out the temperature, wind, humidity, and icon columns
+    :return: tuple of floats
+    """
+    minutes = (point['time'] - now) / 60
+    if precipitation:
+        precip_type = point.get('precipType')
+        precip = (point.get('precipIntensity', NAN), point.get('precipProbability', NAN),
+                  PRECIP_TYPES.index(precip_type) if precip_type in PRECIP_TYPES else -1)
+    else:
+        precip = (NAN, NAN, -1)
+    if not weather:
+        return (minutes, NAN, NAN, NAN, NAN) + precip + (0, 0, 0)
+    humidity = point.get('humidity')
+    icon = point.get('icon', '')
+    return (minutes, point.get('temperature', NAN), point.get('apparentTemperature', NAN),
+            point.get('windSpeed', NAN), NAN if humidity is None else round(humidity * 100)) + precip + \
+        ('medium-wind' in icon, 'heavy-wind' in icon, 'fog' in icon)
+
+
+def load_series(data, horizon):
+    """
+    Build the rows for every minutely and hourly data point after the currently block, up to the horizon.
+    Precipitation comes from the minutely block for as long as it covers, and from the hourly block after that.
+    :type data: dict
+    :param data: JSON from the Dark Sky API, or from models.WeatherData.json
+    :type horizon: int
+    :param horizon: minutes to look ahead
+    :return: list of rows, see point_row
+    """
+    now = data['currently']['time']
+    end = now + horizon * 60
+    minutely = data.get('minutely', {}).get('data', [])
+    covered = minutely[-1]['time'] if minutely else now
+    rows = [point_row(point, now, weather=False) for point in minutely if now < point['time'] <= end]
+    rows.extend(point_row(point, now, precipitation=point['time'] > covered)
+                for point in data.get('hourly', {}).get('data', []) if now < point['time'] <= end)
+    rows.sort(key=lambda row: row[0])
+    return rows
+
+
+def thresholds(units):
+    """
+    :type units: dict
+    :param units: units of the forecast, see utils.get_units
+    :return: dict of the special condition thresholds in the units
+    """
+    temperature = units['temperature']
+    return {
+        'wind_chill': utils.WIND_CHILL_TEMPERATURES.get(temperature, -INFINITY),
+        'heavy_wind': utils.HEAVY_WIND_SPEEDS.get(units['windSpeed'], INFINITY),
+        'cold': utils.COLD_TEMPERATURES.get(temperature, -INFINITY),
+        'super_hot': utils.SUPER_HOT_TEMPERATURES.get(temperature, INFINITY),
+        'hot': utils.HOT_TEMPERATURES.get(temperature, INFINITY),
+        'dry': utils.DRY_HUMIDITY,
+        'intensities': tuple(utils.PRECIPITATION_INTENSITIES[units['precipIntensity']][intensity][1]
+                             for intensity in INTENSITIES)
+    }
+
+
+def classify_row(row, limits):
+    """
+    Classify one row the same way models.WeatherBotString.special classifies the currently block
+    :type row: tuple
+    :type limits: dict
+    :param limits: see thresholds
+    :return: int, code of the condition in CONDITIONS
+    """
+    # pylint: disable=too-many-return-statements
+    _, temperature, apparent_temperature, wind_speed, humidity, intensity, probability, precip_type, medium_wind, \
+        heavy_wind, fog = row
+    if apparent_temperature <= limits['wind_chill']:
+        return 1
+    level = sum(intensity >= threshold for threshold in limits['intensities'])
+    if probability >= 0.80 and precip_type >= 0 and level:
+        return FIRST_PRECIP + int(precip_type) * len(INTENSITIES) + level - 1
+    if medium_wind:
+        return 2
+    if heavy_wind or wind_speed >= limits['heavy_wind']:
+        return 3
+    if fog:
+        return 4
+    if temperature <= limits['cold']:
+        return 5
+    if temperature >= limits['super_hot']:
+        return 6
+    if temperature >= limits['hot']:
+        return 7
+    if humidity <= limits['dry']:
+        return 8
+    return 0
+
+
+def classify_array(rows, limits):
+    """
+    Classify every row in one vectorized pass with NumPy
+    :type rows: list or numpy.ndarray
+    :param rows: rows of a series
+    :type limits: dict
+    :param limits: see thresholds
+    :return: numpy.ndarray of condition codes
+    """
+    if isinstance(rows, numpy.ndarray):
+        table = rows.reshape(-1, len(COLUMNS))
+    else:
+        # fromiter over the flattened rows is about twice as fast as converting the list of tuples
+        table = numpy.fromiter(itertools.chain.from_iterable(rows), float, count=len(rows) * len(COLUMNS))
+        table = table.reshape(-1, len(COLUMNS))
+    intensities = numpy.asarray(limits['intensities'])
+    # NaN is sorted after every threshold, so missing intensities are counted as none
+    level = numpy.where(numpy.isnan(table[:, 5]), 0, numpy.searchsorted(intensities, table[:, 5], side='right'))
+    return classify_columns(table.T[1:], level, limits)
+
+
+def classify_columns(columns, level, limits):
+    """
+    Classify every location or row from its columns with NumPy, in the same order of precedence as classify_row
+    :type columns: sequence
+    :param columns: numpy.ndarray for each of the columns of a row after minutes
+    :type level: numpy.ndarray
+    :param level: precipitation intensity of each row, 0 for none, 1 for very-light, up to 4 for heavy
+    :type limits: dict
+    :param limits: see thresholds, each threshold may also be a numpy.ndarray with one value for each row
+    :return: numpy.ndarray of condition codes
+    """
+    # pylint: disable=too-many-locals
+    temperature, apparent_temperature, wind_speed, humidity, _, probability, precip_type, medium_wind, heavy_wind, \
+        fog = columns
+    conditions = (
+        (apparent_temperature <= limits['wind_chill'], 1),
+        ((probability >= 0.80) & (precip_type >= 0) & (level > 0),
+         FIRST_PRECIP + precip_type.astype(int) * len(INTENSITIES) + level - 1),
+        (medium_wind > 0, 2),
+        ((heavy_wind > 0) | (wind_speed >= limits['heavy_wind']), 3),
+        (fog > 0, 4),
+        (temperature <= limits['cold'], 5),
+        (temperature >= limits['super_hot'], 6),
+        (temperature >= limits['hot'], 7),
+        (humidity <= limits['dry'], 8)
+    )
+    codes = numpy.zeros(len(temperature), dtype=int)
+    # the lowest priority condition is written first, so a higher priority one that also matches overwrites it
+    # numpy.select does the same, but broadcasting every choice makes it several times slower on short series
+    for matches, code in reversed(conditions):
+        numpy.copyto(codes, code, where=matches)
+    return codes
+
+
+def classify(rows, units, vectorized=None):
+    """
+    Classify every row of a series
+    :type rows: list
+    :type units: dict
+    :param units: units of the forecast, see utils.get_units
+    :type vectorized: bool
+    :param vectorized: True to use NumPy, False to classify one row at a time, defaults to NumPy if it is installed
+                       and there are at least VECTORIZE_ROWS rows
+    :return: list of condition codes
+    """
+    limits = thresholds(units)
+    if vectorized is None:
+        vectorized = len(rows) >= VECTORIZE_ROWS and numpy is not None
+    if vectorized and rows:
+        return classify_array(rows, limits).tolist()
+    return [classify_row(row, limits) for row in rows]
+
+
+def weather_row(weather_data):
+    """
+    Flatten the currently block of a WeatherData into a row of a batch, in the order of BATCH_COLUMNS
+    :type weather_data: models.WeatherData
+    :return: tuple
+    """
+    precip_type = weather_data.precipType
+    icon = weather_data.icon
+    return (weather_data.temp, weather_data.apparentTemperature, weather_data.windSpeed, weather_data.humidity,
+            weather_data.precipIntensity, weather_data.precipProbability,
+            PRECIP_TYPES.index(precip_type) if precip_type in PRECIP_TYPES else -1,
+            'medium-wind' in icon, 'heavy-wind' in icon, 'fog' in icon, UNIT_SYSTEMS.index(weather_data.units['unit']))
+
+
+def make_batch(weather_datas):
+    """
+    Build a batch with a column for each field the special conditions are classified by, instead of an object for
+    each location
+    :type weather_datas: list
+    :param weather_datas: list of models.WeatherData
+    :return: ConditionBatch of lists, with a value for each location
+    """
+    if not weather_datas:
+        return ConditionBatch(*([] for _ in BATCH_COLUMNS))
+    return ConditionBatch(*(list(column) for column in zip(*map(weather_row, weather_datas))))
+
+
+@functools.lru_cache(maxsize=None)
+def unit_thresholds():
+    """
+    :return: tuple of the thresholds of each unit system in UNIT_SYSTEMS, see thresholds
+    """
+    return tuple(thresholds(utils.get_units(system)) for system in UNIT_SYSTEMS)
+
+
+def classify_batch(batch, vectorized=None):
+    """
+    Classify the special condition of every location in a batch. The thresholds of each unit system are worked out
+    once, and with NumPy each location's are picked by its unit code, so the whole batch is classified in one pass
+    whatever units its locations use.
+    :type batch: ConditionBatch
+    :param batch: a sequence of values for each column, see make_batch
+    :type vectorized: bool
+    :param vectorized: see classify
+    :return: list of condition types in BATCH_TYPES, the same as models.WeatherBotString.special gives without the
+             lookahead
+    """
+    limits = unit_thresholds()
+    if vectorized is None:
+        vectorized = numpy is not None
+    if not batch.units:
+        return []
+    if not vectorized:
+        return [BATCH_TYPES[classify_row((0,) + row[:-1], limits[row[-1]])] for row in zip(*batch)]
+    units = numpy.asarray(batch.units, dtype=int)
+    per_location = {key: numpy.array([system[key] for system in limits])[units] for key in limits[0]}
+    columns = [numpy.asarray(column, dtype=float) for column in batch[:-1]]
+    # a location's level is the number of its unit system's intensity thresholds it meets, NaN meets none of them
+    level = (columns[4][:, numpy.newaxis] >= per_location['intensities']).sum(axis=1)
+    return [BATCH_TYPES[code] for code in classify_columns(columns, level, per_location).tolist()]
+
+
+def lookahead(data, units, horizon, vectorized=None):
+    """
+    Find the first special condition expected within the horizon
+    :type data: dict
+    :param data: JSON from the Dark Sky API, or from models.WeatherData.json
+    :type units: dict
+    :param units: units of the forecast, see utils.get_units
+    :type horizon: int
+    :param horizon: minutes to look ahead
+    :type vectorized: bool
+    :param vectorized: see classify
+    :return: Nowcast with the condition type and the minutes until it starts, or None if none is expected
+    """
+    rows = load_series(data, horizon)
+    for row, code in zip(rows, classify(rows, units, vectorized)):
+        if code:
+            return Nowcast(type=CONDITIONS[code], minutes=max(1, int(round(row[0]))))
+    return None
@@ -0,0 +1,314 @@
+"""
+weatherBot outbox
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket holding up to capacity tokens, refilled evenly so that capacity tokens are added every window
+    seconds. Each tweet takes one token.
+    """
+
+    def __init__(self, capacity, window, clock=time.monotonic):
+        """
+        :type capacity: int
+        :param capacity: most tokens held at once, and the number added every window
+        :type window: float
+        :param window: seconds to refill an empty bucket
+        :type clock: function
+        :param clock: returns the current time in seconds
+        """
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    def __refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """
+        :return: float, seconds until a token is available, 0 if one is available now
+        """
+        self.__refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        """
+        Take a token if one is available
+        :return: bool, True if a token was taken
+        """
+        self.__refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def empty(self):
+        """
+        Throw away every token, used when Twitter says the limit was reached anyway
+        """
+        self.__refill()
+        self.tokens = 0.0
+
+
+class Outbox:
+    """
+    Persistent queue of tweets waiting to be posted, kept in an SQLite database so they survive a restart. A background
+    worker posts them in order, taking a token from the account's TokenBucket for every tweet. A tweet that fails with
+    a retryable error is tried again after an exponential backoff with full jitter, any other failure drops it.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, send, retryable, path=':memory:', limit=300, window=10800, retries=8, retry_delay=5.0,
+                 max_retry_delay=900.0, clock=time.time):
+        """
+        :type send: function
+        :param send: send(account, status) posts a queued status, raising an exception if it failed
+        :type retryable: function
+        :param retryable: retryable(err) returns True if the status should be sent again after the exception err
+        :type path: str
+        :param path: path to the database file, or ':memory:' to keep nothing on disk
+        :type limit: int
+        :param limit: tweets each account may post every window
+        :type window: float
+        :param window: seconds, Twitter allows 300 tweets per account every 3 hours
+        :type retries: int
+        :param retries: most times a tweet is tried again before it is dropped
+        :type retry_delay: float
+        :param retry_delay: seconds, the backoff before the first retry, doubled for each retry after it
+        :type max_retry_delay: float
+        :param max_retry_delay: seconds, the longest backoff
+        :type clock: function
+        :param clock: returns the current UNIX time in seconds, due times are saved with the tweets
+        """
+        # pylint: disable=too-many-arguments
+        self.send = send
+        self.retryable = retryable
+        self.limit = limit
+        self.window = window
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.clock = clock
+        self.random = random.Random()
+        self.sent = 0
+        self.retried = 0
+        self.dropped = 0
+        self.__buckets = {}
+        self.__lock = threading.Lock()
+        self.__wake = threading.Condition(self.__lock)
+        self.__stopped = False
+        # set when a tweet is queued, so one queued while the worker was busy is not missed
+        self.__queued = False
+        self.__thread = None
+        # accounts that may have queued tweets, so only the first tweet of each is read
+        self.__accounts = set()
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        self.__conn.execute('PRAGMA synchronous=NORMAL')
+        with self.__conn:
+            self.__conn.execute('CREATE TABLE IF NOT EXISTS outbox ('
+                                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                'account TEXT NOT NULL, '
+                                'status TEXT NOT NULL, '
+                                'attempts INTEGER NOT NULL DEFAULT 0, '
+                                'due REAL NOT NULL)')
+            self.__conn.execute('CREATE INDEX IF NOT EXISTS outbox_account ON outbox (account, due, id)')
+        self.__accounts.update(account for account, in self.__conn.execute('SELECT DISTINCT account FROM outbox'))
+
+    def bucket(self, account):
+        """
+        :type account: str
+        :return: TokenBucket for the account, created on first use
+        """
+        bucket = self.__buckets.get(account)
+        if bucket is None:
+            bucket = self.__buckets[account] = TokenBucket(self.limit, self.window, clock=self.clock)
+        return bucket
+
+    def put(self, account, status):
+        """
+        Queue a status to be posted as soon as the account's rate limit allows
+        :type account: str
+        :param account: id of the account to post with
+        :type status: dict
+        :param status: keyword arguments for tweepy.API.update_status, must be JSON serializable
+        """
+        with self.__lock:
+            with self.__conn:
+                self.__conn.execute('INSERT INTO outbox (account, status, due) VALUES (?, ?, ?)',
+                                    (account, json.dumps(status), self.clock()))
+            self.__accounts.add(account)
+            self.__queued = True
+            self.__wake.notify()
+
+    def depth(self):
+        """
+        :return: int, number of tweets waiting to be posted
+        """
+        with self.__lock:
+            return self.__conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def backoff(self, attempts):
+        """
+        :type attempts: int
+        :param attempts: times the tweet has failed
+        :return: float, seconds to wait before trying again, picked at random up to the exponential backoff
+        """
+        return self.random.uniform(0, min(self.max_retry_delay, self.retry_delay * 2 ** (attempts - 1)))
+
+    def run_once(self):
+        """
+        Post the first queued tweet that is due and whose account has a token. Only the first queued tweet of each
+        account is read, with one indexed query per account, so the cost does not grow with the queue.
+        :return: float, seconds until the next tweet could be posted, or None if the queue is empty
+        """
+        rows = []
+        with self.__lock:
+            for account in list(self.__accounts):
+                row = self.__conn.execute('SELECT id, account, status, attempts, due FROM outbox WHERE account = ? '
+                                          'ORDER BY due, id LIMIT 1', (account,)).fetchone()
+                if row is None:
+                    self.__accounts.discard(account)
+                else:
+                    rows.append(row)
+        if not rows:
+            return None
+        now = self.clock()
+        wait = None
+        for row_id, account, status, attempts, due in sorted(rows, key=lambda row: (row[4], row[0])):
+            delay = max(due - now, self.bucket(account).delay())
+            if delay <= 0 and self.bucket(account).take():
+                self.__post(row_id, account, json.loads(status), attempts)
+                return 0.0
+            wait = delay if wait is None else min(wait, delay)
+        return wait
+
+    def __post(self, row_id, account, status, attempts):
+        """
+        Post a tweet, then remove it from the queue, or queue it to be tried again
+        """
+        try:
+            self.send(account, status)
+        except Exception as err:  # pylint: disable=broad-except
+            attempts += 1
+            if self.retryable(err) and attempts <= self.retries:
+                if getattr(getattr(err, 'response', None), 'status_code', None) == 429:
+                    # Twitter says the limit was reached, so wait for the bucket to refill before the next tweet
+                    self.bucket(account).empty()
+                delay = self.backoff(attempts)
+                logging.warning('Tweet failed, trying again in %.1fs: %s', delay, err)
+                with self.__lock:
+                    with self.__conn:
+                        self.__conn.execute('UPDATE outbox SET attempts = ?, due = ? WHERE id = ?',
+                                            (attempts, self.clock() + delay, row_id))
+                self.retried += 1
+                return
+            logging.error('Tweet dropped after %d attempts: %s', attempts, status.get('status'))
+            self.dropped += 1
+        else:
+            self.sent += 1
+        with self.__lock:
+            with self.__conn:
+                self.__conn.execute('DELETE FROM outbox WHERE id = ?', (row_id,))
+
+    def __run(self):
+        """
+        Post tweets until stopped, sleeping until the next one can be posted or a new one is queued
+        """
+        while True:
+            with self.__lock:
+                self.__queued = False
+            try:
+                wait = self.run_once()
+            except Exception:  # pylint: disable=broad-except
+                logging.error('Tweet queue failed', exc_info=True)
+                wait = self.retry_delay
+            with self.__wake:
+                if self.__stopped:
+                    return
+                if wait != 0.0 and not self.__queued:
+                    self.__wake.wait(wait)
+                if self.__stopped:
+                    return
+
+    def start(self):
+        """
+        Start posting queued tweets, including any left from before a restart, on a background thread
+        """
+        with self.__lock:
+            self.__stopped = False
+        self.__thread = threading.Thread(target=self.__run, name='outbox', daemon=True)
+        self.__thread.start()
+
+    def stop(self, timeout=10):
+        """
+        Stop the background thread, tweets still queued are posted after the next start
+        :type timeout: float
+        :param timeout: most seconds to wait for a tweet being posted
+        """
+        with self.__wake:
+            self.__stopped = True
+            self.__wake.notify()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+            self.__thread = None
+
+    def close(self):
+        """
+        Stop the background thread and close the database
+        """
+        self.stop()
+        with self.__lock:
+            self.__conn.close()
+
+    def stats(self):
+        """
+        :return: dict with the queue depth and counters of sent, retried, and dropped tweets
+        """
+        return {
+            'depth': self.depth(),
+            'sent': self.sent,
+            'retried': self.retried,
+            'dropped': self.dropped
+        }
+
+
+def open_outbox(send, retryable, path, queue_settings):
+    """
+    Open the queue of tweets saved in the state file and start posting them in the background
+    :type send: function
+    :param send: send(account, status) posts a tweet
+    :type retryable: function
+    :param retryable: retryable(err) is True if a failed tweet should be tried again
+    :type path: str
+    :param path: path to the SQLite state file
+    :type queue_settings: dict
+    :param queue_settings: CONFIG['tweet_queue']
+    :return: Outbox, or None if the queue is disabled
+    """
+    if not queue_settings['enabled']:
+        return None
+    queue = Outbox(send, retryable, path=path, limit=queue_settings['limit'], window=queue_settings['window'] * 60,
+                   retries=queue_settings['retries'], retry_delay=queue_settings['retry_delay'],
+                   max_retry_delay=queue_settings['max_retry_delay'])
+    if queue.depth():
+        logging.info('Posting %d tweets queued before the restart', queue.depth())
+    queue.start()
+    return queue
@@ -0,0 +1,246 @@
+"""
+weatherBot polling
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import hashlib
+import threading
+from datetime import datetime
+from datetime import timedelta
+
+import pytz
+
+import models
+
+
+def is_active(weather_data, precip_probability=0.3):
+    """
+    :type weather_data: models.WeatherData
+    :type precip_probability: float
+    :param precip_probability: chance of precipitation, from 0 to 1, at or above which the weather is active
+    :return: bool, True if there is an alert, it is precipitating or likely to, or the minutely forecast, when it was
+             requested, has precipitation coming
+    """
+    if weather_data.alerts:
+        return True
+    if weather_data.precipIntensity > 0 or weather_data.precipProbability >= precip_probability:
+        return True
+    if weather_data.minutely is not None:
+        for point in weather_data.minutely.data:
+            try:
+                if point.precipIntensity > 0:
+                    return True
+            except models.PropertyUnavailable:
+                continue
+    return False
+
+
+def minutes_left_today(now):
+    """
+    :type now: datetime.datetime
+    :param now: timezone aware
+    :return: float, minutes until the next midnight UTC
+    """
+    utc = now.astimezone(pytz.utc)
+    midnight = pytz.utc.localize(datetime(utc.year, utc.month, utc.day)) + timedelta(days=1)
+    return (midnight - utc).total_seconds() / 60
+
+
+def budget_name(key):
+    """
+    :type key: str
+    :param key: API key, or None
+    :return: str, name the key's call budget is saved under, so the key itself is never written to disk
+    """
+    return hashlib.sha256((key or '').encode('utf-8')).hexdigest()[:16]
+
+
+class CallBudget:
+    """
+    Calls made today with an API key that has a daily limit. Days start at midnight UTC, like Dark Sky's. With a
+    store, the calls are saved as they are made and loaded again on start, so a restart does not reset the budget.
+    """
+
+    def __init__(self, limit, store=None, name=None):
+        """
+        :type limit: int
+        :param limit: calls allowed each day
+        :type store: state.StateStore
+        :param store: where the calls are saved, or None to keep them in memory
+        :type name: str
+        :param name: budget_name of the API key
+        """
+        self.limit = limit
+        self.day = None
+        self.calls = 0
+        self.store = store
+        self.name = name
+        self.__lock = threading.Lock()
+        saved = store.budget(name) if store is not None else None
+        if saved is not None:
+            self.day = datetime.strptime(saved[0], '%Y-%m-%d').date()
+            self.calls = saved[1]
+
+    def spend(self, now, calls=1):
+        """
+        :type now: datetime.datetime
+        :param now: timezone aware time of the calls
+        :type calls: int
+        """
+        with self.__lock:
+            self.__roll(now)
+            self.calls += calls
+            if self.store is not None:
+                self.store.save_budget(self.name, self.day.isoformat(), self.calls)
+
+    def remaining(self, now):
+        """
+        :type now: datetime.datetime
+        :param now: timezone aware
+        :return: int, calls left today, never negative
+        """
+        with self.__lock:
+            self.__roll(now)
+            return max(self.limit - self.calls, 0)
+
+    def __roll(self, now):
+        """
+        Start counting again on a new day
+        :type now: datetime.datetime
+        """
+        day = now.astimezone(pytz.utc).date()
+        if day != self.day:
+            self.day = day
+            self.calls = 0
+
+
+class AdaptivePoller:
+    """
+    Picks the minutes until a location is polled again, instead of always waiting the refresh time. Active weather, see
+    is_active, is polled every min_refresh minutes. Each calm poll in a row waits growth times longer than the last, up
+    to max_refresh, and the first calm poll after active weather waits refresh again. No location is polled so often
+    that the daily budget of the API key would run out before the day ends, with the calls left spread evenly over the
+    locations.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, refresh, min_refresh=1, max_refresh=15, precip_probability=0.3, budget=1000, growth=2.0,
+                 store=None, registry=None):
+        """
+        :type refresh: float
+        :param refresh: minutes between polls with a fixed interval, the first calm poll waits this long
+        :type min_refresh: float
+        :param min_refresh: minutes between polls while the weather is active
+        :type max_refresh: float
+        :param max_refresh: most minutes between polls while the weather is calm
+        :type precip_probability: float
+        :param precip_probability: chance of precipitation at or above which the weather is active
+        :type budget: int
+        :param budget: calls allowed each day with each API key
+        :type growth: float
+        :param growth: how much longer each calm poll in a row waits
+        :type store: state.StateStore
+        :param store: where the calls made with each API key are saved, or None to keep them in memory
+        :type registry: metrics.Registry
+        :param registry: where the interval of each location is recorded, or None
+        """
+        # pylint: disable=too-many-arguments
+        self.refresh = refresh
+        self.min_refresh = min_refresh
+        self.max_refresh = max_refresh
+        self.precip_probability = precip_probability
+        self.budget = budget
+        self.growth = growth
+        self.store = store
+        self.registry = registry
+        self.budgets = {}
+        self.intervals = {}
+        self.polls = 0
+        # polls a fixed interval of refresh minutes would have made over the same time
+        self.baseline_polls = 0.0
+        self.__lock = threading.Lock()
+
+    def call_budget(self, key):
+        """
+        :type key: str
+        :param key: API key
+        :return: CallBudget of the key
+        """
+        with self.__lock:
+            if key not in self.budgets:
+                self.budgets[key] = CallBudget(self.budget, self.store, budget_name(key))
+            return self.budgets[key]
+
+    def spend(self, key, now):
+        """
+        Count a call made with an API key
+        :type key: str
+        :type now: datetime.datetime
+        """
+        self.call_budget(key).spend(now)
+
+    def next_interval(self, location_id, weather_data, now, locations, key=None):
+        """
+        :type location_id: str
+        :type weather_data: models.WeatherData
+        :param weather_data: weather the location was just polled for
+        :type now: datetime.datetime
+        :type locations: int
+        :param locations: locations polled with the API key, sharing its budget
+        :type key: str
+        :param key: API key the location is polled with
+        :return: float, minutes until the location is polled again
+        """
+        # pylint: disable=too-many-arguments
+        previous = self.intervals.get(location_id)
+        if is_active(weather_data, self.precip_probability):
+            minutes = self.min_refresh
+            # calm weather after this starts over from refresh, not from min_refresh
+            self.intervals.pop(location_id, None)
+        else:
+            if previous is None:
+                minutes = min(max(self.refresh, self.min_refresh), self.max_refresh)
+            else:
+                minutes = min(previous * self.growth, self.max_refresh)
+            self.intervals[location_id] = minutes
+        remaining = self.call_budget(key).remaining(now)
+        left = minutes_left_today(now)
+        # once the budget is spent, wait for it to start again at midnight
+        minutes = max(minutes, left * locations / remaining if remaining else left)
+        with self.__lock:
+            self.polls += 1
+            self.baseline_polls += minutes / self.refresh
+        if self.registry is not None:
+            self.registry.set('weatherbot_poll_interval_minutes', minutes, location=location_id)
+        return minutes
+
+    def stats(self):
+        """
+        :return: dict with the polls made, the polls a fixed interval would have made over the same time, and the
+                 polls saved
+        """
+        with self.__lock:
+            return {'polls': self.polls, 'baseline_polls': round(self.baseline_polls, 1),
+                    'saved': round(self.baseline_polls - self.polls, 1)}
+
+
+def start_poller(polling_settings, refresh, store=None, registry=None):
+    """
+    :type polling_settings: dict
+    :param polling_settings: CONFIG['adaptive_polling']
+    :type refresh: int
+    :param refresh: minutes between polls when the interval is fixed
+    :type store: state.StateStore
+    :param store: where the calls made with each API key are saved, or None to keep them in memory
+    :type registry: metrics.Registry
+    :param registry: where the interval of each location is recorded, or None
+    :return: AdaptivePoller, or None if adaptive polling is disabled
+    """
+    if not polling_settings['enabled']:
+        return None
+    return AdaptivePoller(refresh, min_refresh=polling_settings['min_refresh'],
+                          max_refresh=polling_settings['max_refresh'],
+                          precip_probability=polling_settings['precip_probability'],
+                          budget=polling_settings['daily_budget'], store=store, registry=registry)
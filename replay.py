@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+
+"""
+weatherBot replay
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import Executor
+from concurrent.futures import Future
+from datetime import datetime
+from datetime import timedelta
+
+import pytz
+
+import cache
+import metrics
+import models
+import polling
+import state
+import timeline
+import weatherBot
+
+# fixtures that hold a complete, valid Dark Sky response
+FIXTURES = ['us.json', 'ca.json', 'uk2.json', 'si.json', 'us_alert.json', 'ca_alert.json', 'us_cincinnati.json',
+            'optional_fields.json']
+
+
+class VirtualClock:
+    """
+    Simulated time for weatherBot.CLOCK, sleeping moves the clock forward right away instead of waiting
+    """
+
+    def __init__(self, start):
+        """
+        :type start: datetime.datetime
+        :param start: timezone aware time the clock starts at
+        """
+        self.current = start
+        self.slept = 0.0
+
+    def now(self):
+        """
+        :return: datetime.datetime of the simulated time in UTC
+        """
+        return self.current
+
+    def sleep(self, seconds):
+        """
+        :type seconds: float
+        :param seconds: seconds to move the clock forward
+        """
+        self.current += timedelta(seconds=seconds)
+        self.slept += seconds
+
+    def timestamp(self):
+        """
+        :return: float, the simulated time in seconds, used as the clock of the forecast cache
+        """
+        return self.current.timestamp()
+
+
+class InlineExecutor(Executor):
+    """
+    Executor that runs every job as soon as it is submitted, so a replay handles locations in order and gives the same
+    result every time
+    """
+
+    def submit(self, fn, *args, **kwargs):  # pylint: disable=arguments-differ
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as err:  # pylint: disable=broad-except
+            future.set_exception(err)
+        return future
+
+
+def rebase(data, now, start):
+    """
+    Move a recorded Dark Sky response to the given time, so its lookahead is timed like a fresh response. Alerts are
+    moved to the start of the replay instead, so an alert stays the same alert in every response until it expires.
+    Only the parts whose times change are copied, the rest is shared with the recording.
+    :type data: dict
+    :param data: decoded JSON of a recorded response
+    :type now: datetime.datetime
+    :param now: time the response is fetched at
+    :type start: datetime.datetime
+    :param start: time the replay started at, when the response was recorded
+    :return: dict
+    """
+    offset = int(now.timestamp()) - data['currently']['time']
+    data = dict(data, currently=dict(data['currently'], time=data['currently']['time'] + offset))
+    if 'alerts' in data:
+        start_offset = offset - int((now - start).total_seconds())
+        data['alerts'] = [dict(alert, **{key: alert[key] + start_offset for key in ('time', 'expires')
+                                         if key in alert})
+                          for alert in data['alerts']]
+    for block in ('minutely', 'hourly'):
+        if block in data:
+            data[block] = dict(data[block], data=[dict(point, time=point['time'] + offset)
+                                                  for point in data[block]['data']])
+    return data
+
+
+class ReplayDarkSky:
+    """
+    Stand-in clients.DarkSkyClient answering every request with a recorded response. Each location steps through the
+    recordings one fetch at a time, starting at a different one so locations do not all have the same weather, and
+    keeps the timezone of its first recording so its scheduled tweets stay put. Each recording is moved to the current
+    time once and shared by every location fetching it at that time.
+    """
+
+    def __init__(self, responses, clock):
+        """
+        :type responses: list
+        :param responses: decoded JSON of each recorded response
+        :type clock: VirtualClock
+        """
+        self.responses = responses
+        self.clock = clock
+        self.start = clock.now()
+        self.fetches = 0
+        self.__steps = {}
+        self.__now = None
+        self.__prepared = {}
+
+    def load_forecast(self, key, lat, lng, units='us', lang='en', exclude=None):
+        """
+        :return: dict, the next recorded response of the location, moved to the current simulated time and without
+                 the excluded blocks
+        """
+        # pylint: disable=too-many-arguments,unused-argument
+        step, timezone = self.__steps.get((lat, lng), (len(self.__steps), None))
+        index = step % len(self.responses)
+        timezone = timezone or self.responses[index]['timezone']
+        self.__steps[lat, lng] = (step + 1, timezone)
+        self.fetches += 1
+        now = self.clock.now()
+        if now != self.__now:
+            self.__now = now
+            self.__prepared = {}
+        key = (index, timezone, tuple(exclude or ()))
+        data = self.__prepared.get(key)
+        if data is None:
+            data = {block: value for block, value in self.responses[index].items()
+                    if not exclude or block not in exclude}
+            data['timezone'] = timezone
+            data = self.__prepared[key] = rebase(data, now, self.start)
+        return data
+
+    def stats(self):
+        """
+        :return: dict with the number of fetches
+        """
+        return {'fetches': self.fetches}
+
+
+class CaptureTwitter:
+    """
+    Stand-in for weatherBot.TWITTER and the tweepy.API it hands out, keeping every status instead of posting it
+    """
+
+    def __init__(self, clock):
+        """
+        :type clock: VirtualClock
+        """
+        self.clock = clock
+        self.statuses = []
+
+    def get(self, account):  # pylint: disable=unused-argument
+        """
+        :return: self, used as the API of every account
+        """
+        return self
+
+    def report_error(self, account, err):
+        """
+        Errors never happen in a replay
+        """
+
+    def update_status(self, **status):
+        """
+        Capture a status with the simulated time it was posted at
+        :return: dict, the status
+        """
+        self.statuses.append((self.clock.now(), status))
+        return status
+
+
+def load_responses(paths):
+    """
+    :type paths: list
+    :param paths: paths to recorded Dark Sky responses
+    :return: list of dicts, the decoded JSON of each response
+    """
+    responses = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as file_stream:
+            responses.append(json.load(file_stream))
+    return responses
+
+
+def make_locations(count, defaults):
+    """
+    Build the settings of count locations spread across a grid, far enough apart that each has its own forecast
+    :type count: int
+    :type defaults: dict
+    :param defaults: settings of the default location, every location copies its scheduled times and throttles
+    :return: list of location settings dicts
+    """
+    locations = []
+    for i in range(count):
+        settings = dict(defaults)
+        settings['id'] = 'replay-{0}'.format(i)
+        settings['location'] = models.WeatherLocation(lat=round(-60 + (i // 360) * 0.5, 3),
+                                                      lng=round(-180 + (i % 360) * 1.0, 3),
+                                                      name=settings['id'])
+        locations.append(settings)
+    return locations
+
+
+def replay(path, responses, days=7, locations=0, refresh=None, start=None, adaptive=None):
+    """
+    Run weatherBot on simulated time against recorded Dark Sky responses, capturing its tweets instead of posting
+    them. Tweets are posted right away instead of being queued, variable location is disabled, and locations are
+    handled one at a time. Metrics are not recorded and fetches are not merged. The globals of weatherBot are put back
+    afterwards. Every poll still runs the whole fetch and tweet_logic path, at about 0.1 ms each, so a simulated week
+    across 1,000 locations takes under a minute at a 30 minute refresh and about 6 minutes at a 3 minute refresh.
+    :type path: str
+    :param path: path to the configuration file
+    :type responses: list
+    :param responses: decoded JSON of the recorded responses, see ReplayDarkSky
+    :type days: float
+    :param days: simulated days to run
+    :type locations: int
+    :param locations: locations to replay spread across a grid, or 0 to use the locations in the configuration file
+    :type refresh: int
+    :param refresh: minutes between polls, defaults to the configuration file
+    :type start: datetime.datetime
+    :param start: timezone aware time the replay starts at, defaults to now
+    :type adaptive: bool
+    :param adaptive: whether to use adaptive polling, defaults to the configuration file
+    :return: dict with the counts of cycles, polls, fetches, and tweets, and the elapsed and simulated time. With
+             adaptive polling, also the polls polling every refresh would have made and the polls saved.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    saved = {name: getattr(weatherBot, name) for name in ('CONFIG', 'CLOCK', 'DARKSKY', 'FORECASTS', 'STATE',
+                                                          'TIMELINES', 'TWITTER', 'OUTBOX', 'POLLER', 'METRICS')}
+    clock = VirtualClock(start or pytz.utc.localize(datetime.utcnow()))
+    darksky = ReplayDarkSky(responses, clock)
+    twitter = CaptureTwitter(clock)
+    store = state.StateStore(':memory:')
+    try:
+        weatherBot.load_config(os.path.abspath(path))
+        config = weatherBot.CONFIG
+        config['variable_location']['enabled'] = False
+        if refresh is not None:
+            config['basic']['refresh'] = refresh
+        if locations:
+            config['locations'] = make_locations(locations, weatherBot.default_location_settings())
+        if adaptive is not None:
+            config['adaptive_polling']['enabled'] = adaptive
+        weatherBot.STATE = store
+        weatherBot.TIMELINES = timeline.TimelineTracker()
+        # nothing is scraped during a replay
+        weatherBot.METRICS = metrics.Registry(metrics.DEFINITIONS, enabled=False)
+        poller = polling.start_poller(config['adaptive_polling'], config['basic']['refresh'], store)
+        weatherBot.POLLER = poller
+        weatherBot.CLOCK = clock
+        weatherBot.DARKSKY = darksky
+        # locations are handled one at a time, so there are never concurrent fetches to merge
+        weatherBot.FORECASTS = cache.ForecastCache(clock=clock.timestamp, merge=False, **config['forecast_cache'])
+        weatherBot.TWITTER = twitter
+        weatherBot.OUTBOX = None
+        weatherBot.get_throttles(weatherBot.DEFAULT_LOCATION_ID).conditions['default'] = clock.now()
+        states = weatherBot.build_states(models.load_strings(config['basic']['strings']))
+        events = weatherBot.start_events(states, clock.now())
+        until = clock.now() + timedelta(days=days)
+        started = time.perf_counter()
+        with InlineExecutor() as pool:
+            cycles = weatherBot.run_events(pool, events, states, until=until)
+        elapsed = time.perf_counter() - started
+    finally:
+        store.close()
+        for name, value in saved.items():
+            setattr(weatherBot, name, value)
+    result = {
+        'locations': len(states),
+        'days': days,
+        'cycles': cycles,
+        'fetches': darksky.fetches,
+        'tweets': len(twitter.statuses),
+        'statuses': twitter.statuses,
+        'elapsed_s': elapsed,
+        'cycles_per_s': cycles / elapsed if elapsed else 0.0,
+        'simulated_per_real_s': clock.slept / elapsed if elapsed else 0.0
+    }
+    if poller is not None:
+        stats = poller.stats()
+        result['baseline_polls'] = stats['baseline_polls']
+        result['polls_saved'] = stats['saved']
+    return result
+
+
+def main():
+    """
+    Replay the configuration file given on the command line and print what happened
+    """
+    parser = argparse.ArgumentParser(description='Run weatherBot on simulated time against recorded Dark Sky '
+                                                 'responses, capturing tweets instead of posting them.')
+    parser.add_argument('-c', '--config', default='weatherBot.conf', help='configuration file to replay')
+    parser.add_argument('responses', metavar='response', nargs='*',
+                        default=[os.path.join('fixtures', name) for name in FIXTURES],
+                        help='recorded Dark Sky responses in the fixtures format, defaults to the fixtures')
+    parser.add_argument('--days', type=float, default=7, help='simulated days to run')
+    parser.add_argument('--locations', type=int, default=0,
+                        help='locations to replay, defaults to the locations in the configuration file')
+    parser.add_argument('--refresh', type=int, help='minutes between polls, defaults to the configuration file')
+    parser.add_argument('--tweets', action='store_true', help='print every captured tweet')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='use adaptive polling, and compare the fetches to a replay polling every refresh')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    responses = load_responses(args.responses)
+    start = pytz.utc.localize(datetime.utcnow())
+    result = replay(args.config, responses, days=args.days, locations=args.locations, refresh=args.refresh,
+                    start=start, adaptive=True if args.adaptive else None)
+    if args.adaptive:
+        fixed = replay(args.config, responses, days=args.days, locations=args.locations, refresh=args.refresh,
+                       start=start, adaptive=False)
+        result['fixed_fetches'] = fixed['fetches']
+        result['fetches_saved'] = fixed['fetches'] - result['fetches']
+        result['fixed_tweets'] = fixed['tweets']
+    if args.tweets:
+        for posted, status in result['statuses']:
+            print(posted.isoformat(), status['status'])
+    for key, value in result.items():
+        if key != 'statuses':
+            print('{0:>22} {1}'.format(key, round(value, 2) if isinstance(value, float) else value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+weatherBot scheduler
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import heapq
+import itertools
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import pytz
+
+Event = namedtuple('Event', ['due', 'kind', 'location_id', 'tweet_time'])
+
+
+class SystemClock:
+    """
+    The real time, weatherBot reads the time and waits through a clock so a replay can run on simulated time instead
+    """
+
+    @staticmethod
+    def now():
+        """
+        :return: datetime.datetime of the current time in UTC
+        """
+        return pytz.utc.localize(datetime.utcnow())
+
+    @staticmethod
+    def sleep(seconds):
+        """
+        :type seconds: float
+        :param seconds: seconds to wait
+        """
+        time.sleep(seconds)
+
+
+class Scheduler:
+    """
+    Priority queue of events ordered by when they are due. Pushing and popping an event are O(log n).
+    Events are cancelled lazily: cancelling bumps a generation counter for a location and kind in O(1), and any
+    event from an older generation is dropped when it reaches the front of the queue.
+    """
+
+    def __init__(self):
+        self.__heap = []
+        self.__counter = itertools.count()
+        self.__generations = {}
+
+    def push(self, due, kind, location_id, tweet_time=None):
+        """
+        :type due: datetime.datetime
+        :param due: when the event is due, timezone aware
+        :type kind: str
+        :param kind: type of event, ex: 'poll', 'forecast', 'conditions'
+        :type location_id: str
+        :type tweet_time: utils.Time
+        :param tweet_time: local time a scheduled tweet is for, if any
+        :return: Event
+        """
+        event = Event(due=due, kind=kind, location_id=location_id, tweet_time=tweet_time)
+        generation = self.__generations.get((location_id, kind), 0)
+        # the counter keeps events that are due at the same time in the order they were pushed
+        heapq.heappush(self.__heap, (due, next(self.__counter), generation, event))
+        return event
+
+    def cancel(self, location_id, kind):
+        """
+        Cancel every queued event of the given kind for the location
+        :type location_id: str
+        :type kind: str
+        """
+        key = (location_id, kind)
+        self.__generations[key] = self.__generations.get(key, 0) + 1
+
+    def __drop_cancelled(self):
+        """
+        Pop cancelled events off the front of the queue
+        """
+        while self.__heap:
+            _, _, generation, event = self.__heap[0]
+            if generation == self.__generations.get((event.location_id, event.kind), 0):
+                return
+            heapq.heappop(self.__heap)
+
+    def next_due(self):
+        """
+        :return: datetime.datetime of when the next event is due, or None if there are no events
+        """
+        self.__drop_cancelled()
+        if not self.__heap:
+            return None
+        return self.__heap[0][0]
+
+    def pop_due(self, now):
+        """
+        Remove and return every event that is due at or before now, in the order they are due
+        :type now: datetime.datetime
+        :return: list of Event
+        """
+        due = []
+        while self.next_due() is not None and self.next_due() <= now:
+            due.append(heapq.heappop(self.__heap)[3])
+        return due
+
+    def __len__(self):
+        """
+        :return: number of queued events, including cancelled events that have not been dropped yet
+        """
+        return len(self.__heap)
@@ -0,0 +1,94 @@
+"""
+weatherBot snapshot
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import hashlib
+import logging
+import marshal
+import os
+
+# start of every snapshot file, followed by the key and the marshalled tables
+HEADER = b'weatherBot snapshot\n'
+
+
+def snapshot_key(data):
+    """
+    :type data: bytes
+    :param data: contents of the file the snapshot is of
+    :return: bytes, SHA-256 of the contents and of the marshal format, so a snapshot written by a Python with another
+             marshal format is never read
+    """
+    return hashlib.sha256(bytes([marshal.version]) + data).digest()
+
+
+def read_snapshot(path, key):
+    """
+    :type path: str
+    :param path: path to the snapshot file
+    :type key: bytes
+    :param key: snapshot_key of the file's current contents
+    :return: the tables saved in the snapshot, or None if there is no snapshot, it is of other contents, or it can
+             not be read
+    """
+    try:
+        with open(path, 'rb') as file_stream:
+            blob = file_stream.read()
+    except OSError:
+        return None
+    start = len(HEADER) + len(key)
+    if not blob.startswith(HEADER) or blob[len(HEADER):start] != key:
+        return None
+    try:
+        return marshal.loads(blob[start:])
+    except (EOFError, ValueError, TypeError):
+        return None
+
+
+def write_snapshot(path, key, tables):
+    """
+    Save the tables to the snapshot file. The file is replaced at once, so a snapshot that is being read is never
+    half written. A snapshot that can not be written is skipped with a warning.
+    :type path: str
+    :param path: path to the snapshot file
+    :type key: bytes
+    :param key: snapshot_key of the contents the tables were loaded from
+    :type tables: dict
+    :param tables: only dicts, lists, strings, numbers, booleans, and None
+    """
+    temp_path = path + '.tmp'
+    try:
+        blob = HEADER + key + marshal.dumps(tables)
+        with open(temp_path, 'wb') as file_stream:
+            file_stream.write(blob)
+        os.replace(temp_path, path)
+    except (OSError, ValueError) as err:
+        logging.warning('Could not write the snapshot %s: %s', path, err)
+
+
+def load(path, snapshot_path, parse):
+    """
+    Load the tables in a file, from its snapshot if the snapshot is of the file's current contents. Otherwise the
+    contents are parsed and the snapshot is written again.
+    :type path: str
+    :param path: path to the file, ex: 'strings.yml'
+    :type snapshot_path: str
+    :param snapshot_path: path to the snapshot file, or None to always parse the file
+    :type parse: function
+    :param parse: parse(data) returns the tables in the file's contents, it should also check that they are valid
+    :return: dict of the tables
+    """
+    with open(path, 'rb') as file_stream:
+        data = file_stream.read()
+    if not snapshot_path:
+        return parse(data)
+    key = snapshot_key(data)
+    tables = read_snapshot(snapshot_path, key)
+    if tables is not None:
+        logging.debug('Loaded %s from the snapshot %s', path, snapshot_path)
+        return tables
+    tables = parse(data)
+    write_snapshot(snapshot_path, key, tables)
+    return tables
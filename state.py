@@ -0,0 +1,336 @@
+"""
+weatherBot state
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import heapq
+import logging
+import os
+import pickle
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pytz
+
+EPOCH = pytz.utc.localize(datetime(1970, 1, 1))
+# alerts are deduplicated by the sha256 hex digest returned by models.Alert.sha
+ALERT_KEY = re.compile('^[0-9a-f]{64}$')
+# condition throttle that never expires, it is the fallback for condition types without their own throttle
+DEFAULT_THROTTLE = 'default'
+
+
+def to_micros(value):
+    """
+    :type value: datetime.datetime
+    :param value: timezone aware datetime
+    :return: int, microseconds since the epoch
+    """
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros):
+    """
+    :type micros: int
+    :param micros: microseconds since the epoch
+    :return: datetime.datetime in UTC
+    """
+    return EPOCH + timedelta(microseconds=micros)
+
+
+class TrackedDict(dict):
+    """
+    dict that remembers which keys were set or deleted since it was last flushed
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed = set()
+        self.deleted = set()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.changed.add(key)
+        self.deleted.discard(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.deleted.add(key)
+        self.changed.discard(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *args):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return super().pop(key, *args)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    @property
+    def dirty(self):
+        """
+        :return: bool, True if anything changed since the last flush
+        """
+        return bool(self.changed or self.deleted)
+
+    def mark_clean(self):
+        """
+        Forget every change, called once the changes are written
+        """
+        self.changed.clear()
+        self.deleted.clear()
+
+
+class ExpiringDict(TrackedDict):
+    """
+    TrackedDict of keys to the datetime they expire at. Expiry times are also kept in a min-heap, so expiring only
+    looks at keys that are due, in O(expired * log n), instead of scanning every key. Deleted and overwritten keys
+    are left in the heap and skipped when they reach the front, and the heap is rebuilt once most of it is stale.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__heap = [(expires, key) for key, expires in self.items()]
+        heapq.heapify(self.__heap)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        heapq.heappush(self.__heap, (value, key))
+        if len(self.__heap) > 2 * len(self) + 64:
+            self.__heap = [(expires, key) for key, expires in self.items()]
+            heapq.heapify(self.__heap)
+
+    def expire(self, now, keep=()):
+        """
+        Delete every key that expired at or before now
+        :type now: datetime.datetime
+        :type keep: tuple
+        :param keep: keys that are never deleted
+        :return: list of deleted keys
+        """
+        expired = []
+        while self.__heap and self.__heap[0][0] <= now:
+            expires, key = heapq.heappop(self.__heap)
+            # skip entries for keys that were deleted or given a new expiry time since they were pushed
+            if key not in keep and self.get(key) == expires:
+                del self[key]
+                expired.append(key)
+        return expired
+
+
+class Throttles:
+    """
+    Throttles of one location, kept in separate namespaces: conditions maps special condition types to when they may
+    be tweeted again, and alerts maps the SHA of each tweeted alert to when it is forgotten. The 'default' condition
+    throttle is never expired.
+    """
+
+    def __init__(self, conditions=None, alerts=None):
+        """
+        :type conditions: dict
+        :type alerts: dict
+        """
+        self.conditions = ExpiringDict(conditions or {})
+        self.alerts = ExpiringDict(alerts or {})
+
+    def expire(self, now):
+        """
+        Delete every condition throttle and alert that expired at or before now, except the 'default' throttle
+        :type now: datetime.datetime
+        :return: list of deleted keys
+        """
+        return self.conditions.expire(now, keep=(DEFAULT_THROTTLE,)) + self.alerts.expire(now)
+
+    @property
+    def dirty(self):
+        """
+        :return: bool, True if either namespace changed since the last flush
+        """
+        return self.conditions.dirty or self.alerts.dirty
+
+    def __eq__(self, other):
+        if not isinstance(other, Throttles):
+            return NotImplemented
+        return self.conditions == other.conditions and self.alerts == other.alerts
+
+    def __repr__(self):
+        return 'Throttles(conditions={0!r}, alerts={1!r})'.format(dict(self.conditions), dict(self.alerts))
+
+
+class StateStore:
+    """
+    Throttles and alert SHAs for every location, kept in an SQLite database in WAL mode with one table per namespace.
+    Each location's throttles are read with one indexed query per namespace the first time they are used, so the cost
+    does not grow with the number of locations or alerts stored. flush writes only the entries that changed, in a
+    single transaction, so a crash leaves either the previous or the new state on disk and never a partial write.
+    """
+
+    def __init__(self, path='.wbstate.db'):
+        """
+        :type path: str
+        :param path: path to the database file, or ':memory:' to keep nothing on disk
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__throttles = {}
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        # with WAL, NORMAL still never corrupts the database, the last transaction may only be rolled back
+        self.__conn.execute('PRAGMA synchronous=NORMAL')
+        with self.__conn:
+            self.__conn.execute('CREATE TABLE IF NOT EXISTS throttles ('
+                                'location TEXT NOT NULL, '
+                                'name TEXT NOT NULL, '
+                                'expires INTEGER NOT NULL, '
+                                'PRIMARY KEY (location, name)) WITHOUT ROWID')
+            self.__conn.execute('CREATE TABLE IF NOT EXISTS alerts ('
+                                'location TEXT NOT NULL, '
+                                'name TEXT NOT NULL, '
+                                'expires INTEGER NOT NULL, '
+                                'PRIMARY KEY (location, name)) WITHOUT ROWID')
+            self.__conn.execute('CREATE TABLE IF NOT EXISTS budgets ('
+                                'name TEXT PRIMARY KEY, '
+                                'day TEXT NOT NULL, '
+                                'calls INTEGER NOT NULL) WITHOUT ROWID')
+
+    def throttles(self, location_id):
+        """
+        Return the throttles for the location, loading them on first use. Changes to either namespace are saved by
+        the next flush.
+        :type location_id: str
+        :return: Throttles
+        """
+        with self.__lock:
+            throttles = self.__throttles.get(location_id)
+            if throttles is None:
+                throttles = Throttles(self.__load('throttles', location_id), self.__load('alerts', location_id))
+                self.__throttles[location_id] = throttles
+            return throttles
+
+    def __load(self, table, location_id):
+        """
+        :type table: str
+        :param table: 'throttles' or 'alerts'
+        :type location_id: str
+        :return: dict, name as the key, datetime as the value
+        """
+        rows = self.__conn.execute('SELECT name, expires FROM {0} WHERE location = ?'.format(table), (location_id,))
+        return {name: from_micros(expires) for name, expires in rows}
+
+    def flush(self):
+        """
+        Write every changed or deleted throttle in one transaction
+        :return: int, number of entries written or deleted
+        """
+        with self.__lock:
+            dirty = [(location_id, throttles) for location_id, throttles in self.__throttles.items()
+                     if throttles.dirty]
+            if not dirty:
+                return 0
+            written = 0
+            with self.__conn:
+                for table, namespace in (('throttles', 'conditions'), ('alerts', 'alerts')):
+                    upserts = []
+                    deletes = []
+                    for location_id, throttles in dirty:
+                        entries = getattr(throttles, namespace)
+                        upserts.extend((location_id, name, to_micros(entries[name])) for name in entries.changed)
+                        deletes.extend((location_id, name) for name in entries.deleted)
+                    self.__conn.executemany('INSERT OR REPLACE INTO {0} (location, name, expires) '
+                                            'VALUES (?, ?, ?)'.format(table), upserts)
+                    self.__conn.executemany('DELETE FROM {0} WHERE location = ? AND name = ?'.format(table), deletes)
+                    written += len(upserts) + len(deletes)
+            for _, throttles in dirty:
+                throttles.conditions.mark_clean()
+                throttles.alerts.mark_clean()
+            return written
+
+    def budget(self, name):
+        """
+        :type name: str
+        :param name: name of the call budget, never the API key itself
+        :return: tuple of the day as an ISO date string and the calls made that day, or None if it was never saved
+        """
+        with self.__lock:
+            return self.__conn.execute('SELECT day, calls FROM budgets WHERE name = ?', (name,)).fetchone()
+
+    def save_budget(self, name, day, calls):
+        """
+        Write the calls made today with an API key right away, so a restart does not start the day's budget over
+        :type name: str
+        :param name: name of the call budget, never the API key itself
+        :type day: str
+        :param day: ISO date string
+        :type calls: int
+        """
+        with self.__lock, self.__conn:
+            self.__conn.execute('INSERT OR REPLACE INTO budgets (name, day, calls) VALUES (?, ?, ?)',
+                                (name, day, calls))
+
+    def is_empty(self):
+        """
+        :return: bool, True if nothing has ever been saved
+        """
+        with self.__lock:
+            return (self.__conn.execute('SELECT 1 FROM throttles LIMIT 1').fetchone() is None and
+                    self.__conn.execute('SELECT 1 FROM alerts LIMIT 1').fetchone() is None)
+
+    def import_cache(self, old_cache):
+        """
+        Copy the throttles from a cache saved by an older version of weatherBot, then flush them. Older caches kept
+        alert SHAs with the condition throttles, they are moved into the alerts namespace.
+        :type old_cache: dict
+        :param old_cache: dict with the default location's throttles at 'throttles', and other locations' throttles
+                          by id at 'locations'
+        """
+        locations = dict(old_cache.get('locations', {}))
+        locations['default'] = old_cache.get('throttles', {})
+        for location_id, old_throttles in locations.items():
+            throttles = self.throttles(location_id)
+            for name, expires in old_throttles.items():
+                if ALERT_KEY.match(name):
+                    throttles.alerts[name] = expires
+                else:
+                    throttles.conditions[name] = expires
+        self.flush()
+
+    def close(self):
+        """
+        Flush any changes and close the database
+        """
+        self.flush()
+        with self.__lock:
+            self.__conn.close()
+
+
+def open_state(path, cache_file='.wbcache.p'):
+    """
+    Open the state file at path. If it has nothing saved yet and a cache file from an older version exists, its
+    throttles are imported.
+    :type path: str
+    :param path: path to the state database
+    :type cache_file: str
+    :param cache_file: path to a pickled cache file to import
+    :return: StateStore
+    """
+    store = StateStore(path)
+    if store.is_empty() and os.path.isfile(cache_file):
+        logging.info('Importing throttles from %s into %s', cache_file, path)
+        with open(cache_file, 'rb') as handle:
+            store.import_cache(pickle.load(handle))
+    return store
@@ -3,7 +3,7 @@ from invoke import task
 
 @task(help={
     'bytecode': 'Remove bytecode files matching the pattern \'**/*.pyc\'.',
-    'cache': 'Remove the \'.wbcache.p\' file.',
+    'cache': 'Remove the \'.wbcache.p\', \'.wbstate.db\', and \'.wbstrings.snapshot\' files.',
     'extra': 'Remove any extra files passed in here.'
 })
 def clean(ctx, cache=False, bytecode=False, extra=''):
@@ -13,6 +13,8 @@ def clean(ctx, cache=False, bytecode=False, extra=''):
     patterns = []
     if cache:
         patterns.append('.wbcache.p')
+        patterns.append('.wbstate.db*')
+        patterns.append('.wbstrings.snapshot*')
     if bytecode:
         patterns.append('**/*.pyc')
     if extra:
@@ -33,7 +35,9 @@ def lint(ctx, pylintrc='.pylintrc', extra=''):
     """
     from pylint.lint import Run
     args = ['--reports=no', '--rcfile=' + pylintrc]
-    files = ['weatherBot.py', 'utils.py', 'models.py', 'keys.py']
+    files = ['weatherBot.py', 'utils.py', 'models.py', 'keys.py', 'cache.py', 'clients.py', 'scheduler.py', 'state.py',
+             'templates.py', 'outbox.py', 'timeline.py', 'nowcast.py', 'benchmark.py', 'replay.py',
+             'metrics.py', 'logs.py', 'lazy.py', 'adapters.py', 'snapshot.py', 'watcher.py', 'polling.py']
     if extra:
         files.append(extra)
     Run(args + files)
@@ -59,6 +63,34 @@ def test(ctx, report=False):
     Runs tests and reports on code coverage.
     Keys need to be entered in 'keys.py' or set as environmental variables.
     """
-    ctx.run('coverage run --source=weatherBot,models,utils,keys test.py')
+    ctx.run('coverage run --source=weatherBot,models,utils,keys,cache,clients,scheduler,state,templates,outbox,'
+            'timeline,nowcast,replay,metrics,logs,lazy,adapters,snapshot,watcher,polling test.py')
     if report:
         ctx.run('coverage report -m')
+
+
+@task(help={
+    'names': 'Space separated names of benchmarks to run. Runs all benchmarks if not given.',
+    'extra': 'Extra arguments passed to benchmark.py, ex: \'--workers 50\'.'
+})
+def bench(ctx, names='', extra=''):
+    """
+    Run the benchmarks in 'benchmark.py' and print their results.
+    Keys are not needed, no requests are made to Twitter or Dark Sky.
+    Save the results with '--json base.json' and compare a later run with '--compare base.json'.
+    """
+    ctx.run('python benchmark.py %s %s' % (names, extra))
+
+
+@task(help={
+    'config': 'Path to the configuration file to replay.',
+    'extra': 'Extra arguments passed to replay.py, ex: \'--days 7 --locations 1000 --refresh 30\'.'
+})
+def replay(ctx, config='weatherBot.conf', extra=''):
+    """
+    Run weatherBot on simulated time against the recorded Dark Sky responses in 'fixtures' and print what happened.
+    Keys are not needed, tweets are captured instead of posted. Pass '--adaptive' in extra to count the fetches adaptive
+    polling saves against polling every refresh. Each poll takes about 0.1 ms, so a week across 1,000 locations takes
+    under a minute with '--refresh 30'.
+    """
+    ctx.run('python replay.py --config %s %s' % (config, extra))
@@ -0,0 +1,125 @@
+"""
+weatherBot templates
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import functools
+import operator
+import string
+
+# replacement fields allowed in each kind of template in strings.yml
+FIELDS = {
+    'forecasts': ('summary', 'summary_lower', 'high', 'low'),
+    'normal_conditions': ('summary', 'temp', 'location'),
+    'special_conditions': ('apparent_temp', 'temp', 'wind_speed', 'wind_bearing', 'humidity', 'summary', 'location'),
+    'precipitations': ('rate',),
+    'expires_alerts': ('title', 'time', 'expires', 'uri'),
+    'no_expires_alerts': ('title', 'time', 'uri'),
+    'lookahead': ('condition', 'minutes', 'location')
+}
+
+
+class TemplateError(ValueError):
+    """
+    Raised when a template can not be compiled, such as when it uses a replacement field that is not allowed
+    """
+
+
+class Template:
+    """
+    A template compiled once into its literal segments and replacement field slots. Rendering fills the slots and
+    joins the pieces, instead of parsing the template again like str.format does every time. Templates without format
+    specs, which is every template in strings.yml, are also compiled into a printf-style string and a getter for
+    their fields, so rendering them is a single % operation.
+    """
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self, text, fields):
+        """
+        :type text: str
+        :param text: template using str.format replacement fields, ex: '{temp} and {summary}.'
+        :type fields: tuple
+        :param fields: names of the replacement fields the template may use
+        """
+        self.text = text
+        self.__pieces = []
+        self.__slots = []
+        try:
+            parsed = list(string.Formatter().parse(text))
+        except ValueError as err:
+            raise TemplateError('{0!r}: {1}'.format(text, err)) from err
+        for literal, name, format_spec, conversion in parsed:
+            if literal:
+                self.__pieces.append(literal)
+            if name is None:
+                continue
+            if name not in fields:
+                raise TemplateError('{0!r}: unknown replacement field {{{1}}}, use one of: {2}'.format(
+                    text, name, ', '.join(fields)))
+            if conversion not in (None, 's', 'r', 'a') or '{' in format_spec:
+                raise TemplateError('{0!r}: unsupported conversion or format spec in {{{1}}}'.format(text, name))
+            self.__slots.append((len(self.__pieces), name, conversion, format_spec))
+            self.__pieces.append('')
+        self.__printf = None
+        self.__getter = None
+        if all(format_spec == '' for _, _, _, format_spec in self.__slots):
+            self.__printf = ''.join(literal.replace('%', '%%') + ('' if name is None else '%' + (conversion or 's'))
+                                    for literal, name, _, conversion in parsed)
+            names = tuple(name for _, name, _, _ in self.__slots)
+            # itemgetter only returns a tuple for more than one name
+            if len(names) > 1:
+                self.__getter = operator.itemgetter(*names)
+            elif names:
+                self.__getter = lambda values, name=names[0]: (values[name],)
+            else:
+                self.__getter = lambda values: ()
+
+    def render(self, values):
+        """
+        :type values: dict
+        :param values: value for each replacement field
+        :return: str, the same as text.format(**values)
+        """
+        if self.__printf is not None:
+            return self.__printf % self.__getter(values)
+        pieces = self.__pieces[:]
+        for index, name, conversion, format_spec in self.__slots:
+            value = values[name]
+            if conversion == 's':
+                value = str(value)
+            elif conversion == 'r':
+                value = repr(value)
+            elif conversion == 'a':
+                value = ascii(value)
+            pieces[index] = value if format_spec == '' and isinstance(value, str) else format(value, format_spec)
+        return ''.join(pieces)
+
+    def __repr__(self):
+        return 'Template({0!r})'.format(self.text)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_template(text, fields):
+    """
+    Compile a template, reusing the compiled template if the same one was compiled before
+    :type text: str
+    :type fields: tuple
+    :param fields: names of the replacement fields the template may use
+    :return: Template
+    """
+    return Template(text, fields)
+
+
+def compile_all(templates, kind):
+    """
+    Compile every template in a list, or in lists nested in dicts like special_conditions and precipitations
+    :type templates: list or dict
+    :type kind: str
+    :param kind: key in FIELDS for the allowed replacement fields
+    :return: the same structure as templates, with a Template in place of each string
+    """
+    if isinstance(templates, dict):
+        return {key: compile_all(value, kind) for key, value in templates.items()}
+    return [compile_template(text, FIELDS[kind]) for text in templates]
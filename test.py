@@ -9,23 +9,55 @@ See the GitHub repository: https://github.com/BrianMitchL/weatherBot
 
 import configparser
 import datetime
+import hashlib
+import io
+import json
 import logging
+import math
 import os
+import urllib.error
+import urllib.request
 import pickle
+import random
+import subprocess
 import sys
+import threading
+import time
 import unittest
+from unittest.mock import Mock
+from concurrent.futures import ThreadPoolExecutor
 
 import forecastio
 import pytz
+import requests
 import tweepy
+import tweepy.binder
 import yaml
 from testfixtures import LogCapture
+from testfixtures import Replacer
 from testfixtures import replace
 
+import adapters
+import cache
+import clients
 import keys
+import lazy
+import logs
+import metrics
 import models
+import nowcast
+import outbox
+import polling
+import replay
+import scheduler
+import snapshot
+import state
+import templates
+import timeline
 import utils
+import watcher
 import weatherBot
+from test_helpers import mocked_darksky_session_get
 from test_helpers import mocked_forecastio_load_forecast
 from test_helpers import mocked_forecastio_load_forecast_error
 from test_helpers import mocked_get_tweepy_api
@@ -41,6 +73,13 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(average[0], 44.9415195)
         self.assertEqual(average[1], -93.1056485)
 
+    def test_distance(self):
+        """Testing the great circle distance between two coordinates"""
+        self.assertEqual(0, utils.distance(45.585, -95.91, 45.585, -95.91))
+        # Minneapolis to Morris, MN
+        self.assertAlmostEqual(217.2, utils.distance(44.98, -93.27, 45.585, -95.91), places=1)
+        self.assertAlmostEqual(20015.1, utils.distance(0, 0, 0, 180), places=1)
+
     def test_get_wind_direction(self):
         """Testing if wind direction conversions are successful"""
         self.assertEqual(utils.get_wind_direction(0), 'N')
@@ -124,6 +163,26 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(utils.precipitation_intensity(2.540, 'mm/h'), 'moderate')
         self.assertEqual(utils.precipitation_intensity(5.08, 'mm/h'), 'heavy')
 
+    def test_shared_units(self):
+        """Testing that every call for the same units gets the same read only dict"""
+        self.assertIs(utils.get_units('us'), utils.get_units('us'))
+        self.assertIs(utils.get_units('si'), utils.get_units('unknown'))
+        self.assertEqual([utils.get_units('ca'), utils.get_units('uk2')], utils.get_units_list(['ca', 'uk2']))
+        with self.assertRaises(TypeError):
+            utils.get_units('us')['temperature'] = 'C'
+
+    def test_vectorized_helpers(self):
+        """Testing that the vectorized helpers give the same results as calling the helper for each value"""
+        degrees = [value / 4 for value in range(-100, 1600)] + [float('nan')]
+        self.assertEqual([utils.get_wind_direction(value) for value in degrees], utils.get_wind_directions(degrees))
+        self.assertEqual(['', 'N', ''], utils.get_wind_directions([float('nan'), 0, float('nan')]))
+        for unit in ('in/h', 'mm/h'):
+            rates = [threshold + offset for threshold in (0,) + utils.INTENSITY_THRESHOLDS[unit]
+                     for offset in (-0.0001, 0, 0.0001)]
+            self.assertEqual([utils.precipitation_intensity(rate, unit) for rate in rates],
+                             utils.precipitation_intensities(rates, unit))
+        self.assertEqual(['none'], utils.precipitation_intensities([float('nan')], 'in/h'))
+
     def test_localize_utc_datetime(self):
         """Testing localizing a plain datetime object to a pytz timezone aware object"""
         dt = datetime.datetime.fromtimestamp(1461731335)  # datetime.datetime(2016, 4, 26, 23, 28, 55)
@@ -140,6 +199,45 @@ class TestUtils(unittest.TestCase):
         correct_dt = pytz.timezone('Europe/Copenhagen').localize(dt).astimezone(pytz.utc)
         self.assertEqual(utc_dt, correct_dt)
 
+    def test_next_fire_time(self):
+        """Testing finding the next time a local time happens, including across DST changes"""
+        after = pytz.utc.localize(datetime.datetime(2016, 10, 14, 12, 0))
+        self.assertEqual(pytz.utc.localize(datetime.datetime(2016, 10, 14, 16, 0)),
+                         utils.next_fire_time('Europe/Copenhagen', utils.Time(hour=18, minute=0), after))
+        self.assertEqual(pytz.utc.localize(datetime.datetime(2016, 10, 15, 4, 0)),
+                         utils.next_fire_time('Europe/Copenhagen', utils.Time(hour=6, minute=0), after))
+        self.assertEqual(pytz.utc.localize(datetime.datetime(2016, 10, 15, 10, 0)),
+                         utils.next_fire_time('Europe/Copenhagen', utils.Time(hour=12, minute=0), after))
+        # 2:30 is skipped in Chicago on 2016-03-13, so it is shifted forward an hour to 3:30 CDT
+        after = pytz.utc.localize(datetime.datetime(2016, 3, 13, 5, 0))
+        self.assertEqual(pytz.utc.localize(datetime.datetime(2016, 3, 13, 8, 30)),
+                         utils.next_fire_time('America/Chicago', utils.Time(hour=2, minute=30), after))
+        self.assertEqual(pytz.utc.localize(datetime.datetime(2016, 3, 13, 12, 0)),
+                         utils.next_fire_time('America/Chicago', utils.Time(hour=7, minute=0), after))
+        # 1:30 happens twice in Chicago on 2016-11-06, only the first is used
+        after = pytz.utc.localize(datetime.datetime(2016, 11, 6, 5, 0))
+        self.assertEqual(pytz.utc.localize(datetime.datetime(2016, 11, 6, 6, 30)),
+                         utils.next_fire_time('America/Chicago', utils.Time(hour=1, minute=30), after))
+        self.assertEqual(pytz.utc.localize(datetime.datetime(2016, 11, 7, 7, 30)),
+                         utils.next_fire_time('America/Chicago', utils.Time(hour=1, minute=30),
+                                              pytz.utc.localize(datetime.datetime(2016, 11, 6, 6, 30))))
+
+    def test_fire_times(self):
+        """Testing that the fire time table is shared by a timezone and follows DST from one day to the next"""
+        self.assertIs(utils.get_timezone('America/Chicago'), utils.get_timezone('America/Chicago'))
+        fire_times = utils.get_fire_times('America/Chicago')
+        self.assertIs(fire_times, utils.get_fire_times('America/Chicago'))
+        seven = utils.Time(hour=7, minute=0)
+        saturday = fire_times.fire_time(datetime.date(2016, 3, 12), seven)
+        self.assertEqual(pytz.utc.localize(datetime.datetime(2016, 3, 12, 13, 0)), saturday)
+        self.assertIs(saturday, fire_times.fire_time(datetime.date(2016, 3, 12), seven))
+        self.assertEqual(pytz.utc.localize(datetime.datetime(2016, 3, 13, 12, 0)),
+                         fire_times.next_fire_time(seven, saturday))
+        self.assertEqual(pytz.utc.localize(datetime.datetime(2016, 3, 14, 12, 0)),
+                         fire_times.fire_time(datetime.date(2016, 3, 14), seven))
+        # only the latest two days are kept, so an older day is localized again
+        self.assertIsNot(saturday, fire_times.fire_time(datetime.date(2016, 3, 12), seven))
+
     def test_parse_time_string(self):
         """Testing parsing string representing time to a Time namedtuple"""
         self.assertEqual(utils.parse_time_string('7:00'), utils.Time(hour=7, minute=0))
@@ -238,6 +336,14 @@ class WeatherBotAlert(unittest.TestCase):
         self.assertEqual('a6bf597275fdf063c76a42b05c3c81ed093701b2344c3c98cfde36875f7a4c3d', alert.sha())
         self.assertEqual('<WeatherAlert: Wind Advisory at 2016-10-18 04:04:00+00:00>', str(alert))
 
+    def test_from_json(self):
+        """Test that a WeatherAlert is loaded from the alert dict in the response"""
+        with open(os.path.join('fixtures', 'us_alert.json'), 'r') as file_stream:
+            alert = models.WeatherAlert(json.load(file_stream)['alerts'][0])
+        self.assertEqual('Wind Advisory', alert.title)
+        self.assertEqual(pytz.utc.localize(datetime.datetime(2016, 10, 20, 19, 0)), alert.expires)
+        self.assertEqual('a6bf597275fdf063c76a42b05c3c81ed093701b2344c3c98cfde36875f7a4c3d', alert.sha())
+
     @replace('requests.get', mocked_requests_get)
     def test_no_expires(self):
         """Test that a WeatherAlert is loaded correctly"""
@@ -305,6 +411,18 @@ class WeatherBotData(unittest.TestCase):
         self.assertEqual(wd.alerts[1].title, 'Beach Hazards Statement')
         self.assertEqual(wd.alerts[2].title, 'Red Flag Warning')
 
+    def test_bad_alert(self):
+        """Testing that a bad alert makes the data invalid instead of raising once the alerts are used"""
+        location = models.WeatherLocation(34.2, -118.36, 'Los Angeles, CA')
+        with open(os.path.join('fixtures', 'us_alert.json'), 'r') as file_stream:
+            data = json.load(file_stream)
+        del data['alerts'][1]['time']
+        wd = models.WeatherData(data, location)
+        self.assertFalse(wd.valid)
+        self.assertEqual([], wd.alerts)
+        data['alerts'][1]['time'] = 'soon'
+        self.assertFalse(models.WeatherData(data, location).valid)
+
     @replace('requests.get', mocked_requests_get)
     def test_bad_data(self):
         """Testing that bad data will gracefully fail"""
@@ -326,12 +444,62 @@ class WeatherBotData(unittest.TestCase):
         self.assertEqual(wd.precipType, 'rain')
         self.assertEqual(wd.windBearing, 'unknown direction')
 
+    @replace('requests.get', mocked_requests_get)
+    def test_minutely(self):
+        """Testing that minutely is only read when it is in the response"""
+        forecast = forecastio.manual(os.path.join('fixtures', 'us_alert.json'))
+        wd = models.WeatherData(forecast, self.location)
+        self.assertEqual(61, len(wd.minutely.data))
+        forecast = forecastio.manual(os.path.join('fixtures', 'us.json'))
+        wd = models.WeatherData(forecast, self.location)
+        self.assertIsNone(wd.minutely)
+
+    def test_from_json(self):
+        """Testing that weather data is built from the decoded JSON and only reads fields when they are used"""
+        with open(os.path.join('fixtures', 'us_alert.json'), 'r') as file_stream:
+            data = json.load(file_stream)
+        wd = models.WeatherData(data, self.location)
+        self.assertTrue(wd.valid)
+        self.assertFalse(hasattr(wd, '__dict__'))
+        self.assertIs(models.get_units('us'), wd.units)
+        self.assertIs(data['currently'], wd._currently)
+        with self.assertRaises(AttributeError):
+            object.__getattribute__(wd, 'temp')
+        self.assertEqual(data['currently']['temperature'], wd.temp)
+        self.assertEqual(data['currently']['temperature'], object.__getattribute__(wd, 'temp'))
+        wd.temp = -40
+        self.assertEqual(-40, wd.temp)
+        self.assertEqual(data['daily']['data'][0]['temperatureMax'], wd.forecast.temperatureMax)
+        with self.assertRaises(AttributeError):
+            wd.forecast.notAField
+        with self.assertRaises(AttributeError):
+            wd.notAField
+        self.assertEqual('Wind Advisory', wd.alerts[0].title)
+        self.assertIs(wd.alerts, wd.alerts)
+        self.assertEqual(datetime.datetime.utcfromtimestamp(data['minutely']['data'][0]['time']),
+                         wd.minutely.data[0].time)
+        self.assertEqual(data['minutely']['data'][0]['time'], wd.minutely.data[0].utime)
+        self.assertEqual(datetime.datetime.utcfromtimestamp(data['daily']['data'][0]['sunriseTime']),
+                         wd.forecast.sunriseTime)
+        self.assertFalse(models.WeatherData({'flags': {'units': 'us'}}, self.location).valid)
+
     @replace('requests.get', mocked_requests_get)
     def test_json(self):
         """Testing that json() returns a dict containing the response from the Dark Sky API"""
         forecast = forecastio.manual(os.path.join('fixtures', 'us.json'))
         wd = models.WeatherData(forecast, self.location)
-        self.assertEqual(wd.json(), forecast.json)
+        kept = wd.json()
+        # only the parts of the response weatherBot uses are kept, each the same as in the response
+        self.assertEqual({'flags', 'timezone', 'currently', 'daily', 'alerts', 'hourly'}, set(kept))
+        self.assertEqual(forecast.json['flags']['units'], kept['flags']['units'])
+        for key in ('timezone', 'currently', 'hourly'):
+            self.assertEqual(forecast.json[key], kept[key])
+        self.assertEqual(forecast.json.get('alerts', []), kept['alerts'])
+        self.assertEqual(forecast.json['daily']['data'][:1], kept['daily']['data'])
+        # hourly is left out of the request unless the lookahead is enabled
+        data = dict(forecast.json)
+        del data['hourly']
+        self.assertNotIn('hourly', models.WeatherData(data, self.location).json())
 
 
 class WeatherBotString(unittest.TestCase):
@@ -574,6 +742,29 @@ class WeatherBotString(unittest.TestCase):
         self.assertIn('https://alerts.weather.gov/cap/wwacapget.php?x=OH12561A63BE38.SevereThunderstormWarning.'
                       '12561A63C2E8OH.ILNSVSILN.f17bc0b3ead1db18bf60532894d9925e', alert)
 
+    @replace('requests.get', mocked_requests_get)
+    def test_lazy(self):
+        """Testing that lazily rendered strings are the same as strings rendered by set_weather"""
+        for fixture in ('us.json', 'si.json', 'us_cincinnati.json', 'ca_alert.json'):
+            wd = models.WeatherData(forecastio.manual(os.path.join('fixtures', fixture)), self.location)
+            wd.precipProbability = 0.9
+            wd.precipType = 'snow'
+            lazy = models.WeatherBotString(self.weatherbot_strings)
+            eager = models.WeatherBotString(self.weatherbot_strings, lazy=False)
+            strings = []
+            for wbs in (lazy, eager):
+                wbs.set_weather(wd)
+                random.seed(fixture)
+                strings.append([wbs.forecast(), wbs.normal(), wbs.special(), wbs.precipitation()])
+            self.assertEqual(strings[1], strings[0])
+            self.assertEqual(eager.__dict__(), lazy.__dict__())
+
+    def test_bad_template(self):
+        """Testing that a template using a field that is not allowed is rejected when the strings are loaded"""
+        self.weatherbot_strings['precipitations']['rain']['heavy'].append('{temp} and raining')
+        with self.assertRaises(templates.TemplateError):
+            models.WeatherBotString(self.weatherbot_strings)
+
     @replace('requests.get', mocked_requests_get)
     def test_dict(self):
         """Testing that __dict__ returns the correct data"""
@@ -591,6 +782,17 @@ class WeatherBotString(unittest.TestCase):
             'precipitations': wbs.precipitations
         }, wbs.__dict__())
 
+    def test_tables_copied(self):
+        """Testing that the lists of rendered strings are copied while the strings in them are shared"""
+        wbs = models.WeatherBotString(self.weatherbot_strings)
+        self.assertEqual(self.weatherbot_strings['forecasts'], wbs.forecasts)
+        self.assertIsNot(self.weatherbot_strings['forecasts'], wbs.forecasts)
+        self.assertIs(self.weatherbot_strings['forecasts'][0], wbs.forecasts[0])
+        rain = self.weatherbot_strings['precipitations']['rain']
+        self.assertEqual(rain, wbs.precipitations['rain'])
+        self.assertIsNot(rain['heavy'], wbs.precipitations['rain']['heavy'])
+        self.assertIsNot(self.weatherbot_strings['special_conditions'], wbs.special_conditions)
+
 
 class TestWB(unittest.TestCase):
     def setUp(self):
@@ -605,7 +807,10 @@ class TestWB(unittest.TestCase):
                 'tweet_location': False,
                 'hashtag': '',
                 'refresh': 300,
-                'strings': 'fake_path.yml'
+                'strings': 'fake_path.yml',
+                'workers': 10,
+                'state_path': '.wbstate.db',
+                'strings_snapshot': '.wbstrings.snapshot'
             },
             'scheduled_times': {
                 'forecast': utils.Time(hour=6, minute=0),
@@ -619,11 +824,16 @@ class TestWB(unittest.TestCase):
             'variable_location': {
                 'enabled': True,
                 'user': 'test_user',
-                'unnamed_location_name': 'Somewhere in deep space'
+                'unnamed_location_name': 'Somewhere in deep space',
+                'min_distance': 0.5
             },
             'log': {
                 'enabled': False,
-                'log_path': '/tmp/weatherBotTest.log'
+                'log_path': '/tmp/weatherBotTest.log',
+                'level': 'info',
+                'max_bytes': 1024,
+                'backups': 5,
+                'json_path': None
             },
             'throttles': {
                 'default': 24,
@@ -650,7 +860,41 @@ class TestWB(unittest.TestCase):
                 'moderate-hail': 3,
                 'light-hail': 2,
                 'very-light-hail': 1
-            }
+            },
+            'forecast_cache': {
+                'ttl': 60,
+                'precision': 3,
+                'size': 1000
+            },
+            'tweet_queue': {
+                'enabled': True,
+                'limit': 300,
+                'window': 180,
+                'retries': 8,
+                'retry_delay': 5.0,
+                'max_retry_delay': 900.0
+            },
+            'lookahead': {
+                'enabled': True,
+                'minutes': 30
+            },
+            'metrics': {
+                'enabled': False,
+                'host': '127.0.0.1',
+                'port': 9187
+            },
+            'reload': {
+                'enabled': True,
+                'interval': 30.0
+            },
+            'adaptive_polling': {
+                'enabled': False,
+                'min_refresh': 1.0,
+                'max_refresh': 15.0,
+                'precip_probability': 0.3,
+                'daily_budget': 1000
+            },
+            'locations': []
         }
 
         conf = configparser.ConfigParser()
@@ -674,11 +918,18 @@ class TestWB(unittest.TestCase):
         conf['variable location'] = {
             'enabled': 'yes',
             'user': 'test_user',
-            'unnamed_location_name': 'Somewhere in deep space'
+            'unnamed_location_name': 'Somewhere in deep space',
+            'min_distance': '0.5'
         }
         conf['log'] = {
             'enabled': '0',
-            'log_path': '/tmp/weatherBotTest.log'
+            'log_path': '/tmp/weatherBotTest.log',
+            'level': 'info',
+            'max_bytes': '1024'
+        }
+        conf['lookahead'] = {
+            'enabled': 'yes',
+            'minutes': '30'
         }
         conf['throttles'] = {
             'default': '24',
@@ -712,14 +963,282 @@ class TestWB(unittest.TestCase):
         self.assertDictEqual(weatherBot.CONFIG, equal)
         os.remove(os.path.abspath('weatherBotTest.conf'))
 
+    def test_config_locations(self):
+        """Testing that location sections are loaded and fall back to the other sections"""
+        conf = configparser.ConfigParser()
+        conf.read_dict({
+            'basic': {'hashtag': '#base'},
+            'scheduled times': {'forecast': '6:00', 'conditions': '7:00\n12:00'},
+            'default location': {},
+            'variable location': {},
+            'log': {},
+            'throttles': {'fog': '45'},
+            'location copenhagen': {'lat': '55.68', 'lng': '12.57', 'name': 'Copenhagen', 'hashtag': '#cph',
+                                    'forecast': '8:30', 'heavy-rain': '5'},
+            'location morris': {'lat': '45.585', 'lng': '-95.91', 'conditions': '9:00'}
+        })
+        with open(os.getcwd() + '/weatherBotTest.conf', 'w') as configfile:
+            conf.write(configfile)
+        weatherBot.load_config(os.path.abspath('weatherBotTest.conf'))
+        os.remove(os.path.abspath('weatherBotTest.conf'))
+        copenhagen, morris = weatherBot.CONFIG['locations']
+        self.assertEqual('copenhagen', copenhagen['id'])
+        self.assertEqual(models.WeatherLocation(55.68, 12.57, 'Copenhagen'), copenhagen['location'])
+        self.assertEqual('#cph', copenhagen['hashtag'])
+        self.assertEqual(utils.Time(hour=8, minute=30), copenhagen['scheduled_times']['forecast'])
+        self.assertEqual([utils.Time(hour=7, minute=0), utils.Time(hour=12, minute=0)],
+                         copenhagen['scheduled_times']['conditions'])
+        self.assertEqual(5, copenhagen['throttles']['heavy-rain'])
+        self.assertEqual(45, copenhagen['throttles']['fog'])
+        self.assertEqual(models.WeatherLocation(45.585, -95.91, 'morris'), morris['location'])
+        self.assertEqual('#base', morris['hashtag'])
+        self.assertEqual(utils.Time(hour=6, minute=0), morris['scheduled_times']['forecast'])
+        self.assertEqual([utils.Time(hour=9, minute=0)], morris['scheduled_times']['conditions'])
+        self.assertEqual(60, morris['throttles']['heavy-rain'])
+        self.assertEqual(weatherBot.CONFIG['locations'], weatherBot.get_locations())
+
+    def test_get_locations_default(self):
+        """Testing that the default location is used when no location sections are configured"""
+        weatherBot.load_config(os.path.abspath('weatherBot.conf'))
+        locations = weatherBot.get_locations()
+        self.assertEqual(1, len(locations))
+        self.assertEqual(weatherBot.DEFAULT_LOCATION_ID, locations[0]['id'])
+        self.assertEqual(weatherBot.CONFIG['default_location'], locations[0]['location'])
+        self.assertEqual(weatherBot.CONFIG['throttles'], locations[0]['throttles'])
+
+    @replace('weatherBot.TIMELINES', timeline.TimelineTracker())
+    def test_reload_config(self):
+        """Testing that a reload swaps in changed locations and strings, and keeps the running ones if not valid"""
+        conf = configparser.ConfigParser()
+        conf.read_dict({
+            'basic': {'hashtag': '#base', 'workers': '4', 'strings_snapshot': ''},
+            'scheduled times': {'forecast': '6:00', 'conditions': '7:00'},
+            'default location': {},
+            'variable location': {},
+            'log': {},
+            'throttles': {},
+            'location copenhagen': {'lat': '55.68', 'lng': '12.57'},
+            'location morris': {'lat': '45.585', 'lng': '-95.91'}
+        })
+        path = os.path.abspath('weatherBotTest.conf')
+        with open(path, 'w') as configfile:
+            conf.write(configfile)
+        now = pytz.utc.localize(datetime.datetime(2016, 10, 14, 10, 0))
+        try:
+            weatherBot.load_config(path)
+            states = weatherBot.build_states(models.load_strings('strings.yml'))
+            events = weatherBot.start_events(states, now)
+            events.pop_due(now)
+            copenhagen = states['copenhagen']
+            copenhagen['timezone'] = 'Europe/Copenhagen'
+            copenhagen['weather_data'] = Mock()
+            weatherBot.schedule_tweets(events, copenhagen['settings'], 'Europe/Copenhagen', now)
+            conf.remove_section('location morris')
+            conf.read_dict({'basic': {'hashtag': '#new', 'workers': '8'},
+                            'variable location': {'min_distance': '5'},
+                            'location copenhagen': {'forecast': '9:00'},
+                            'location oslo': {'lat': '59.91', 'lng': '10.75'}})
+            with open(path, 'w') as configfile:
+                conf.write(configfile)
+            with LogCapture() as check:
+                self.assertTrue(watcher.reload_config(weatherBot, path, events, states, now))
+                self.assertIn('Restart weatherBot to apply the changed basic workers setting', str(check))
+            self.assertEqual(4, weatherBot.CONFIG['basic']['workers'])
+            self.assertEqual(5.0, weatherBot.TIMELINES.min_distance)
+            self.assertEqual(['copenhagen', 'oslo'], sorted(states))
+            self.assertEqual('#new', states['copenhagen']['settings']['hashtag'])
+            self.assertIs(copenhagen['weather_data'], states['copenhagen']['weather_data'])
+            self.assertIsNot(copenhagen['wb_string'], states['copenhagen']['wb_string'])
+            self.assertEqual([('poll', 'oslo')], [(event.kind, event.location_id) for event in events.pop_due(now)])
+            forecasts = [event for event in events.pop_due(now + datetime.timedelta(days=1))
+                         if event.kind == 'forecast']
+            self.assertEqual([('copenhagen', utils.Time(hour=9, minute=0))],
+                             [(event.location_id, event.tweet_time) for event in forecasts])
+            conf.read_dict({'basic': {'strings': 'missing_strings.yml'}})
+            with open(path, 'w') as configfile:
+                conf.write(configfile)
+            config = weatherBot.CONFIG
+            with LogCapture() as check:
+                self.assertFalse(watcher.reload_config(weatherBot, path, events, states, now))
+                self.assertIn('Could not reload', str(check))
+            self.assertIs(config, weatherBot.CONFIG)
+            self.assertEqual(['copenhagen', 'oslo'], sorted(states))
+        finally:
+            os.remove(path)
+
+    @replace('weatherBot.STATE', state.StateStore(':memory:'))
+    def test_get_throttles(self):
+        """Testing that each location gets its own throttles, seeded with the default throttle"""
+        now = pytz.utc.localize(datetime.datetime(2016, 10, 14, hour=14, minute=42))
+        default = weatherBot.get_throttles(weatherBot.DEFAULT_LOCATION_ID)
+        default.conditions['default'] = now
+        self.assertIs(default, weatherBot.get_throttles(weatherBot.DEFAULT_LOCATION_ID))
+        throttles = weatherBot.get_throttles('somewhere')
+        self.assertIsNot(default, throttles)
+        self.assertEqual(state.Throttles({'default': now}), throttles)
+        throttles.conditions['fog'] = now
+        self.assertIs(throttles, weatherBot.get_throttles('somewhere'))
+
+    def test_open_state(self):
+        """Testing that a pickled cache from an older version is imported into a new state file only"""
+        now = pytz.utc.localize(datetime.datetime(2016, 10, 14, hour=14, minute=42))
+        weatherBot.set_cache({'throttles': {'default': now, 'fog': now}, 'locations': {'somewhere': {'default': now}}},
+                             file='testopenstate.p')
+        try:
+            store = state.open_state('testopenstate.db', cache_file='testopenstate.p')
+            store.close()
+            weatherBot.set_cache({'throttles': {'default': now, 'hot': now}}, file='testopenstate.p')
+            store = state.open_state('testopenstate.db', cache_file='testopenstate.p')
+            self.assertEqual({'default': now, 'fog': now}, store.throttles(weatherBot.DEFAULT_LOCATION_ID).conditions)
+            self.assertEqual({'default': now}, store.throttles('somewhere').conditions)
+            store.close()
+        finally:
+            for file in ('testopenstate.p', 'testopenstate.db', 'testopenstate.db-wal', 'testopenstate.db-shm'):
+                if os.path.isfile(file):
+                    os.remove(file)
+
+    @replace('requests.get', mocked_requests_get)
+    def test_run_cycle(self):
+        """Testing that every location is processed and reports whether a forecast was fetched"""
+        weatherBot.load_config(os.path.abspath('weatherBot.conf'))
+        with open('strings.yml', 'r') as file_stream:
+            weatherbot_strings = yaml.safe_load(file_stream)
+        now = pytz.utc.localize(datetime.datetime.utcnow())
+        forecasts = {
+            1: forecastio.manual(os.path.join('fixtures', 'us.json')),
+            2: forecastio.manual(os.path.join('fixtures', 'ca.json')),
+            3: None
+        }
+        jobs = []
+        for lat in forecasts:
+            settings = weatherBot.default_location_settings()
+            settings['id'] = str(lat)
+            settings['location'] = models.WeatherLocation(lat, 0, str(lat))
+            throttles = state.Throttles({'default': now, 'expired': now - datetime.timedelta(minutes=1)})
+            jobs.append((settings, models.WeatherBotString(weatherbot_strings), throttles))
+        with ThreadPoolExecutor(max_workers=2) as pool, \
+                Replacer() as replacer:
+            replacer.replace('weatherBot.get_forecast_object', lambda lat, *args, **kwargs: forecasts[lat])
+            replacer.replace('weatherBot.do_tweet', lambda *args, **kwargs: None)
+            fetched = weatherBot.run_cycle(pool, jobs, now)
+        self.assertEqual('Europe/Copenhagen', fetched[0].timezone)
+        self.assertEqual('ca', fetched[1].units['unit'])
+        self.assertIsNone(fetched[2])
+        self.assertEqual({'default': now}, jobs[0][2].conditions)
+        self.assertEqual({'default': now}, jobs[1][2].conditions)
+        self.assertIn('expired', jobs[2][2].conditions)
+
+    @replace('requests.get', mocked_requests_get)
+    def test_run_cycle_merged(self):
+        """Testing that locations at the same place in a cycle share one fetch, each with its own WeatherData"""
+        weatherBot.load_config(os.path.abspath('weatherBot.conf'))
+        with open('strings.yml', 'r') as file_stream:
+            weatherbot_strings = yaml.safe_load(file_stream)
+        now = pytz.utc.localize(datetime.datetime.utcnow())
+        forecast = forecastio.manual(os.path.join('fixtures', 'us.json'))
+        forecasts = cache.ForecastCache(ttl=0)
+
+        def load_forecast(*args, **kwargs):
+            # stay in flight until the other locations are waiting on this fetch
+            deadline = time.monotonic() + 5
+            while forecasts.merged < 2 and time.monotonic() < deadline:
+                time.sleep(0.001)
+            return forecast
+
+        darksky = Mock(load_forecast=Mock(side_effect=load_forecast))
+        jobs = []
+        for location_id, name in (('first', 'Same'), ('second', 'Same'), ('third', 'Other')):
+            settings = weatherBot.default_location_settings()
+            settings['id'] = location_id
+            settings['location'] = models.WeatherLocation(45.585, -95.91, name)
+            jobs.append((settings, models.WeatherBotString(weatherbot_strings), state.Throttles({'default': now})))
+        with ThreadPoolExecutor(max_workers=3) as pool, Replacer() as replacer:
+            replacer.replace('weatherBot.DARKSKY', darksky)
+            replacer.replace('weatherBot.FORECASTS', forecasts)
+            replacer.replace('weatherBot.do_tweet', lambda *args, **kwargs: None)
+            fetched = weatherBot.run_cycle(pool, jobs, now)
+            self.assertEqual(1, darksky.load_forecast.call_count)
+            self.assertEqual(2, forecasts.merged)
+            self.assertEqual('Same', fetched[1].location.name)
+            self.assertEqual('Other', fetched[2].location.name)
+
+    def test_schedule_tweets(self):
+        """Testing that scheduled tweets are queued at their next local times and replace older ones"""
+        weatherBot.load_config(os.path.abspath('weatherBot.conf'))
+        settings = weatherBot.default_location_settings()
+        events = scheduler.Scheduler()
+        after = pytz.utc.localize(datetime.datetime(2016, 10, 14, 12, 0))
+        weatherBot.schedule_tweets(events, settings, 'America/Chicago', after)
+        weatherBot.schedule_tweets(events, settings, 'Europe/Copenhagen', after)
+        due = events.pop_due(after + datetime.timedelta(days=1))
+        self.assertEqual([('conditions', 15), ('conditions', 18), ('conditions', 22), ('forecast', 6),
+                          ('conditions', 7), ('conditions', 12)],
+                         [(event.kind, event.tweet_time.hour) for event in due])
+        self.assertEqual(pytz.utc.localize(datetime.datetime(2016, 10, 14, 13, 0)), due[0].due)
+
+    @replace('requests.get', mocked_requests_get)
+    def test_handle_events(self):
+        """Testing that polls fetch the weather and queue scheduled tweets that use it"""
+        weatherBot.load_config(os.path.abspath('weatherBot.conf'))
+        with open('strings.yml', 'r') as file_stream:
+            weatherbot_strings = yaml.safe_load(file_stream)
+        settings = weatherBot.default_location_settings()
+        states = {settings['id']: {'settings': settings,
+                                   'wb_string': models.WeatherBotString(weatherbot_strings),
+                                   'weather_data': None,
+                                   'timezone': None}}
+        forecast = forecastio.manual(os.path.join('fixtures', 'us.json'))
+        now = pytz.utc.localize(datetime.datetime(2016, 10, 14, 10, 1))
+        events = scheduler.Scheduler()
+        events.push(now, 'poll', settings['id'])
+        do_tweet = Mock()
+        with ThreadPoolExecutor(max_workers=1) as pool, Replacer() as replacer:
+            replacer.replace('weatherBot.get_forecast_object', lambda *args, **kwargs: forecast)
+            replacer.replace('weatherBot.do_tweet', do_tweet)
+            replacer.replace('weatherBot.STATE', state.StateStore(':memory:'))
+            weatherBot.get_throttles(weatherBot.DEFAULT_LOCATION_ID).conditions['default'] = now
+            replacer.replace('weatherBot.CLOCK', Mock(now=lambda: now))
+            weatherBot.handle_events(pool, events, states, events.pop_due(now), now)
+            self.assertEqual('Europe/Copenhagen', states[settings['id']]['timezone'])
+            # 12:00 in Copenhagen was within the last refresh period, so it is caught up on
+            due = events.pop_due(now)
+            self.assertEqual([('conditions', utils.Time(hour=12, minute=0))],
+                             [(event.kind, event.tweet_time) for event in due])
+            weatherBot.handle_events(pool, events, states, due, now)
+            self.assertIn(do_tweet.call_args[0][0], states[settings['id']]['wb_string'].normal_conditions)
+            due = events.pop_due(now + datetime.timedelta(minutes=3))
+            self.assertEqual(['poll'], [event.kind for event in due])
+            self.assertEqual(pytz.utc.localize(datetime.datetime(2016, 10, 14, 13, 0)), events.next_due())
+
+    @replace('requests.get', mocked_requests_get)
+    def test_scheduled_tweet(self):
+        """Testing that scheduled tweets use the forecast or normal strings"""
+        weatherBot.load_config(os.path.abspath('weatherBot.conf'))
+        with open('strings.yml', 'r') as file_stream:
+            weatherbot_strings = yaml.safe_load(file_stream)
+        weatherbot_strings['forecast_endings'] = []
+        wbs = models.WeatherBotString(weatherbot_strings)
+        wd = models.WeatherData(forecastio.manual(os.path.join('fixtures', 'us.json')), self.location)
+        settings = weatherBot.default_location_settings()
+        do_tweet = Mock()
+        with Replacer() as replacer:
+            replacer.replace('weatherBot.do_tweet', do_tweet)
+            weatherBot.scheduled_tweet('forecast', wd, wbs, settings)
+            self.assertIn(do_tweet.call_args[0][0], wbs.forecasts)
+            weatherBot.scheduled_tweet('conditions', wd, wbs, settings)
+            self.assertIn(do_tweet.call_args[0][0], wbs.normal_conditions)
+            self.assertEqual(settings['hashtag'], do_tweet.call_args[1]['hashtag'])
+
     def test_logging(self):
         """Testing if the system version is in the log and log file"""
         with LogCapture() as l:
             logger = logging.getLogger()
             logger.info('info')
-            weatherBot.initialize_logger(True, os.path.abspath('weatherBotTest.log'))
+            writer = logs.initialize_logger(True, os.path.abspath('weatherBotTest.log'))
             logger.debug('debug')
             logger.warning('uh oh')
+            # the log file is written in the background until the writer is stopped
+            writer.stop()
         l.check(('root', 'INFO', 'info'), ('root', 'INFO', 'Starting weatherBot with Python ' + sys.version),
                 ('root', 'DEBUG', 'debug'), ('root', 'WARNING', 'uh oh'))
         path = os.path.join(os.getcwd(), 'weatherBotTest.log')
@@ -736,14 +1255,38 @@ class TestWB(unittest.TestCase):
         api = weatherBot.get_tweepy_api()
         self.assertTrue(type(api) is tweepy.API)
 
-    @replace('forecastio.load_forecast', mocked_forecastio_load_forecast)
+    @replace('clients.DarkSkyClient.load_forecast', mocked_forecastio_load_forecast)
     def test_get_forecast_object(self):
         """Testing getting the forecastio object"""
         forecast = weatherBot.get_forecast_object(self.location.lat, self.location.lng, units='us', lang='de')
-        self.assertEqual(forecast.response.status_code, 200)
-        self.assertEqual(forecast.json['flags']['units'], 'us')
-
-    @replace('forecastio.load_forecast', mocked_forecastio_load_forecast_error)
+        self.assertEqual(forecast['flags']['units'], 'us')
+
+    def test_get_forecast_object_minutely(self):
+        """Testing that minutely is requested when adaptive polling is enabled, so coming precipitation is active"""
+
+        def session_get(url, params=None, timeout=None):
+            response = mocked_darksky_session_get('https://darksky.test/forecast/us_cincinnati/1,2', params, timeout)
+            data = response.json()
+            # calm right now, with precipitation in the minutely forecast
+            data['currently'].update(precipIntensity=0, precipProbability=0)
+            del data['alerts']
+            response.content = json.dumps(data).encode()
+            return response
+
+        weatherBot.load_config(os.path.abspath('weatherBot.conf'))
+        with Replacer() as replacer:
+            replacer.replace('requests.Session.get', Mock(side_effect=session_get))
+            replacer.replace('weatherBot.DARKSKY', clients.DarkSkyClient())
+            for enabled in (False, True):
+                replacer.replace('weatherBot.FORECASTS', cache.ForecastCache(ttl=300))
+                weatherBot.CONFIG['adaptive_polling']['enabled'] = enabled
+                forecast = weatherBot.get_forecast_object(self.location.lat, self.location.lng)
+                self.assertEqual(enabled, polling.is_active(models.WeatherData(forecast, self.location)))
+        # only the parts WeatherData reads are cached
+        self.assertEqual({'flags', 'timezone', 'currently', 'daily', 'alerts', 'minutely'}, set(forecast))
+        self.assertEqual(1, len(forecast['daily']['data']))
+
+    @replace('clients.DarkSkyClient.load_forecast', mocked_forecastio_load_forecast_error)
     def test_get_forecast_object_error(self):
         """Testing getting the forecastio object"""
         bad_forecast = weatherBot.get_forecast_object(45.5, 123.45)
@@ -784,6 +1327,83 @@ class TestWB(unittest.TestCase):
         fallback_loc = models.WeatherLocation(4, 3, 'test')
         self.assertEqual(weatherBot.get_location_from_user_timeline('no tweets', fallback_loc), fallback_loc)
 
+    @replace('weatherBot.get_tweepy_api', mocked_get_tweepy_api)
+    def test_get_location_from_user_timeline_since_id(self):
+        """Testing that later polls only read new tweets, and keep the location that was found before"""
+        fallback_loc = models.WeatherLocation(4, 3, 'test')
+        with Replacer() as replacer:
+            tracker = timeline.TimelineTracker()
+            replacer.replace('weatherBot.TIMELINES', tracker)
+            self.assertEqual(models.WeatherLocation(2, 1, 'test'),
+                             weatherBot.get_location_from_user_timeline('since', fallback_loc))
+            self.assertEqual(models.WeatherLocation(2, 1, 'test'),
+                             weatherBot.get_location_from_user_timeline('since', fallback_loc))
+        self.assertDictEqual({'polls': 2, 'tweets': 1, 'bytes': 25, 'saved_bytes': 25, 'saved_calls': 1},
+                             tracker.stats())
+
+    @replace('weatherBot.get_tweepy_api', mocked_get_tweepy_api)
+    def test_locate_locations(self):
+        """Testing that a location that moved is polled right away"""
+        weatherBot.load_config(os.path.abspath('weatherBot.conf'))
+        settings = weatherBot.default_location_settings()
+        states = {settings['id']: {'settings': settings}}
+        now = pytz.utc.localize(datetime.datetime(2016, 10, 14, 10, 1))
+        events = scheduler.Scheduler()
+        events.push(now + datetime.timedelta(minutes=2), 'poll', settings['id'])
+        with ThreadPoolExecutor(max_workers=1) as pool, Replacer() as replacer:
+            replacer.replace('weatherBot.TIMELINES', timeline.TimelineTracker())
+            weatherBot.CONFIG['variable_location']['user'] = 'nocoords'
+            self.assertEqual([settings['id']], weatherBot.locate_locations(pool, events, states, [settings['id']], now))
+            self.assertEqual(models.WeatherLocation(5.0, 4.0, 'cool place'), settings['location'])
+            self.assertEqual([], weatherBot.locate_locations(pool, events, states, [settings['id']], now))
+            # none of the latest tweets has a location anymore, so the default location is used again
+            weatherBot.CONFIG['variable_location']['user'] = 'no tweets'
+            self.assertEqual([settings['id']], weatherBot.locate_locations(pool, events, states, [settings['id']], now))
+            self.assertEqual(weatherBot.CONFIG['default_location'], settings['location'])
+        self.assertEqual([('locate', now + datetime.timedelta(minutes=30))] * 3,
+                         [(event.kind, event.due) for event in events.pop_due(now + datetime.timedelta(hours=1))])
+
+    @replace('weatherBot.get_tweepy_api', mocked_get_tweepy_api)
+    def test_locate_locations_min_distance(self):
+        """Testing that a move shorter than the configured min_distance keeps the current location"""
+        weatherBot.load_config(os.path.abspath('weatherBot.conf'))
+        weatherBot.CONFIG['variable_location']['min_distance'] = 1000.0
+        settings = weatherBot.default_location_settings()
+        states = {settings['id']: {'settings': settings}}
+        now = pytz.utc.localize(datetime.datetime(2016, 10, 14, 10, 1))
+        events = scheduler.Scheduler()
+        with ThreadPoolExecutor(max_workers=1) as pool, Replacer() as replacer:
+            replacer.replace('weatherBot.TIMELINES', timeline.start_tracker(weatherBot.CONFIG['variable_location']))
+            weatherBot.CONFIG['variable_location']['user'] = 'nocoords'
+            self.assertEqual([settings['id']], weatherBot.locate_locations(pool, events, states, [settings['id']], now))
+            # about 55 km from cool place
+            tweet = Mock(coordinates={'coordinates': [4.5, 5.0]}, place=None, id=1001, _json={'id': 1001})
+            replacer.replace('weatherBot.get_tweepy_api', lambda: Mock(user_timeline=Mock(return_value=[tweet])))
+            self.assertEqual([], weatherBot.locate_locations(pool, events, states, [settings['id']], now))
+            self.assertEqual(models.WeatherLocation(5.0, 4.0, 'cool place'), settings['location'])
+
+    def test_locate_locations_shared_timeline(self):
+        """Testing that the timeline of a user is read once for all of the locations that follow them"""
+        weatherBot.load_config(os.path.abspath('weatherBot.conf'))
+        states = {}
+        for location_id in ('home', 'work', 'cabin'):
+            settings = weatherBot.default_location_settings()
+            settings['id'] = location_id
+            states[location_id] = {'settings': settings}
+        now = pytz.utc.localize(datetime.datetime(2016, 10, 14, 10, 1))
+        events = scheduler.Scheduler()
+        tweet = Mock(coordinates={'coordinates': [4.0, 5.0]}, place=None, id=1001, _json={'id': 1001})
+        user_timeline = Mock(return_value=[tweet])
+        with ThreadPoolExecutor(max_workers=3) as pool, Replacer() as replacer:
+            replacer.replace('weatherBot.TIMELINES', timeline.TimelineTracker())
+            replacer.replace('weatherBot.get_tweepy_api', lambda: Mock(user_timeline=user_timeline))
+            self.assertEqual(['home', 'work', 'cabin'],
+                             weatherBot.locate_locations(pool, events, states, ['home', 'work', 'cabin'], now))
+        self.assertEqual(1, user_timeline.call_count)
+        for state in states.values():
+            self.assertEqual((5.0, 4.0), (state['settings']['location'].lat, state['settings']['location'].lng))
+        self.assertEqual(3, len(events.pop_due(now + datetime.timedelta(hours=1))))
+
     @replace('weatherBot.get_tweepy_api', mocked_get_tweepy_api)
     def test_get_location_from_user_timeline_error(self):
         """Testing getting a location from twitter account's recent tweets when there is an error"""
@@ -840,6 +1460,61 @@ class TestWB(unittest.TestCase):
         status = weatherBot.do_tweet(content, self.location, tweet_location, variable_location)
         self.assertEqual(status.text, tweet_content)
 
+    @replace('weatherBot.get_tweepy_api', mocked_get_tweepy_api)
+    def test_queue_tweet(self):
+        """Testing that tweets are queued when the outbox is running, and posted right away otherwise"""
+        content = 'Just running unit tests, this should disappear...'
+        self.assertEqual(content + ' #testing',
+                         weatherBot.queue_tweet(content, self.location, False, False, hashtag='#testing').text)
+        queue = outbox.Outbox(Mock(), clients.is_retryable_error)
+        with Replacer() as replacer:
+            replacer.replace('weatherBot.OUTBOX', queue)
+            replacer.replace('clients.env_account', lambda: clients.Account('key', 'secret', 'token', 'secret'))
+            self.assertIsNone(weatherBot.queue_tweet(content, self.location, True, True, hashtag='#testing',
+                                                     location_id='testing'))
+        self.assertEqual(1, queue.depth())
+        self.assertEqual(0.0, queue.run_once())
+        account, status = queue.send.call_args[0]
+        self.assertEqual(clients.account_id(clients.Account('key', 'secret', 'token', 'secret')), account)
+        self.assertNotIn('token', account)
+        self.assertDictEqual({'status': self.location.name + ': ' + content + ' #testing',
+                              'lat': self.location.lat, 'long': self.location.lng, 'location_id': 'testing'}, status)
+        queue.close()
+
+    @replace('weatherBot.get_tweepy_api', mocked_get_tweepy_api)
+    def test_send_status(self):
+        """Testing that errors posting a queued status are raised so the outbox can retry"""
+        account = clients.account_id(clients.env_account())
+        weatherBot.send_status(account, {'status': 'queued'})
+        with self.assertRaises(tweepy.TweepError):
+            weatherBot.send_status(account, {'status': 'error'})
+
+    def test_send_status_location(self):
+        """Testing that the location a status was queued for labels its timing and is not posted to Twitter"""
+        registry = metrics.Registry(metrics.DEFINITIONS)
+        update_status = Mock()
+        with Replacer() as replacer:
+            replacer.replace('weatherBot.METRICS', registry)
+            replacer.replace('weatherBot.get_tweepy_api', lambda: Mock(update_status=update_status))
+            weatherBot.send_status(clients.account_id(clients.env_account()), {'status': 'hi', 'location_id': 'home'})
+            weatherBot.do_tweet('hi', self.location, False, False, location_id='away')
+        update_status.assert_called_with(status='hi')
+        self.assertEqual(2, update_status.call_count)
+        lines = registry.render().splitlines()
+        self.assertIn('weatherbot_tweet_seconds_count{location="home",outcome="success"} 1', lines)
+        self.assertIn('weatherbot_tweet_seconds_count{location="away",outcome="success"} 1', lines)
+
+    def test_send_status_other_account(self):
+        """Testing that a status queued for an account without credentials is not posted with other ones"""
+        update_status = Mock()
+        with Replacer() as replacer:
+            replacer.replace('weatherBot.get_tweepy_api', lambda: Mock(update_status=update_status))
+            with self.assertRaises(LookupError) as context:
+                weatherBot.send_status(clients.account_id(clients.Account('key', 'secret', 'old', 'secret')),
+                                       {'status': 'queued'})
+        self.assertFalse(clients.is_retryable_error(context.exception))
+        update_status.assert_not_called()
+
     @replace('weatherBot.get_tweepy_api', mocked_get_tweepy_api)
     def test_do_tweet_error(self):
         """Testing tweeting a test tweet that should throw and error using keys from env variables"""
@@ -853,13 +1528,16 @@ class TestWB(unittest.TestCase):
         """Testing that an expired, non-default key will be removed from a dict"""
         now = pytz.utc.localize(datetime.datetime(2016, 10, 14, hour=14, minute=42)).astimezone(pytz.utc)
         base = {'default': now - datetime.timedelta(hours=2)}
-        a = base
-        a['snow-light'] = now + datetime.timedelta(minutes=20)
-        self.assertDictEqual(a, weatherBot.cleanse_throttles(a, now))
-        b = base
-        b['dummy'] = now - datetime.timedelta(hours=3)
-        self.assertDictEqual(base, weatherBot.cleanse_throttles(b, now))
-        self.assertDictEqual({}, weatherBot.cleanse_throttles({}, now))
+        a = state.Throttles(base)
+        a.conditions['snow-light'] = now + datetime.timedelta(minutes=20)
+        self.assertDictEqual(dict(a.conditions), dict(weatherBot.cleanse_throttles(a, now).conditions))
+        b = state.Throttles(a.conditions)
+        b.conditions['dummy'] = now - datetime.timedelta(hours=3)
+        self.assertDictEqual(dict(a.conditions), dict(weatherBot.cleanse_throttles(b, now).conditions))
+        c = state.Throttles(alerts={'sha': now, 'later': now + datetime.timedelta(minutes=1)})
+        self.assertDictEqual({'later': now + datetime.timedelta(minutes=1)},
+                             weatherBot.cleanse_throttles(c, now).alerts)
+        self.assertEqual(state.Throttles(), weatherBot.cleanse_throttles(state.Throttles(), now))
 
     def test_set_cache(self):
         """Testing that set_cache properly saves a dict"""
@@ -880,6 +1558,1116 @@ class TestWB(unittest.TestCase):
         os.remove('testgetcache.p')
 
 
+class TestLogs(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.level = self.logger.level
+        self.paths = [os.path.abspath(name) for name in ('weatherBotTest.log', 'weatherBotTest.log.1',
+                                                         'weatherBotTest.jsonl', 'weatherBotTest.jsonl.1')]
+        self.console = io.StringIO()
+        self.writer = None
+
+    def tearDown(self):
+        if self.writer is not None:
+            self.writer.stop()
+        self.logger.setLevel(self.level)
+        for path in self.paths:
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def start_writer(self, **kwargs):
+        """
+        Start the background logger with its console handler writing to self.console
+        """
+        with Replacer() as replacer:
+            replacer.replace('sys.stderr', self.console)
+            self.writer = logs.initialize_logger(True, self.paths[0], **kwargs)
+
+    def stop_writer(self):
+        """
+        Write every queued record, then remove the handlers from the root logger
+        """
+        self.writer.stop()
+        self.writer = None
+        self.assertFalse(any(isinstance(handler, logs.RecordQueueHandler) for handler in self.logger.handlers))
+
+    def test_json_rotation(self):
+        """Testing that the log files are rotated, JSON lines are written, and unwritten debug records are skipped"""
+        self.start_writer(level='info', max_bytes=400, backups=1, json_path=self.paths[2])
+        self.assertFalse(self.logger.isEnabledFor(logging.DEBUG))
+        for i in range(20):
+            self.logger.info('line %d "quoted"', i)
+        try:
+            raise ValueError('bad value')
+        except ValueError:
+            self.logger.error('failed %d', 1, exc_info=True)
+        self.stop_writer()
+        self.assertTrue(all(os.path.isfile(path) for path in self.paths))
+        lines = []
+        for path in (self.paths[3], self.paths[2]):
+            with open(path, 'r', encoding='utf-8') as file_stream:
+                lines.extend(json.loads(text) for text in file_stream)
+        line, failed = lines[-2:]
+        self.assertEqual('failed 1', failed['message'])
+        self.assertIn('ValueError: bad value', failed['exc_info'])
+        self.assertNotIn('exc_info', line)
+        self.assertEqual('INFO', line['level'])
+        self.assertEqual('line 19 "quoted"', line['message'])
+        self.assertEqual('root', line['logger'])
+        # the console gets the same records, and nothing is written to the real console
+        self.assertIn('line 19 "quoted"', self.console.getvalue())
+        self.assertIn('ValueError: bad value', self.console.getvalue())
+
+
+class TestClients(unittest.TestCase):
+    def setUp(self):
+        self.account = clients.Account('key', 'secret', 'token', 'token secret')
+        self.other_account = clients.Account('other key', 'other secret', 'other token', 'other token secret')
+
+    @replace('tweepy.OAuthHandler', mocked_tweepy_o_auth_handler)
+    def test_get(self):
+        """Testing that one tweepy API is built per account and then reused"""
+        twitter = clients.TwitterClients()
+        api = twitter.get(self.account)
+        self.assertTrue(type(api) is tweepy.API)
+        self.assertIs(api, twitter.get(self.account))
+        self.assertIsNot(api, twitter.get(self.other_account))
+        self.assertEqual(2, twitter.builds)
+
+    @replace('tweepy.OAuthHandler', mocked_tweepy_o_auth_handler)
+    def test_report_error(self):
+        """Testing that a tweepy API is only rebuilt after an auth or connection error"""
+        twitter = clients.TwitterClients()
+        api = twitter.get(self.account)
+        twitter.report_error(self.account, tweepy.TweepError('Status is a duplicate.', api_code=187))
+        self.assertIs(api, twitter.get(self.account))
+        twitter.report_error(self.account, tweepy.TweepError('Could not authenticate you.', api_code=32))
+        rebuilt = twitter.get(self.account)
+        self.assertIsNot(api, rebuilt)
+        twitter.report_error(self.account, tweepy.TweepError('Failed to send request: connection refused'))
+        self.assertIsNot(rebuilt, twitter.get(self.account))
+        self.assertEqual(3, twitter.builds)
+
+    def test_is_retryable_error(self):
+        """Testing that only rate limit, server, and connection errors are worth retrying"""
+        response = requests.Response()
+        response.status_code = 503
+        self.assertTrue(clients.is_retryable_error(tweepy.TweepError('Over capacity', response=response)))
+        response.status_code = 429
+        self.assertTrue(clients.is_retryable_error(tweepy.TweepError('Too Many Requests', response=response)))
+        self.assertTrue(clients.is_retryable_error(tweepy.TweepError('Rate limit exceeded', api_code=88)))
+        self.assertTrue(clients.is_retryable_error(tweepy.TweepError('Failed to send request: timed out')))
+        response.status_code = 403
+        self.assertFalse(clients.is_retryable_error(tweepy.TweepError('Status is a duplicate.', response=response,
+                                                                      api_code=187)))
+        self.assertFalse(clients.is_retryable_error(ValueError('not from Twitter')))
+
+    def test_keep_alive_adapter(self):
+        """Testing that closing a session leaves the pooled connections of a KeepAliveAdapter open"""
+        adapter = adapters.KeepAliveAdapter()
+        adapter.get_connection('https://api.twitter.com/1.1/statuses/update.json')
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.close()
+        self.assertEqual(1, len(adapter.poolmanager.pools))
+        adapter.reset()
+        self.assertEqual(0, len(adapter.poolmanager.pools))
+
+    def test_install_adapter(self):
+        """Testing that sessions created by tweepy use the installed adapter"""
+        original = tweepy.binder.requests
+        with Replacer() as replacer:
+            # put back whatever tweepy used before, so other tests are not affected
+            replacer.replace('tweepy.binder.requests', original)
+            adapter = adapters.KeepAliveAdapter()
+            adapters.install_adapter(adapter)
+            session = tweepy.binder.requests.Session()
+            self.assertIs(adapter, session.get_adapter('https://api.twitter.com'))
+            self.assertIs(requests.exceptions, tweepy.binder.requests.exceptions)
+            other = adapters.KeepAliveAdapter()
+            adapters.install_adapter(other)
+            self.assertIs(other, tweepy.binder.requests.Session().get_adapter('https://api.twitter.com'))
+        self.assertIs(original, tweepy.binder.requests)
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.send = Mock()
+        self.outbox = outbox.Outbox(self.send, clients.is_retryable_error, limit=2, window=60, retries=2,
+                                    retry_delay=4, max_retry_delay=6, clock=lambda: self.now)
+
+    def tearDown(self):
+        self.outbox.close()
+
+    def test_token_bucket(self):
+        """Testing that a token bucket refills evenly over its window"""
+        bucket = outbox.TokenBucket(3, 30, clock=lambda: self.now)
+        self.assertTrue(all(bucket.take() for _ in range(3)))
+        self.assertFalse(bucket.take())
+        self.assertAlmostEqual(10, bucket.delay())
+        self.now += 10
+        self.assertEqual(0, bucket.delay())
+        self.assertTrue(bucket.take())
+        self.now += 1000
+        bucket.empty()
+        self.assertAlmostEqual(10, bucket.delay())
+
+    def test_run_once(self):
+        """Testing that queued tweets are posted in order until the account's rate limit is reached"""
+        self.assertIsNone(self.outbox.run_once())
+        for text in ('one', 'two', 'three'):
+            self.outbox.put('token', {'status': text})
+        self.assertEqual(3, self.outbox.depth())
+        self.assertEqual(0.0, self.outbox.run_once())
+        self.assertEqual(0.0, self.outbox.run_once())
+        self.assertAlmostEqual(30, self.outbox.run_once())
+        self.assertEqual([(('token', {'status': 'one'}),), (('token', {'status': 'two'}),)],
+                         [call[0:1] for call in self.send.call_args_list])
+        self.now += 30
+        self.assertEqual(0.0, self.outbox.run_once())
+        self.send.assert_called_with('token', {'status': 'three'})
+        self.assertDictEqual({'depth': 0, 'sent': 3, 'retried': 0, 'dropped': 0}, self.outbox.stats())
+
+    def test_accounts(self):
+        """Testing that each account has its own rate limit"""
+        for account in ('a', 'a', 'a', 'b'):
+            self.outbox.put(account, {'status': 'hi'})
+        self.assertEqual([0.0, 0.0, 0.0], [self.outbox.run_once() for _ in range(3)])
+        self.assertEqual(['a', 'a', 'b'], [call[0][0] for call in self.send.call_args_list])
+        self.assertEqual(1, self.outbox.depth())
+
+    def test_retry(self):
+        """Testing that retryable errors are tried again after a jittered backoff, and other errors are dropped"""
+        response = requests.Response()
+        response.status_code = 503
+        self.send.side_effect = tweepy.TweepError('Over capacity', response=response)
+        self.outbox.put('token', {'status': 'retried'})
+        with LogCapture():
+            self.assertEqual(0.0, self.outbox.run_once())
+            wait = self.outbox.run_once()
+            self.assertTrue(0 <= wait <= 4)
+            self.now += wait
+            self.assertEqual(0.0, self.outbox.run_once())
+            # the third attempt waits for the token used by the first
+            self.now += 30
+            self.assertEqual(0.0, self.outbox.run_once())
+            self.assertIsNone(self.outbox.run_once())
+            self.send.side_effect = tweepy.TweepError('Status is a duplicate.', api_code=187)
+            self.outbox.put('token', {'status': 'dropped'})
+            self.now += 60
+            self.assertEqual(0.0, self.outbox.run_once())
+        self.assertEqual(4, self.send.call_count)
+        self.assertDictEqual({'depth': 0, 'sent': 0, 'retried': 2, 'dropped': 2}, self.outbox.stats())
+        for attempts in range(1, 10):
+            self.assertTrue(0 <= self.outbox.backoff(attempts) <= min(6, 4 * 2 ** (attempts - 1)))
+
+    def test_rate_limited(self):
+        """Testing that a 429 from Twitter empties the account's token bucket"""
+        response = requests.Response()
+        response.status_code = 429
+        self.send.side_effect = tweepy.TweepError('Too Many Requests', response=response)
+        self.outbox.put('token', {'status': 'limited'})
+        with LogCapture():
+            self.outbox.run_once()
+        self.assertAlmostEqual(30, self.outbox.bucket('token').delay())
+
+    def test_persistence(self):
+        """Testing that queued tweets survive closing and opening the database"""
+        path = os.path.join(os.getcwd(), 'outboxTest.db')
+        queue = outbox.Outbox(self.send, clients.is_retryable_error, path=path)
+        queue.put('token', {'status': 'saved', 'lat': 1.5, 'long': 2.5})
+        queue.close()
+        queue = outbox.Outbox(self.send, clients.is_retryable_error, path=path)
+        self.assertEqual(1, queue.depth())
+        self.assertEqual(0.0, queue.run_once())
+        self.send.assert_called_once_with('token', {'status': 'saved', 'lat': 1.5, 'long': 2.5})
+        queue.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    def test_start_stop(self):
+        """Testing that the background worker posts tweets as they are queued"""
+        posted = threading.Event()
+        self.send.side_effect = lambda account, status: posted.set()
+        self.outbox.start()
+        self.outbox.put('token', {'status': 'background'})
+        self.assertTrue(posted.wait(5))
+        self.outbox.stop()
+        self.send.assert_called_once_with('token', {'status': 'background'})
+
+
+class TestTimelineTracker(unittest.TestCase):
+    class Tweet:
+        def __init__(self, tweet_id, lat=None, lng=None):
+            self.id = tweet_id
+            self.coordinates = None if lat is None else {'coordinates': [lng, lat]}
+            self.place = None
+            self._json = {'id': tweet_id, 'text': 'x' * tweet_id}
+
+    def setUp(self):
+        self.timelines = []
+        self.api = Mock()
+        self.api.user_timeline.side_effect = lambda **kwargs: self.timelines.pop(0)
+        self.tracker = timeline.TimelineTracker(min_distance=1.0, count=3)
+
+    def test_since_id(self):
+        """Testing that only tweets newer than the last poll are requested, and the bytes that saves"""
+        self.timelines = [[self.Tweet(3), self.Tweet(2, 45.585, -95.91), self.Tweet(1)], [], [self.Tweet(4)]]
+        poll = self.tracker.poll(self.api, 'user', 'unnamed')
+        self.assertEqual(timeline.TimelinePoll('user', models.WeatherLocation(45.585, -95.91, 'unnamed'), True, 3,
+                                               60, 0), poll)
+        self.assertNotIn('since_id', self.api.user_timeline.call_args[1])
+        poll = self.tracker.poll(self.api, 'user', 'unnamed')
+        self.assertEqual(3, self.api.user_timeline.call_args[1]['since_id'])
+        self.assertEqual((False, 0, 0, 60), (poll.moved, poll.tweets, poll.bytes, poll.saved_bytes))
+        self.assertEqual(models.WeatherLocation(45.585, -95.91, 'unnamed'), poll.location)
+        # one new tweet, so the two newest of the old tweets would have been read again
+        poll = self.tracker.poll(self.api, 'user', 'unnamed')
+        self.assertEqual(3, self.api.user_timeline.call_args[1]['since_id'])
+        self.assertEqual((1, 22, 41), (poll.tweets, poll.bytes, poll.saved_bytes))
+        self.assertDictEqual({'polls': 3, 'tweets': 4, 'bytes': 82, 'saved_bytes': 101, 'saved_calls': 2},
+                             self.tracker.stats())
+
+    def test_min_distance(self):
+        """Testing that a location only changes when it moves more than the min distance"""
+        self.timelines = [[self.Tweet(1, 45.585, -95.91)], [self.Tweet(2, 45.59, -95.91)],
+                          [self.Tweet(3, 45.6, -95.91)], [self.Tweet(4)]]
+        self.assertTrue(self.tracker.poll(self.api, 'user', 'unnamed').moved)
+        poll = self.tracker.poll(self.api, 'user', 'unnamed')
+        self.assertFalse(poll.moved)
+        self.assertEqual(45.585, poll.location.lat)
+        poll = self.tracker.poll(self.api, 'user', 'unnamed')
+        self.assertTrue(poll.moved)
+        self.assertEqual(45.6, poll.location.lat)
+        self.assertEqual(45.6, self.tracker.poll(self.api, 'user', 'unnamed').location.lat)
+        self.assertIsNone(timeline.TimelineTracker().poll(Mock(user_timeline=Mock(return_value=[])), 'other',
+                                                          'unnamed').location)
+
+    def test_location_expires(self):
+        """Testing that the location is dropped once its tweet is no longer one of the latest count tweets"""
+        self.timelines = [[self.Tweet(2), self.Tweet(1, 45.585, -95.91)], [self.Tweet(3)], [self.Tweet(4)],
+                          [self.Tweet(5, 45.585, -95.91)]]
+        self.assertEqual(45.585, self.tracker.poll(self.api, 'user', 'unnamed').location.lat)
+        # tweets 3, 2, and 1 are the latest 3, so the location is still found
+        poll = self.tracker.poll(self.api, 'user', 'unnamed')
+        self.assertEqual((False, 45.585), (poll.moved, poll.location.lat))
+        poll = self.tracker.poll(self.api, 'user', 'unnamed')
+        self.assertEqual((False, None), (poll.moved, poll.location))
+        poll = self.tracker.poll(self.api, 'user', 'unnamed')
+        self.assertEqual((True, 45.585), (poll.moved, poll.location.lat))
+
+
+class TestNowcast(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join('fixtures', 'us.json'), 'r') as file_stream:
+            self.data = json.load(file_stream)
+        with open('strings.yml', 'r') as file_stream:
+            self.weatherbot_strings = yaml.safe_load(file_stream)
+        self.now = self.data['currently']['time']
+        self.location = models.WeatherLocation(55.76, 12.49, 'Lyngby-Taarbæk, Hovedstaden')
+
+    def minutely(self, intensities):
+        """Build a minutely block starting a minute before now with the given rain intensities"""
+        return {'data': [{'time': self.now - 60 + 60 * i, 'precipIntensity': intensity, 'precipProbability': 0.9,
+                          'precipType': 'rain'} for i, intensity in enumerate(intensities)]}
+
+    def test_load_series(self):
+        """Testing that points after now are loaded in order, with precipitation from minutely while it covers"""
+        self.data['minutely'] = self.minutely([0.5] * 61)
+        rows = nowcast.load_series(self.data, 120)
+        self.assertEqual(list(range(1, 60)), [round(row[0]) for row in rows if math.isnan(row[1])])
+        self.assertTrue(all(0 < row[0] <= 120 for row in rows))
+        self.assertEqual(sorted(row[0] for row in rows), [row[0] for row in rows])
+        hourly = [row for row in rows if not math.isnan(row[1])]
+        self.assertEqual(2, len(hourly))
+        self.assertTrue(math.isnan(hourly[0][5]))
+        self.assertEqual(0, hourly[1][5])
+        self.assertEqual([], nowcast.load_series({'currently': {'time': self.now}}, 60))
+
+    def test_classify_matches_special(self):
+        """Testing that classifying a row gives the same condition as WeatherBotString.special"""
+        rand = random.Random(42)
+        wbs = models.WeatherBotString(self.weatherbot_strings)
+        for units in ('us', 'si', 'ca', 'uk2'):
+            for _ in range(300):
+                currently = dict(self.data['currently'])
+                currently.update({
+                    'temperature': rand.uniform(-45, 125),
+                    'apparentTemperature': rand.uniform(-50, 125),
+                    'windSpeed': rand.uniform(0, 70),
+                    'humidity': rand.uniform(0, 1),
+                    'precipIntensity': rand.choice([0, 0.001, 0.002, 0.05, 0.3, 0.5, 3, 6]),
+                    'precipProbability': rand.choice([0, 0.5, 0.8, 1]),
+                    'precipType': rand.choice(nowcast.PRECIP_TYPES),
+                    'icon': rand.choice(['clear-day', 'fog', 'wind', 'medium-wind', 'heavy-wind'])
+                })
+                data = dict(self.data, currently=currently, flags={'units': units})
+                wbs.set_weather(models.WeatherData(data, self.location))
+                expected = wbs.special().type
+                row = nowcast.point_row(currently, currently['time'])
+                code = nowcast.classify([row], models.get_units(units), vectorized=False)[0]
+                self.assertEqual('normal' if expected == 'none' else expected,
+                                 'normal' if code == 0 else nowcast.CONDITIONS[code])
+
+    @unittest.skipIf(nowcast.numpy is None, 'NumPy is not installed')
+    def test_vectorized(self):
+        """Testing that the NumPy pass classifies every row the same as one row at a time"""
+        self.data['minutely'] = self.minutely([0, 0.001, 0.01, 0.05, 0.2, 0.5] * 10)
+        rows = nowcast.load_series(self.data, 48 * 60)
+        units = models.get_units('us')
+        self.assertEqual(nowcast.classify(rows, units, vectorized=False), nowcast.classify(rows, units,
+                                                                                           vectorized=True))
+
+    @unittest.skipIf(nowcast.numpy is None, 'NumPy is not installed')
+    def test_classify_default(self):
+        """Testing that NumPy is only used by default for series of at least VECTORIZE_ROWS rows"""
+        rows = nowcast.load_series(self.data, 48 * 60)
+        units = models.get_units('us')
+        self.assertLess(len(rows), nowcast.VECTORIZE_ROWS)
+        classify_array = Mock(wraps=nowcast.classify_array)
+        with Replacer() as replacer:
+            replacer.replace('nowcast.classify_array', classify_array)
+            nowcast.classify(rows, units)
+            classify_array.assert_not_called()
+            long_rows = (rows * nowcast.VECTORIZE_ROWS)[:nowcast.VECTORIZE_ROWS]
+            self.assertEqual(nowcast.classify(long_rows, units, vectorized=False), nowcast.classify(long_rows, units))
+            classify_array.assert_called_once()
+
+    def test_classify_batch(self):
+        """Testing that a batch mixing unit systems is classified the same as WeatherBotString.special"""
+        rand = random.Random(7)
+        wbs = models.WeatherBotString(self.weatherbot_strings)
+        weather_datas = []
+        expected = []
+        for _ in range(500):
+            currently = dict(self.data['currently'])
+            currently.update({
+                'temperature': rand.uniform(-45, 125),
+                'apparentTemperature': rand.uniform(-50, 125),
+                'windSpeed': rand.uniform(0, 70),
+                'humidity': rand.uniform(0, 1),
+                'precipIntensity': rand.choice([0, 0.001, 0.002, 0.05, 0.3, 0.5, 3, 6]),
+                'precipProbability': rand.choice([0, 0.5, 0.8, 1]),
+                'precipType': rand.choice(nowcast.PRECIP_TYPES),
+                'icon': rand.choice(['clear-day', 'fog', 'wind', 'medium-wind', 'heavy-wind'])
+            })
+            data = dict(self.data, currently=currently, flags={'units': rand.choice(nowcast.UNIT_SYSTEMS)})
+            weather_data = models.WeatherData(data, self.location)
+            wbs.set_weather(weather_data)
+            weather_datas.append(weather_data)
+            expected.append(wbs.special().type)
+        batch = nowcast.make_batch(weather_datas)
+        self.assertEqual(500, len(batch.units))
+        self.assertEqual(expected, nowcast.classify_batch(batch, vectorized=False))
+        if nowcast.numpy is not None:
+            self.assertEqual(expected, nowcast.classify_batch(batch, vectorized=True))
+        self.assertEqual([], nowcast.classify_batch(nowcast.make_batch([])))
+
+    def test_lookahead(self):
+        """Testing that the first special condition within the horizon is found"""
+        units = models.get_units('us')
+        self.assertIsNone(nowcast.lookahead(self.data, units, 60, vectorized=False))
+        self.data['minutely'] = self.minutely([0] * 20 + [0.2] * 41)
+        self.assertEqual(nowcast.Nowcast(type='moderate-rain', minutes=19),
+                         nowcast.lookahead(self.data, units, 60, vectorized=False))
+        self.assertIsNone(nowcast.lookahead(self.data, units, 15, vectorized=False))
+        del self.data['minutely']
+        self.data['hourly']['data'][2]['apparentTemperature'] = -40
+        self.assertEqual(nowcast.Nowcast(type='wind-chill', minutes=63),
+                         nowcast.lookahead(self.data, units, 120, vectorized=False))
+
+    def test_special_lookahead(self):
+        """Testing that WeatherBotString.special tweets about a condition that is about to start"""
+        self.data['minutely'] = self.minutely([0] * 10 + [0.2] * 51)
+        wd = models.WeatherData(self.data, self.location)
+        wbs = models.WeatherBotString(self.weatherbot_strings)
+        wbs.set_weather(wd)
+        self.assertEqual('normal', wbs.special().type)
+        self.weatherbot_strings['lookahead'] = ['{condition} in {minutes} minutes in {location}.']
+        wbs = models.WeatherBotString(self.weatherbot_strings, lookahead=60)
+        wbs.set_weather(wd)
+        self.assertEqual(models.Condition(type='moderate-rain',
+                                          text='moderate rain in 9 minutes in Lyngby-Taarbæk, Hovedstaden.'),
+                         wbs.special())
+        del self.weatherbot_strings['lookahead']
+        wbs = models.WeatherBotString(self.weatherbot_strings, lookahead=60)
+        wbs.set_weather(wd)
+        self.assertEqual('normal', wbs.special().type)
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.now = pytz.utc.localize(datetime.datetime(2016, 10, 14, 12, 0))
+        self.events = scheduler.Scheduler()
+
+    def test_pop_due(self):
+        """Testing that events are popped in the order they are due"""
+        self.assertIsNone(self.events.next_due())
+        self.events.push(self.now + datetime.timedelta(minutes=5), 'poll', 'b')
+        self.events.push(self.now, 'poll', 'a')
+        self.events.push(self.now + datetime.timedelta(minutes=1), 'forecast', 'a', utils.Time(hour=6, minute=0))
+        self.events.push(self.now, 'poll', 'c')
+        self.assertEqual(self.now, self.events.next_due())
+        self.assertEqual([('poll', 'a'), ('poll', 'c')],
+                         [(event.kind, event.location_id) for event in self.events.pop_due(self.now)])
+        self.assertEqual([], self.events.pop_due(self.now))
+        due = self.events.pop_due(self.now + datetime.timedelta(minutes=10))
+        self.assertEqual(['forecast', 'poll'], [event.kind for event in due])
+        self.assertEqual(utils.Time(hour=6, minute=0), due[0].tweet_time)
+        self.assertEqual(0, len(self.events))
+
+    def test_cancel(self):
+        """Testing that cancelled events are skipped and later events are kept"""
+        self.events.push(self.now, 'forecast', 'a')
+        self.events.push(self.now, 'poll', 'a')
+        self.events.push(self.now, 'forecast', 'b')
+        self.events.cancel('a', 'forecast')
+        self.events.push(self.now + datetime.timedelta(minutes=1), 'forecast', 'a')
+        due = self.events.pop_due(self.now + datetime.timedelta(minutes=1))
+        self.assertEqual([('poll', 'a', self.now), ('forecast', 'b', self.now),
+                          ('forecast', 'a', self.now + datetime.timedelta(minutes=1))],
+                         [(event.kind, event.location_id, event.due) for event in due])
+        self.events.push(self.now, 'poll', 'a')
+        self.events.cancel('a', 'poll')
+        self.assertIsNone(self.events.next_due())
+
+
+class TestPolling(unittest.TestCase):
+    def setUp(self):
+        self.location = models.WeatherLocation(55.76, 12.49, 'Lyngby-Taarbæk, Hovedstaden')
+        self.now = pytz.utc.localize(datetime.datetime(2016, 10, 14, 12, 0))
+
+    def weather_data(self, name):
+        with open(os.path.join('fixtures', name), 'r', encoding='utf-8') as file_stream:
+            return models.WeatherData(json.load(file_stream), self.location)
+
+    def test_is_active(self):
+        """Testing that alerts, precipitation, and precipitation in the minutely forecast are active weather"""
+        self.assertFalse(polling.is_active(self.weather_data('us.json')))
+        self.assertTrue(polling.is_active(self.weather_data('us_alert.json')))
+        self.assertTrue(polling.is_active(self.weather_data('us_cincinnati.json')))
+        with open(os.path.join('fixtures', 'us.json'), 'r', encoding='utf-8') as file_stream:
+            data = json.load(file_stream)
+        data['minutely'] = {'data': [{'time': 0}, {'time': 60, 'precipIntensity': 0}]}
+        self.assertFalse(polling.is_active(models.WeatherData(data, self.location)))
+        data['minutely']['data'].append({'time': 120, 'precipIntensity': 0.1})
+        self.assertTrue(polling.is_active(models.WeatherData(data, self.location)))
+        data['currently']['precipProbability'] = 0.5
+        del data['minutely']
+        self.assertFalse(polling.is_active(models.WeatherData(data, self.location), precip_probability=0.6))
+        self.assertTrue(polling.is_active(models.WeatherData(data, self.location), precip_probability=0.5))
+
+    def test_next_interval(self):
+        """Testing that calm weather is polled less often each time, and active weather right away"""
+        poller = polling.AdaptivePoller(3, min_refresh=1, max_refresh=15, budget=100000)
+        calm = self.weather_data('us.json')
+        active = self.weather_data('us_alert.json')
+        self.assertEqual([3, 6, 12, 15, 15], [poller.next_interval('calm', calm, self.now, 1) for _ in range(5)])
+        self.assertEqual(1, poller.next_interval('calm', active, self.now, 1))
+        self.assertEqual([3, 6], [poller.next_interval('calm', calm, self.now, 1) for _ in range(2)])
+        self.assertEqual(1, poller.next_interval('active', active, self.now, 1))
+        self.assertEqual({'polls': 9, 'baseline_polls': round(62 / 3, 1), 'saved': round(62 / 3 - 9, 1)},
+                         poller.stats())
+
+    def test_budget(self):
+        """Testing that polls are slowed down so the budget lasts the day, and stop once it is spent"""
+        poller = polling.AdaptivePoller(3, min_refresh=1, budget=720)
+        active = self.weather_data('us_alert.json')
+        # 720 minutes are left today, so 10 locations can be polled every 10 minutes
+        self.assertEqual(720, polling.minutes_left_today(self.now))
+        self.assertEqual(10, poller.next_interval('active', active, self.now, 10, 'key'))
+        self.assertEqual(1, poller.next_interval('active', active, self.now, 1, 'other'))
+        for _ in range(720):
+            poller.spend('key', self.now)
+        self.assertEqual(0, poller.call_budget('key').remaining(self.now))
+        self.assertEqual(720, poller.next_interval('active', active, self.now, 10, 'key'))
+        tomorrow = self.now + datetime.timedelta(hours=12)
+        self.assertEqual(720, poller.call_budget('key').remaining(tomorrow))
+
+    def test_budget_saved(self):
+        """Testing that the calls made today are saved, without the API key, and loaded again after a restart"""
+        store = state.StateStore(':memory:')
+        poller = polling.AdaptivePoller(3, budget=720, store=store)
+        for _ in range(20):
+            poller.spend('secret', self.now)
+        self.assertEqual((self.now.date().isoformat(), 20), store.budget(polling.budget_name('secret')))
+        self.assertIsNone(store.budget('secret'))
+        restarted = polling.AdaptivePoller(3, budget=720, store=store)
+        self.assertEqual(700, restarted.call_budget('secret').remaining(self.now))
+        self.assertEqual(720, restarted.call_budget('secret').remaining(self.now + datetime.timedelta(days=1)))
+        store.close()
+
+    def test_start_poller(self):
+        """Testing that the poller is only started with adaptive polling enabled, and records each interval"""
+        settings = {'enabled': False, 'min_refresh': 1, 'max_refresh': 15, 'precip_probability': 0.3,
+                    'daily_budget': 1000}
+        self.assertIsNone(polling.start_poller(settings, 3))
+        settings['enabled'] = True
+        registry = metrics.Registry([('weatherbot_poll_interval_minutes', 'gauge', 'Minutes.')])
+        poller = polling.start_poller(settings, 3, registry=registry)
+        poller.next_interval('calm', self.weather_data('us.json'), self.now, 1)
+        self.assertIn('weatherbot_poll_interval_minutes{location="calm"} 3', registry.render())
+
+
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self.path = 'testwatched.txt'
+        with open(self.path, 'w') as file_stream:
+            file_stream.write('first')
+
+    def tearDown(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def test_changed(self):
+        """Testing that a change to a watched file, or a reload that was asked for, is noticed once"""
+        file_watcher = watcher.FileWatcher([self.path, 'testmissing.txt'], interval=5)
+        self.assertFalse(file_watcher.changed())
+        with open(self.path, 'w') as file_stream:
+            file_stream.write('second, longer')
+        self.assertTrue(file_watcher.changed())
+        self.assertFalse(file_watcher.changed())
+        file_watcher.request()
+        self.assertTrue(file_watcher.changed())
+        self.assertFalse(file_watcher.changed())
+        os.remove(self.path)
+        self.assertTrue(file_watcher.changed())
+        self.assertIsNone(watcher.file_stat(self.path))
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.responses = replay.load_responses([os.path.join('fixtures', name) for name in replay.FIXTURES])
+        self.start = pytz.utc.localize(datetime.datetime(2016, 10, 14))
+
+    def test_rebase(self):
+        """Testing that a recording is moved to the fetch time, and its alerts stay at the start of the replay"""
+        data = self.responses[replay.FIXTURES.index('us_alert.json')]
+        later = self.start + datetime.timedelta(hours=5)
+        first = replay.rebase(data, self.start, self.start)
+        second = replay.rebase(data, later, self.start)
+        self.assertEqual(int(self.start.timestamp()), first['currently']['time'])
+        self.assertEqual(int(later.timestamp()), second['currently']['time'])
+        self.assertEqual(first['alerts'], second['alerts'])
+        self.assertEqual(int(self.start.timestamp()) - data['currently']['time'],
+                         first['alerts'][0]['time'] - data['alerts'][0]['time'])
+        self.assertNotEqual(first['currently']['time'], data['currently']['time'])
+
+    def test_recordings_shared(self):
+        """Testing that a recording is moved once for every location fetching it at the same time"""
+        clock = replay.VirtualClock(self.start)
+        darksky = replay.ReplayDarkSky(self.responses, clock)
+        fetched = [darksky.load_forecast('key', lat, 0, exclude=['hourly']) for lat in range(len(self.responses) + 1)]
+        self.assertIs(fetched[0], fetched[-1])
+        self.assertNotIn('hourly', fetched[0])
+        clock.sleep(180)
+        later = darksky.load_forecast('key', 0, 0, exclude=['hourly'])
+        self.assertIsNot(fetched[0], later)
+        self.assertEqual(fetched[0]['currently']['time'] + 180, later['currently']['time'])
+
+    def test_replay(self):
+        """Testing that a simulated day polls every location on time and captures the tweets"""
+        clock = weatherBot.CLOCK
+        result = replay.replay('weatherBot.conf', self.responses, days=1, locations=3, refresh=30, start=self.start)
+        self.assertIs(clock, weatherBot.CLOCK)
+        self.assertEqual(3, result['locations'])
+        self.assertEqual(48, result['cycles'])
+        self.assertEqual(3 * 48, result['fetches'])
+        self.assertEqual(len(result['statuses']), result['tweets'])
+        end = self.start + datetime.timedelta(days=1)
+        self.assertTrue(all(self.start <= posted < end for posted, _ in result['statuses']))
+        # every location tweets its forecast once a day
+        forecasts = [status for _, status in result['statuses'] if status['status'].startswith('The forecast')]
+        self.assertEqual(3, len(forecasts))
+        again = replay.replay('weatherBot.conf', self.responses, days=1, locations=3, refresh=30, start=self.start)
+        self.assertEqual([posted for posted, _ in result['statuses']], [posted for posted, _ in again['statuses']])
+        self.assertNotIn('polls_saved', result)
+
+    def test_replay_restores(self):
+        """Testing that a replay that fails to start leaves the running state open and restores every global"""
+        names = ('STATE', 'TIMELINES', 'METRICS', 'CONFIG', 'CLOCK')
+        running = {name: getattr(weatherBot, name) for name in names}
+        with Replacer() as replacer, self.assertRaises(OSError):
+            replacer.replace('weatherBot.load_config', Mock(side_effect=OSError('weatherBot.conf')))
+            replay.replay('weatherBot.conf', self.responses, days=1, start=self.start)
+        self.assertEqual(running, {name: getattr(weatherBot, name) for name in names})
+        # raises sqlite3.ProgrammingError if the replay closed it
+        weatherBot.STATE.is_empty()
+
+    def test_replay_adaptive(self):
+        """Testing that adaptive polling makes fewer fetches than polling every refresh, and reports the polls saved"""
+        fixed = replay.replay('weatherBot.conf', self.responses, days=1, locations=3, refresh=5, start=self.start)
+        adaptive = replay.replay('weatherBot.conf', self.responses, days=1, locations=3, refresh=5, start=self.start,
+                                 adaptive=True)
+        self.assertLess(adaptive['fetches'], fixed['fetches'])
+        self.assertGreater(adaptive['polls_saved'], 0)
+        self.assertAlmostEqual(fixed['fetches'], adaptive['baseline_polls'], delta=fixed['fetches'] * 0.05)
+        self.assertIsNone(weatherBot.POLLER)
+
+
+class TestLazy(unittest.TestCase):
+    def test_lazy_import(self):
+        """Testing that a module is only imported once one of its attributes is used"""
+        sys.modules.pop('colorsys', None)
+        colorsys = lazy.lazy_import('colorsys')
+        self.assertIsInstance(colorsys, lazy.LazyModule)
+        self.assertNotIn('colorsys', sys.modules)
+        self.assertEqual((1, 1, 1), colorsys.hsv_to_rgb(0, 0, 1))
+        self.assertIn('colorsys', sys.modules)
+        self.assertIs(sys.modules['json'], lazy.lazy_import('json'))
+        self.assertIsNone(lazy.lazy_import('weatherbot_not_installed'))
+
+    def test_deferred_imports(self):
+        """Testing that importing weatherBot does not import the Twitter, Dark Sky, YAML, or NumPy libraries"""
+        code = ('import sys, weatherBot; print(sorted(name for name in ("requests", "tweepy", "forecastio", "yaml", '
+                '"numpy") if name in sys.modules))')
+        result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True,
+                                check=True)
+        self.assertEqual('[]', result.stdout.strip())
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry([
+            ('test_total', 'counter', 'Things counted.'),
+            ('test_depth', 'gauge', 'Things waiting.'),
+            ('test_seconds', 'histogram', 'Seconds things took.', (0.1, 1.0))
+        ])
+
+    def test_render(self):
+        """Testing that counters, gauges, and cumulative histogram buckets are rendered in the text format"""
+        self.registry.inc('test_total', location='a "b"')
+        self.registry.inc('test_total', 2, location='a "b"')
+        self.registry.add_collector(lambda registry: registry.set('test_depth', 7))
+        for value in (0.05, 0.1, 0.5, 3):
+            self.registry.observe('test_seconds', value, location='x')
+        with self.registry.time('test_seconds', location='y', outcome='error') as labels:
+            labels['outcome'] = 'success'
+        lines = self.registry.render().splitlines()
+        self.assertEqual(['# HELP test_total Things counted.', '# TYPE test_total counter',
+                          'test_total{location="a \\"b\\""} 3'], lines[:3])
+        self.assertIn('test_depth 7', lines)
+        self.assertIn('test_seconds_bucket{location="x",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{location="x",le="1.0"} 3', lines)
+        self.assertIn('test_seconds_bucket{location="x",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_sum{location="x"} 3.65', lines)
+        self.assertIn('test_seconds_count{location="x"} 4', lines)
+        self.assertIn('test_seconds_count{location="y",outcome="success"} 1', lines)
+        with self.assertRaises(ValueError):
+            self.registry.declare('test_info', 'info', 'Not a metric type.')
+
+    def test_disabled(self):
+        """Testing that a disabled registry ignores every update"""
+        registry = metrics.Registry([('test_total', 'counter', 'Things counted.'),
+                                     ('test_seconds', 'histogram', 'Seconds things took.')], enabled=False)
+        registry.inc('test_total')
+        registry.set('test_total', 3)
+        registry.observe('test_seconds', 0.5)
+        with registry.time('test_seconds', location='y') as labels:
+            self.assertEqual({'location': 'y'}, labels)
+        self.assertEqual(['# HELP test_total Things counted.', '# TYPE test_total counter',
+                          '# HELP test_seconds Seconds things took.', '# TYPE test_seconds histogram'],
+                         registry.render().splitlines())
+
+    def test_server(self):
+        """Testing that the metrics are served at /metrics only"""
+        self.registry.inc('test_total')
+        server = metrics.MetricsServer(self.registry, port=0)
+        server.start()
+        try:
+            url = 'http://127.0.0.1:{0}'.format(server.port)
+            with urllib.request.urlopen(url + '/metrics') as response:
+                self.assertEqual(metrics.CONTENT_TYPE, response.headers['Content-Type'])
+                self.assertIn('test_total 1', response.read().decode('utf-8').splitlines())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + '/')
+        finally:
+            server.stop()
+
+    @replace('requests.get', mocked_requests_get)
+    def test_weatherbot_metrics(self):
+        """Testing that each stage of polling a location is measured with its location as a label"""
+        weatherBot.load_config(os.path.abspath('weatherBot.conf'))
+        self.assertIsNone(metrics.start_metrics(weatherBot.METRICS, weatherBot.CONFIG['metrics']))
+        with open('strings.yml', 'r') as file_stream:
+            weatherbot_strings = yaml.safe_load(file_stream)
+        settings = weatherBot.default_location_settings()
+        settings['id'] = 'measured'
+        forecast = forecastio.manual(os.path.join('fixtures', 'us_alert.json'))
+        now = pytz.utc.localize(datetime.datetime(2016, 10, 14, 10, 1))
+        with Replacer() as replacer:
+            replacer.replace('weatherBot.get_forecast_object', lambda *args, **kwargs: forecast)
+            replacer.replace('weatherBot.queue_tweet', Mock())
+            replacer.replace('weatherBot.CLOCK', Mock(now=lambda: now))
+            weatherBot.process_location(settings, models.WeatherBotString(weatherbot_strings),
+                                        state.Throttles({'default': now}), now)
+            replacer.replace('weatherBot.get_forecast_object', lambda *args, **kwargs: None)
+            weatherBot.process_location(settings, models.WeatherBotString(weatherbot_strings),
+                                        state.Throttles({'default': now}), now)
+        weatherBot.collect_metrics(weatherBot.METRICS)
+        lines = weatherBot.METRICS.render().splitlines()
+        self.assertIn('weatherbot_forecast_seconds_count{location="measured"} 2', lines)
+        self.assertIn('weatherbot_forecast_errors_total{location="measured"} 1', lines)
+        self.assertIn('weatherbot_parse_seconds_count{location="measured"} 1', lines)
+        self.assertIn('weatherbot_render_seconds_count{location="measured",kind="special"} 1', lines)
+        self.assertIn('weatherbot_throttles{location="measured",namespace="alerts"} 3', lines)
+        self.assertIn('weatherbot_outbox_depth 0', lines)
+
+    def test_payload_bytes(self):
+        """Testing that the size of a response is recorded once when it is fetched, not for each cached use"""
+        registry = metrics.Registry(metrics.DEFINITIONS)
+        forecast = Mock(response=Mock(content=b'x' * 2000), json={'flags': {'units': 'us'}})
+        with Replacer() as replacer:
+            replacer.replace('weatherBot.METRICS', registry)
+            replacer.replace('weatherBot.DARKSKY', Mock(load_forecast=Mock(return_value=forecast)))
+            replacer.replace('weatherBot.FORECASTS', cache.ForecastCache(ttl=300))
+            for _ in range(3):
+                self.assertEqual(forecast.json, weatherBot.get_forecast_object(45.585, -95.91, location_id='morris'))
+        lines = registry.render().splitlines()
+        self.assertIn('weatherbot_payload_bytes_count{location="morris"} 1', lines)
+        self.assertIn('weatherbot_payload_bytes_sum{location="morris"} 2000', lines)
+
+
+class TestTemplates(unittest.TestCase):
+    def test_render(self):
+        """Testing that compiled templates render the same as str.format"""
+        values = {'summary': 'Clear', 'temp': '12ºF', 'location': 'Morris, MN', 'wind_bearing': 270}
+        fields = ('summary', 'temp', 'location', 'wind_bearing')
+        for text in ('{temp} and {summary}.', '', 'no fields', '{{braces}} {summary}', '{summary}{temp}',
+                     '{wind_bearing}º', '{wind_bearing:>5}|{summary!r}|{location:.6}', '{temp} and {temp}'):
+            self.assertEqual(text.format(**values), templates.Template(text, fields).render(values))
+
+    def test_strings(self):
+        """Testing that every template in strings.yml compiles and renders the same as str.format"""
+        with open('strings.yml', 'r') as file_stream:
+            weatherbot_strings = yaml.safe_load(file_stream)
+        weatherbot_strings['expires_alerts'] = weatherbot_strings['alerts']['expires']
+        weatherbot_strings['no_expires_alerts'] = weatherbot_strings['alerts']['no_expires']
+        for kind, fields in templates.FIELDS.items():
+            values = {field: field.upper() for field in fields}
+            texts = weatherbot_strings[kind]
+            if isinstance(texts, dict):
+                texts = [text for value in texts.values()
+                         for text in (value if isinstance(value, list) else sum(value.values(), []))]
+            compiled = [templates.compile_template(text, fields) for text in texts]
+            self.assertEqual([text.format(**values) for text in texts],
+                             [template.render(values) for template in compiled])
+
+    def test_errors(self):
+        """Testing that unknown fields and unsupported templates are rejected"""
+        for text in ('{temp} {wind_speed}', '{}', '{0}', '{summary.upper}', '{summary[0]}', '{summary',
+                     '{summary:{temp}}'):
+            with self.assertRaises(templates.TemplateError):
+                templates.Template(text, ('summary', 'temp'))
+        self.assertIs(templates.compile_template('{temp}', ('temp',)), templates.compile_template('{temp}', ('temp',)))
+        self.assertEqual({'a': [templates.compile_template('{rate}', ('rate',))]},
+                         templates.compile_all({'a': ['{rate}']}, 'precipitations'))
+
+
+class TestStateStore(unittest.TestCase):
+    def setUp(self):
+        self.path = 'teststate.db'
+        self.now = pytz.utc.localize(datetime.datetime(2016, 10, 14, 14, 42, 7, 123456))
+        self.store = state.StateStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.isfile(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_micros(self):
+        """Testing that datetimes are stored without losing any precision"""
+        self.assertEqual(self.now, state.from_micros(state.to_micros(self.now)))
+        copenhagen = pytz.timezone('Europe/Copenhagen').localize(datetime.datetime(2016, 10, 14, 16, 42, 7, 123456))
+        self.assertEqual(self.now, state.from_micros(state.to_micros(copenhagen)))
+
+    def test_tracked_dict(self):
+        """Testing that set and deleted keys are tracked until marked clean"""
+        tracked = state.TrackedDict({'default': self.now})
+        self.assertFalse(tracked.dirty)
+        tracked['fog'] = self.now
+        tracked.setdefault('hot', self.now)
+        tracked.setdefault('fog', None)
+        tracked.update({'cold': self.now})
+        self.assertEqual({'fog', 'hot', 'cold'}, tracked.changed)
+        del tracked['fog']
+        self.assertEqual(self.now, tracked.pop('hot'))
+        self.assertIsNone(tracked.pop('missing', None))
+        self.assertEqual({'cold'}, tracked.changed)
+        self.assertEqual({'fog', 'hot'}, tracked.deleted)
+        tracked.mark_clean()
+        self.assertFalse(tracked.dirty)
+        self.assertEqual({'default': self.now, 'cold': self.now}, tracked)
+
+    def test_flush(self):
+        """Testing that only changed throttles are written and they are loaded again after reopening"""
+        throttles = self.store.throttles('default')
+        self.assertIs(throttles, self.store.throttles('default'))
+        self.assertTrue(self.store.is_empty())
+        self.assertEqual(0, self.store.flush())
+        throttles.conditions['default'] = self.now
+        throttles.conditions['fog'] = self.now
+        self.store.throttles('somewhere').conditions['hot'] = self.now
+        self.store.throttles('somewhere').alerts['sha'] = self.now
+        self.assertEqual(4, self.store.flush())
+        self.assertEqual(0, self.store.flush())
+        self.assertFalse(self.store.is_empty())
+        del throttles.conditions['fog']
+        throttles.conditions['default'] = self.now + datetime.timedelta(hours=2)
+        self.assertEqual(2, self.store.flush())
+        self.store.close()
+        self.store = state.StateStore(self.path)
+        self.assertEqual(state.Throttles({'default': self.now + datetime.timedelta(hours=2)}),
+                         self.store.throttles('default'))
+        self.assertEqual(state.Throttles({'hot': self.now}, {'sha': self.now}), self.store.throttles('somewhere'))
+        self.assertEqual(state.Throttles(), self.store.throttles('elsewhere'))
+
+    def test_import_cache(self):
+        """Testing that a cache from an older version is copied into the store"""
+        sha = hashlib.sha256(b'Winter Storm Warning').hexdigest()
+        self.store.import_cache({'throttles': {'default': self.now, sha: self.now},
+                                 'locations': {'somewhere': {'fog': self.now}}})
+        self.assertFalse(self.store.is_empty())
+        self.assertEqual(0, self.store.flush())
+        self.assertEqual(state.Throttles({'default': self.now}, {sha: self.now}), self.store.throttles('default'))
+        self.assertEqual(state.Throttles({'fog': self.now}), self.store.throttles('somewhere'))
+
+    def test_expiring_dict(self):
+        """Testing that only expired keys are deleted, using their latest expiry time"""
+        expiring = state.ExpiringDict({'default': self.now, 'fog': self.now})
+        expiring['hot'] = self.now + datetime.timedelta(minutes=5)
+        expiring['fog'] = self.now + datetime.timedelta(minutes=10)
+        expiring['cold'] = self.now
+        del expiring['cold']
+        self.assertEqual([], expiring.expire(self.now, keep=('default',)))
+        self.assertEqual(['hot'], expiring.expire(self.now + datetime.timedelta(minutes=5)))
+        expiring['fog'] = self.now + datetime.timedelta(minutes=1)
+        self.assertEqual(['fog'], expiring.expire(self.now + datetime.timedelta(minutes=10), keep=('default',)))
+        self.assertEqual({'default': self.now}, expiring)
+        for i in range(1000):
+            expiring['fog'] = self.now + datetime.timedelta(minutes=i)
+        self.assertEqual(['default', 'fog'], sorted(expiring.expire(self.now + datetime.timedelta(days=1))))
+        self.assertEqual({}, expiring)
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.path = 'teststrings.yml'
+        self.snapshot_path = 'teststrings.snapshot'
+        with open('strings.yml', 'rb') as file_stream:
+            self.data = file_stream.read()
+        with open(self.path, 'wb') as file_stream:
+            file_stream.write(self.data)
+        self.parsed = []
+
+    def tearDown(self):
+        for path in (self.path, self.snapshot_path, self.snapshot_path + '.tmp'):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def parse(self, data):
+        self.parsed.append(data)
+        return yaml.safe_load(data)
+
+    def test_load(self):
+        """Testing that the snapshot is used until the file changes"""
+        tables = snapshot.load(self.path, self.snapshot_path, self.parse)
+        self.assertEqual(1, len(self.parsed))
+        self.assertTrue(os.path.isfile(self.snapshot_path))
+        self.assertEqual(tables, snapshot.load(self.path, self.snapshot_path, self.parse))
+        self.assertEqual(1, len(self.parsed))
+        with open(self.path, 'ab') as file_stream:
+            file_stream.write(b'\nextra: [one]\n')
+        tables = snapshot.load(self.path, self.snapshot_path, self.parse)
+        self.assertEqual(2, len(self.parsed))
+        self.assertEqual(['one'], tables['extra'])
+        self.assertEqual(tables, snapshot.load(self.path, self.snapshot_path, self.parse))
+        self.assertEqual(2, len(self.parsed))
+        snapshot.load(self.path, None, self.parse)
+        self.assertEqual(3, len(self.parsed))
+
+    def test_read_snapshot(self):
+        """Testing that missing, stale, and corrupt snapshots are not read"""
+        key = snapshot.snapshot_key(self.data)
+        self.assertIsNone(snapshot.read_snapshot(self.snapshot_path, key))
+        snapshot.write_snapshot(self.snapshot_path, key, {'forecasts': ['sunny']})
+        self.assertEqual({'forecasts': ['sunny']}, snapshot.read_snapshot(self.snapshot_path, key))
+        self.assertIsNone(snapshot.read_snapshot(self.snapshot_path, snapshot.snapshot_key(self.data + b'\n')))
+        with open(self.snapshot_path, 'rb') as file_stream:
+            blob = file_stream.read()
+        with open(self.snapshot_path, 'wb') as file_stream:
+            file_stream.write(blob[:-3])
+        self.assertIsNone(snapshot.read_snapshot(self.snapshot_path, key))
+        with open(self.snapshot_path, 'wb') as file_stream:
+            file_stream.write(b'not a snapshot')
+        self.assertIsNone(snapshot.read_snapshot(self.snapshot_path, key))
+
+    def test_write_snapshot_error(self):
+        """Testing that a snapshot that can not be written is skipped with a warning"""
+        with LogCapture() as check:
+            snapshot.write_snapshot(os.path.join('missing_dir', 'strings.snapshot'), b'key', {})
+            self.assertIn('Could not write the snapshot', str(check))
+
+    def test_load_strings(self):
+        """Testing that the strings are checked before a snapshot of them is written"""
+        tables = models.load_strings(self.path, self.snapshot_path)
+        with open('strings.yml', 'r') as file_stream:
+            self.assertEqual(yaml.safe_load(file_stream), tables)
+        self.assertEqual(tables, models.load_strings(self.path, self.snapshot_path))
+        with open(self.path, 'ab') as file_stream:
+            file_stream.write(b'\nforecasts: ["{nope}"]\n')
+        with self.assertRaises(SystemExit):
+            models.load_strings(self.path, self.snapshot_path)
+        self.assertEqual(tables, snapshot.read_snapshot(self.snapshot_path, snapshot.snapshot_key(self.data)))
+
+
+class TestForecastCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.forecasts = cache.ForecastCache(ttl=60, precision=2, size=2, clock=lambda: self.now)
+
+    def test_get(self):
+        """Testing that nearby coordinates with the same units and language share an entry until it expires"""
+        fetch = Mock(return_value='forecast')
+        self.assertEqual('forecast', self.forecasts.get(45.5851, -95.9101, 'us', 'en', fetch))
+        self.assertEqual('forecast', self.forecasts.get(45.5899, -95.9149, 'us', 'en', fetch))
+        self.assertEqual(1, fetch.call_count)
+        self.forecasts.get(45.5851, -95.9101, 'si', 'en', fetch)
+        self.forecasts.get(45.5851, -95.9101, 'us', 'de', fetch)
+        self.forecasts.get(45.60, -95.9101, 'us', 'en', fetch)
+        self.assertEqual(4, fetch.call_count)
+        self.now = 61
+        self.forecasts.get(45.60, -95.9101, 'us', 'en', fetch)
+        self.assertEqual(5, fetch.call_count)
+        self.assertEqual({'entries': 2, 'hits': 1, 'misses': 5, 'evictions': 2, 'merged': 0}, self.forecasts.stats())
+
+    def test_lru(self):
+        """Testing that the least recently used entry is evicted first"""
+        fetch = Mock(return_value='forecast')
+        self.forecasts.get(1, 1, 'us', 'en', fetch)
+        self.forecasts.get(2, 2, 'us', 'en', fetch)
+        self.forecasts.get(1, 1, 'us', 'en', fetch)
+        self.forecasts.get(3, 3, 'us', 'en', fetch)
+        self.assertEqual(3, fetch.call_count)
+        self.forecasts.get(1, 1, 'us', 'en', fetch)
+        self.assertEqual(3, fetch.call_count)
+        self.forecasts.get(2, 2, 'us', 'en', fetch)
+        self.assertEqual(4, fetch.call_count)
+        self.assertEqual(2, len(self.forecasts))
+        self.assertEqual(2, self.forecasts.evictions)
+
+    def test_no_merge(self):
+        """Testing that a cache that does not merge fetches still caches them"""
+        forecasts = cache.ForecastCache(ttl=60, size=1, clock=lambda: self.now, merge=False)
+        fetch = Mock(return_value='forecast')
+        forecasts.get(1, 1, 'us', 'en', fetch)
+        self.assertEqual('forecast', forecasts.get(1, 1, 'us', 'en', fetch))
+        forecasts.get(2, 2, 'us', 'en', fetch)
+        self.assertEqual(2, fetch.call_count)
+        self.assertEqual({'entries': 1, 'hits': 1, 'misses': 2, 'evictions': 1, 'merged': 0}, forecasts.stats())
+
+    def test_not_cached(self):
+        """Testing that failed fetches and a ttl of 0 are not cached"""
+        fetch = Mock(return_value=None)
+        self.assertIsNone(self.forecasts.get(1, 1, 'us', 'en', fetch))
+        self.forecasts.get(1, 1, 'us', 'en', fetch)
+        self.assertEqual(2, fetch.call_count)
+        fetch = Mock(side_effect=requests.exceptions.ConnectionError)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.forecasts.get(1, 1, 'us', 'en', fetch)
+        self.assertEqual(0, len(self.forecasts))
+        forecasts = cache.ForecastCache(ttl=0)
+        fetch = Mock(return_value='forecast')
+        forecasts.get(1, 1, 'us', 'en', fetch)
+        forecasts.get(1, 1, 'us', 'en', fetch)
+        self.assertEqual(2, fetch.call_count)
+        self.assertEqual(0, len(forecasts))
+
+    def test_single_flight(self):
+        """Testing that concurrent callers for the same key wait on one fetch"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def fetch():
+            started.set()
+            release.wait(5)
+            return 'forecast'
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            leader = pool.submit(self.forecasts.get, 1, 1, 'us', 'en', fetch)
+            started.wait(5)
+            followers = [pool.submit(self.forecasts.get, 1, 1, 'us', 'en', Mock()) for _ in range(3)]
+            while self.forecasts.hits < 3:
+                time.sleep(0.001)
+            release.set()
+            self.assertEqual(['forecast'] * 4, [leader.result()] + [follower.result() for follower in followers])
+        self.assertEqual(1, self.forecasts.misses)
+        self.assertEqual(3, self.forecasts.merged)
+
+    def test_single_flight_error(self):
+        """Testing that an error from a fetch is raised for every caller waiting on it"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def fetch():
+            started.set()
+            release.wait(5)
+            raise requests.exceptions.HTTPError('uh oh')
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            leader = pool.submit(self.forecasts.get, 1, 1, 'us', 'en', fetch)
+            started.wait(5)
+            follower = pool.submit(self.forecasts.get, 1, 1, 'us', 'en', Mock())
+            while self.forecasts.hits < 1:
+                time.sleep(0.001)
+            release.set()
+            with self.assertRaises(requests.exceptions.HTTPError):
+                leader.result()
+            with self.assertRaises(requests.exceptions.HTTPError):
+                follower.result()
+
+
+class TestDarkSkyClient(unittest.TestCase):
+    def setUp(self):
+        self.darksky = clients.DarkSkyClient(base_url='https://darksky.test/forecast/')
+
+    def test_load_forecast(self):
+        """Testing that forecasts are fetched with excluded blocks and the size of each fetch is recorded"""
+        get = Mock(side_effect=mocked_darksky_session_get)
+        with Replacer() as replacer:
+            replacer.replace('requests.Session.get', get)
+            forecast = self.darksky.load_forecast('us_alert', 34.2, -118.36, units='us', lang='de',
+                                                  exclude=['minutely', 'hourly'])
+            get.assert_called_with('https://darksky.test/forecast/us_alert/34.2,-118.36',
+                                   params={'units': 'us', 'lang': 'de', 'exclude': 'minutely,hourly'}, timeout=30)
+            self.assertNotIn('hourly', forecast.json)
+            self.assertNotIn('minutely', forecast.json)
+            self.assertEqual('Wind Advisory', forecast.alerts()[0].title)
+            self.darksky.load_forecast('us', 1, 2)
+            self.assertEqual({'units': 'us', 'lang': 'en'}, get.call_args[1]['params'])
+        stats = self.darksky.stats()
+        self.assertEqual(2, stats['fetches'])
+        self.assertLess(stats['wire_bytes_per_fetch'], stats['json_bytes_per_fetch'])
+        self.assertGreater(stats['seconds_per_fetch'], 0)
+
+    def test_load_forecast_error(self):
+        """Testing that HTTP errors are raised and not recorded"""
+        with Replacer() as replacer:
+            replacer.replace('requests.Session.get', Mock(side_effect=mocked_darksky_session_get))
+            with self.assertRaises(requests.exceptions.HTTPError):
+                self.darksky.load_forecast('bad_key', 1, 2)
+        self.assertEqual(0, self.darksky.stats()['fetches'])
+
+    def test_session(self):
+        """Testing that the session asks for gzip and is reused"""
+        self.assertEqual('gzip', self.darksky.session.headers['Accept-Encoding'])
+        self.assertIsInstance(self.darksky.session.get_adapter('https://darksky.test/forecast/x'),
+                              requests.adapters.HTTPAdapter)
+
+
 class TestKeys(unittest.TestCase):
     def setUp(self):
         self.WEATHERBOT_CONSUMER_KEY = os.environ['WEATHERBOT_CONSUMER_KEY']
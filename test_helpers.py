@@ -1,4 +1,5 @@
 import json
+import os
 
 import tweepy
 import requests
@@ -44,9 +45,9 @@ def mocked_get_tweepy_api():
             else:
                 return Status(status)
 
-        def user_timeline(self, screen_name, include_rts, count):
+        def user_timeline(self, screen_name, include_rts, count, since_id=None):
             """
-            Get a user's timeline
+            Get a user's timeline, every user has a single tweet with the id 1000
             :return: list
             """
 
@@ -61,6 +62,8 @@ def mocked_get_tweepy_api():
 
             class Tweet:
                 def __init__(self):
+                    self.id = 1000
+                    self._json = {'id': self.id, 'text': 'test'}
                     if screen_name == 'nocoords':
                         self.coordinates = None
                         self.place = Place('cool place')
@@ -77,7 +80,7 @@ def mocked_get_tweepy_api():
 
             if screen_name == 'error':
                 raise tweepy.TweepError('uh oh')
-            elif screen_name != 'no tweets':
+            elif screen_name != 'no tweets' and (since_id is None or since_id < 1000):
                 return [Tweet()]
             else:
                 return []
@@ -117,6 +120,48 @@ def mocked_requests_get(*args, **kwargs):
         return MockResponse(json.load(file_stream), 200)
 
 
+def mocked_darksky_session_get(url, params=None, timeout=None):
+    """
+    Mocked requests.Session.get for clients.DarkSkyClient, returning the fixture named by the key in the url
+    :return: MockResponse
+    """
+
+    class Raw:
+        def __init__(self, size):
+            self.size = size
+
+        def tell(self):
+            return self.size
+
+    class MockResponse:
+        """
+        Class mocking a gzipped response from the Dark Sky API
+        """
+
+        def __init__(self, content, status_code):
+            self.content = content
+            self.status_code = status_code
+            self.headers = {'Content-Encoding': 'gzip'}
+            self.raw = Raw(len(content) // 4)
+            self.url = url
+
+        def raise_for_status(self):
+            if self.status_code != 200:
+                raise requests.exceptions.HTTPError(str(self.status_code))
+
+        def json(self):
+            return json.loads(self.content)
+
+    name = url.split('/')[-2]
+    if name == 'bad_key':
+        return MockResponse(b'{}', 403)
+    with open(os.path.join('fixtures', name + '.json'), 'rb') as file_stream:
+        data = json.loads(file_stream.read())
+    for block in (params or {}).get('exclude', '').split(','):
+        data.pop(block, None)
+    return MockResponse(json.dumps(data).encode(), 200)
+
+
 def mocked_forecastio_load_forecast(*args, **kwargs):
     class Response:
         def __init__(self, status_code):
@@ -0,0 +1,186 @@
+"""
+weatherBot timeline
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import json
+import threading
+from collections import deque
+from collections import namedtuple
+
+import models
+import utils
+
+TimelinePoll = namedtuple('TimelinePoll', ['username', 'location', 'moved', 'tweets', 'bytes', 'saved_bytes'])
+
+
+def tweet_location(tweet, unnamed_location_name):
+    """
+    Find the location of a tweet, preferring its coordinates over the center of its place
+    :type tweet: tweepy.models.Status
+    :type unnamed_location_name: str
+    :param unnamed_location_name: name used for coordinates that are not in a Twitter place
+    :return: models.WeatherLocation, or None if the tweet has no location
+    """
+    # if tweet has coordinates (from a smartphone)
+    if tweet.coordinates is not None:
+        lat = tweet.coordinates['coordinates'][1]
+        lng = tweet.coordinates['coordinates'][0]
+        name = unnamed_location_name
+        # sometimes a tweet contains a coordinate, but is not in a Twitter place
+        # for example, https://twitter.com/BrianMitchL/status/982664157857271810 has coordinates, but no place
+        if tweet.place is not None:
+            name = tweet.place.full_name
+        return models.WeatherLocation(lat=lat, lng=lng, name=name)
+    # if the location is a place, not coordinates
+    if tweet.place is not None:
+        lat, lng = utils.centerpoint(tweet.place.bounding_box.coordinates[0])
+        return models.WeatherLocation(lat=lat, lng=lng, name=tweet.place.full_name)
+    return None
+
+
+def newest_location(timeline, unnamed_location_name):
+    """
+    :type timeline: list
+    :param timeline: tweets, newest first
+    :type unnamed_location_name: str
+    :param unnamed_location_name: name used for coordinates that are not in a Twitter place
+    :return: tuple of the location of the newest tweet that has one and the number of tweets newer than it, or None
+             and the number of tweets if none has a location
+    """
+    for position, tweet in enumerate(timeline):
+        location = tweet_location(tweet, unnamed_location_name)
+        if location is not None:
+            return location, position
+    return None, len(timeline)
+
+
+def tweet_size(tweet):
+    """
+    :type tweet: tweepy.models.Status
+    :return: int, approximate bytes the tweet took in the API response
+    """
+    raw = getattr(tweet, '_json', None)
+    return len(json.dumps(raw, separators=(',', ':'))) if raw is not None else 0
+
+
+class FollowedUser:
+    """
+    What is remembered about a followed user between polls
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('since_id', 'location', 'newer', 'sizes')
+
+    def __init__(self, count):
+        """
+        :type count: int
+        :param count: most recent tweets to remember the sizes of
+        """
+        self.since_id = None
+        self.location = None
+        # tweets posted after the newest tweet with a location
+        self.newer = 0
+        self.sizes = deque(maxlen=count)
+
+
+class TimelineTracker:
+    """
+    Follows the locations of Twitter users. Each user's newest status id is remembered, so later polls only request
+    tweets posted since then with since_id, and a user who has not tweeted costs an empty response instead of their
+    latest tweets. The newest location found is kept until a newer tweet has a location, or until the tweet it was
+    found in is no longer one of the latest count tweets, the same as if all of them had been read again.
+    """
+
+    def __init__(self, min_distance=1.0, count=20):
+        """
+        :type min_distance: float
+        :param min_distance: kilometers a user has to move before their location counts as changed
+        :type count: int
+        :param count: most tweets requested in each poll
+        """
+        self.min_distance = min_distance
+        self.count = count
+        self.polls = 0
+        self.tweets = 0
+        self.bytes = 0
+        self.saved_bytes = 0
+        self.saved_calls = 0
+        self.__users = {}
+        self.__lock = threading.Lock()
+
+    def poll(self, api, username, unnamed_location_name):
+        """
+        Request the user's tweets posted since the last poll and find their newest location
+        :type api: tweepy.API
+        :type username: str
+        :type unnamed_location_name: str
+        :param unnamed_location_name: name used for coordinates that are not in a Twitter place
+        :return: TimelinePoll, location is None if none of the latest count tweets has a location, and moved is True
+                 if the location is more than min_distance from the previous one
+        """
+        with self.__lock:
+            user = self.__users.get(username)
+            if user is None:
+                user = self.__users[username] = FollowedUser(self.count)
+            since_id = user.since_id
+        kwargs = {'screen_name': username, 'include_rts': False, 'count': self.count}
+        if since_id is not None:
+            kwargs['since_id'] = since_id
+        timeline = api.user_timeline(**kwargs)
+        sizes = [tweet_size(tweet) for tweet in timeline]
+        location, newer = newest_location(timeline, unnamed_location_name)
+        with self.__lock:
+            # without since_id the older tweets would have been downloaded again
+            saved_bytes = sum(list(user.sizes)[:self.count - len(timeline)]) if since_id is not None else 0
+            user.sizes.extendleft(reversed(sizes))
+            ids = [tweet.id for tweet in timeline if getattr(tweet, 'id', None) is not None]
+            if ids:
+                user.since_id = max(ids + ([since_id] if since_id is not None else []))
+            if location is not None:
+                user.newer = newer
+            else:
+                user.newer += newer
+                if user.newer >= self.count:
+                    # the tweet with the location would not be among the latest count tweets anymore
+                    user.location = None
+            previous = user.location
+            moved = location is not None and (previous is None or self.min_distance < utils.distance(
+                previous.lat, previous.lng, location.lat, location.lng))
+            if moved:
+                user.location = location
+            else:
+                location = previous
+                if previous is not None:
+                    # the forecast for the previous location is still good, so it is not fetched again
+                    self.saved_calls += 1
+            self.polls += 1
+            self.tweets += len(timeline)
+            self.bytes += sum(sizes)
+            self.saved_bytes += saved_bytes
+        return TimelinePoll(username=username, location=location, moved=moved, tweets=len(timeline),
+                            bytes=sum(sizes), saved_bytes=saved_bytes)
+
+    def stats(self):
+        """
+        :return: dict with the number of polls, tweets and bytes received, bytes saved by since_id, and forecast
+                 fetches saved because a location did not move
+        """
+        with self.__lock:
+            return {
+                'polls': self.polls,
+                'tweets': self.tweets,
+                'bytes': self.bytes,
+                'saved_bytes': self.saved_bytes,
+                'saved_calls': self.saved_calls
+            }
+
+
+def start_tracker(variable_location_settings):
+    """
+    :type variable_location_settings: dict
+    :param variable_location_settings: CONFIG['variable_location']
+    :return: TimelineTracker
+    """
+    return TimelineTracker(min_distance=variable_location_settings['min_distance'])
@@ -5,74 +5,106 @@ Copyright 2015-2019 Brian Mitchell under the MIT license
 See the GitHub repository: https://github.com/BrianMitchL/weatherBot
 """
 
+import bisect
+import functools
+import math
+import threading
 from collections import namedtuple
+from datetime import datetime, timedelta
+from types import MappingProxyType
 
 import pytz
 
-Time = namedtuple('Time', ['hour', 'minute'])
-
-
-class InvalidTimeError(Exception):
-    """Designed to be thrown when parsing a bad str for creating a Time namedtuple"""
+import lazy
 
+# NumPy is optional, and only imported the first time a vectorized helper is used
+numpy = lazy.lazy_import('numpy')
 
-def get_units(unit):
-    """
-    Return a dict of units based on the unit format code.
-    :type unit: str
-    :param unit: unit format
-    :return dict containing units for weather measurements
-    """
-    if unit == 'us':
-        return {
-            'unit': 'us',
-            'nearestStormDistance': 'mph',
-            'precipIntensity': 'in/h',
-            'precipIntensityMax': 'in/h',
-            'precipAccumulation': 'in',
-            'temperature': 'F',
-            'temperatureMin': 'F',
-            'temperatureMax': 'F',
-            'apparentTemperature': 'F',
-            'dewPoint': 'F',
-            'windSpeed': 'mph',
-            'pressure': 'mb',
-            'visibility': 'mi'
-        }
-    if unit == 'ca':
-        return {
-            'unit': 'ca',
-            'nearestStormDistance': 'km',
-            'precipIntensity': 'mm/h',
-            'precipIntensityMax': 'mm/h',
-            'precipAccumulation': 'cm',
-            'temperature': 'C',
-            'temperatureMin': 'C',
-            'temperatureMax': 'C',
-            'apparentTemperature': 'C',
-            'dewPoint': 'C',
-            'windSpeed': 'km/h',
-            'pressure': 'hPa',
-            'visibility': 'km'
-        }
-    if unit == 'uk2':
-        return {
-            'unit': 'uk2',
-            'nearestStormDistance': 'mi',
-            'precipIntensity': 'mm/h',
-            'precipIntensityMax': 'mm/h',
-            'precipAccumulation': 'cm',
-            'temperature': 'C',
-            'temperatureMin': 'C',
-            'temperatureMax': 'C',
-            'apparentTemperature': 'C',
-            'dewPoint': 'C',
-            'windSpeed': 'mph',
-            'pressure': 'hPa',
-            'visibility': 'mi'
-        }
-    # si
-    return {
+Time = namedtuple('Time', ['hour', 'minute'])
+# mean radius of the Earth in kilometers
+EARTH_RADIUS = 6371.0088
+# lowest precipIntensity of each intensity, by the unit of the rate
+PRECIPITATION_INTENSITIES = {
+    'in/h': {
+        'very-light': ('very-light', 0.002),
+        'light': ('light', 0.017),
+        'moderate': ('moderate', 0.1),
+        'heavy': ('heavy', 0.4)
+    },
+    'mm/h': {
+        'very-light': ('very-light', 0.051),
+        'light': ('light', 0.432),
+        'moderate': ('moderate', 2.540),
+        'heavy': ('heavy', 5.08)
+    }
+}
+# special condition thresholds by the unit of the temperature or wind speed, the temperatures are inclusive
+WIND_CHILL_TEMPERATURES = {'F': -30, 'C': -34}
+COLD_TEMPERATURES = {'F': -20, 'C': -28}
+SUPER_HOT_TEMPERATURES = {'F': 110, 'C': 43}
+HOT_TEMPERATURES = {'F': 100, 'C': 37}
+HEAVY_WIND_SPEEDS = {'mph': 35.0, 'km/h': 56.0, 'm/s': 15.0}
+# humidity percentage at or below which it is dry
+DRY_HUMIDITY = 25
+# precipitation intensities from none to the heaviest
+INTENSITY_NAMES = ('none', 'very-light', 'light', 'moderate', 'heavy')
+# ascending lowest precipIntensity of each intensity after none, by the unit of the rate
+INTENSITY_THRESHOLDS = {unit: tuple(intensities[name][1] for name in INTENSITY_NAMES[1:])
+                        for unit, intensities in PRECIPITATION_INTENSITIES.items()}
+# lowest degrees of each wind direction after the first N, each direction is 45º wide around its compass point
+WIND_DIRECTION_BOUNDS = (23, 68, 113, 158, 203, 248, 293, 338)
+WIND_DIRECTIONS = ('N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW', 'N')
+# wind direction of each whole degree from 0 to 359, every other bearing is N
+WIND_DIRECTION_BY_DEGREE = tuple(WIND_DIRECTIONS[bisect.bisect_right(WIND_DIRECTION_BOUNDS, degrees)]
+                                 for degrees in range(360))
+# units of each unit format code, read only since every caller shares the same dict
+UNITS = {
+    'us': MappingProxyType({
+        'unit': 'us',
+        'nearestStormDistance': 'mph',
+        'precipIntensity': 'in/h',
+        'precipIntensityMax': 'in/h',
+        'precipAccumulation': 'in',
+        'temperature': 'F',
+        'temperatureMin': 'F',
+        'temperatureMax': 'F',
+        'apparentTemperature': 'F',
+        'dewPoint': 'F',
+        'windSpeed': 'mph',
+        'pressure': 'mb',
+        'visibility': 'mi'
+    }),
+    'ca': MappingProxyType({
+        'unit': 'ca',
+        'nearestStormDistance': 'km',
+        'precipIntensity': 'mm/h',
+        'precipIntensityMax': 'mm/h',
+        'precipAccumulation': 'cm',
+        'temperature': 'C',
+        'temperatureMin': 'C',
+        'temperatureMax': 'C',
+        'apparentTemperature': 'C',
+        'dewPoint': 'C',
+        'windSpeed': 'km/h',
+        'pressure': 'hPa',
+        'visibility': 'km'
+    }),
+    'uk2': MappingProxyType({
+        'unit': 'uk2',
+        'nearestStormDistance': 'mi',
+        'precipIntensity': 'mm/h',
+        'precipIntensityMax': 'mm/h',
+        'precipAccumulation': 'cm',
+        'temperature': 'C',
+        'temperatureMin': 'C',
+        'temperatureMax': 'C',
+        'apparentTemperature': 'C',
+        'dewPoint': 'C',
+        'windSpeed': 'mph',
+        'pressure': 'hPa',
+        'visibility': 'mi'
+    }),
+    'si': MappingProxyType({
         'unit': 'si',
         'nearestStormDistance': 'km',
         'precipIntensity': 'mm/h',
@@ -86,7 +118,33 @@ def get_units(unit):
         'windSpeed': 'm/s',
         'pressure': 'hPa',
         'visibility': 'km'
-    }
+    })
+}
+
+
+class InvalidTimeError(Exception):
+    """Designed to be thrown when parsing a bad str for creating a Time namedtuple"""
+
+
+def get_units(unit):
+    """
+    Return a dict of units based on the unit format code.
+    :type unit: str
+    :param unit: unit format, unknown formats get the si units
+    :return read only dict containing units for weather measurements, the same one for every call with the unit
+    """
+    return UNITS.get(unit, UNITS['si'])
+
+
+def get_units_list(units):
+    """
+    Vectorized form of get_units
+    :type units: list
+    :param units: list of unit format codes
+    :return: list of read only dicts of units, see get_units
+    """
+    si_units = UNITS['si']
+    return [UNITS.get(unit, si_units) for unit in units]
 
 
 def get_wind_direction(degrees):
@@ -101,24 +159,25 @@ def get_wind_direction(degrees):
         degrees = int(degrees)
     except ValueError:
         return ''
-    direction = ''
-    if degrees < 23 or degrees >= 338:
-        direction = 'N'
-    elif degrees < 68:
-        direction = 'NE'
-    elif degrees < 113:
-        direction = 'E'
-    elif degrees < 158:
-        direction = 'SE'
-    elif degrees < 203:
-        direction = 'S'
-    elif degrees < 248:
-        direction = 'SW'
-    elif degrees < 293:
-        direction = 'W'
-    elif degrees < 338:
-        direction = 'NW'
-    return direction
+    return WIND_DIRECTION_BY_DEGREE[degrees] if 0 <= degrees < 360 else 'N'
+
+
+def get_wind_directions(degrees):
+    """
+    Vectorized form of get_wind_direction, using NumPy if it is installed
+    :type degrees: list or numpy.ndarray
+    :param degrees: numbers of degrees of wind
+    :return: list of wind directions in shorthand form, '' for NaN like get_wind_direction
+    """
+    if numpy is None:
+        return [get_wind_direction(value) for value in degrees]
+    values = numpy.asarray(degrees, dtype=float)
+    # rounded towards 0 like int()
+    indexes = numpy.searchsorted(WIND_DIRECTION_BOUNDS, numpy.trunc(values), side='right')
+    # NaN is sorted after every bound, so it is sent to the '' after the last direction instead
+    indexes[numpy.isnan(values)] = len(WIND_DIRECTIONS)
+    directions = WIND_DIRECTIONS + ('',)
+    return [directions[index] for index in indexes.tolist()]
 
 
 def centerpoint(geolocations):
@@ -138,6 +197,30 @@ def centerpoint(geolocations):
     return [avg_lat, avg_lng]
 
 
+def distance(lat1, lng1, lat2, lng2):
+    """
+    Find the great circle distance between two points with the haversine formula
+    :type lat1: float
+    :type lng1: float
+    :type lat2: float
+    :type lng2: float
+    :return: float: distance in kilometers
+    """
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    half_chord = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(1.0, half_chord)))
+
+
+@functools.lru_cache(maxsize=None)
+def get_timezone(timezone_id):
+    """
+    :type timezone_id: str
+    :param timezone_id: timezone id, ex: 'Europe/Copenhagen'
+    :return: pytz timezone, the same object for every call with the timezone_id
+    """
+    return pytz.timezone(timezone_id)
+
+
 def localize_utc_datetime(timezone_id, raw_dt):
     """
     Convert a timezone unaware datetime object in the UTC timezone to a timezone aware datetime object based on the
@@ -149,7 +232,7 @@ def localize_utc_datetime(timezone_id, raw_dt):
     :return: datetime.datetime
     """
     utc_dt = pytz.utc.localize(raw_dt)
-    return utc_dt.astimezone(pytz.timezone(timezone_id))
+    return utc_dt.astimezone(get_timezone(timezone_id))
 
 
 def datetime_to_utc(timezone_id, raw_dt):
@@ -162,11 +245,113 @@ def datetime_to_utc(timezone_id, raw_dt):
     :param raw_dt: timezone unaware datetime
     :return: datetime.datetime in utc timezone
     """
-    timezone = pytz.timezone(timezone_id)
+    timezone = get_timezone(timezone_id)
     local_dt = timezone.localize(raw_dt)
     return local_dt.astimezone(pytz.utc)
 
 
+def local_fire_time(timezone, day, tweet_time):
+    """
+    Return the moment on the given local day when the local time is tweet_time.
+    If tweet_time is skipped when clocks move forward for DST, it is shifted forward by the hour the clocks skip.
+    If tweet_time happens twice when clocks move back, the first one is used.
+    :type timezone: datetime.tzinfo
+    :param timezone: pytz timezone
+    :type day: datetime.date
+    :param day: local date
+    :type tweet_time: Time
+    :param tweet_time: local time of day
+    :return: datetime.datetime in utc timezone
+    """
+    naive = datetime(day.year, day.month, day.day, tweet_time.hour, tweet_time.minute)
+    try:
+        local_dt = timezone.localize(naive, is_dst=None)
+    except pytz.AmbiguousTimeError:
+        local_dt = timezone.localize(naive, is_dst=True)
+    except pytz.NonExistentTimeError:
+        local_dt = timezone.normalize(timezone.localize(naive, is_dst=False))
+    return local_dt.astimezone(pytz.utc)
+
+
+class FireTimes:
+    """
+    Table of the UTC moments each local time of day happens in a timezone, one row for each local day. A row is built
+    the first time a day is used and holds the times asked for on it, so every location in the timezone shares it.
+    Each day is localized on its own, so a DST transition only changes the rows of the days after it, and only the
+    rows of the latest two days are kept.
+    """
+
+    def __init__(self, timezone_id):
+        """
+        :type timezone_id: str
+        :param timezone_id: timezone id, ex: 'Europe/Copenhagen'
+        """
+        self.timezone = get_timezone(timezone_id)
+        self.__days = {}
+        self.__lock = threading.Lock()
+
+    def fire_time(self, day, tweet_time):
+        """
+        :type day: datetime.date
+        :param day: local date
+        :type tweet_time: Time
+        :param tweet_time: local time of day
+        :return: datetime.datetime in utc timezone, see local_fire_time
+        """
+        with self.__lock:
+            row = self.__days.get(day)
+            if row is None:
+                row = self.__days[day] = {}
+                for old_day in sorted(self.__days)[:-2]:
+                    del self.__days[old_day]
+            fire_dt = row.get(tweet_time)
+            if fire_dt is None:
+                fire_dt = row[tweet_time] = local_fire_time(self.timezone, day, tweet_time)
+        return fire_dt
+
+    def next_fire_time(self, tweet_time, after):
+        """
+        :type tweet_time: Time
+        :param tweet_time: local time of day
+        :type after: datetime.datetime
+        :param after: timezone aware datetime
+        :return: datetime.datetime in utc timezone, the first moment after the given datetime when the local time is
+                 tweet_time
+        """
+        day = after.astimezone(self.timezone).date()
+        while True:
+            fire_dt = self.fire_time(day, tweet_time)
+            if fire_dt > after:
+                return fire_dt
+            day += timedelta(days=1)
+
+
+@functools.lru_cache(maxsize=None)
+def get_fire_times(timezone_id):
+    """
+    :type timezone_id: str
+    :param timezone_id: timezone id, ex: 'Europe/Copenhagen'
+    :return: FireTimes for the timezone, shared by every location in it
+    """
+    return FireTimes(timezone_id)
+
+
+def next_fire_time(timezone_id, tweet_time, after):
+    """
+    Return the first moment after the given datetime when the local time in timezone_id is tweet_time.
+    If tweet_time is skipped when clocks move forward for DST, it is shifted forward by the hour the clocks skip.
+    If tweet_time happens twice when clocks move back, the first one is used.
+    :type timezone_id: str
+    :param timezone_id: timezone id, ex: 'Europe/Copenhagen'
+    :type tweet_time: Time
+    :param tweet_time: local time of day
+    :type after: datetime.datetime
+    :param after: timezone aware datetime
+    :return: datetime.datetime in utc timezone
+    """
+    return get_fire_times(timezone_id).next_fire_time(tweet_time, after)
+
+
 def precipitation_intensity(precip_intensity, unit):
     """
     Return the precipitation intensity str based on the unit of precipIntensity and precip_intensity.
@@ -177,30 +362,28 @@ def precipitation_intensity(precip_intensity, unit):
     :param unit: unit for precipIntensity rate ('in/h' or 'mm/h')
     :return: str of precipitation rate. Note: this is appended to and used in special event times
     """
-    intensities = {
-        'in/h': {
-            'very-light': ('very-light', 0.002),
-            'light': ('light', 0.017),
-            'moderate': ('moderate', 0.1),
-            'heavy': ('heavy', 0.4)
-        },
-        'mm/h': {
-            'very-light': ('very-light', 0.051),
-            'light': ('light', 0.432),
-            'moderate': ('moderate', 2.540),
-            'heavy': ('heavy', 5.08)
-        }
-    }
+    thresholds = INTENSITY_THRESHOLDS[unit]
+    # most of the time there is no precipitation, and NaN would be bisected past every threshold
+    if not precip_intensity >= thresholds[0]:
+        return 'none'
+    return INTENSITY_NAMES[bisect.bisect_right(thresholds, precip_intensity)]
 
-    if precip_intensity >= intensities[unit]['heavy'][1]:
-        return intensities[unit]['heavy'][0]
-    if precip_intensity >= intensities[unit]['moderate'][1]:
-        return intensities[unit]['moderate'][0]
-    if precip_intensity >= intensities[unit]['light'][1]:
-        return intensities[unit]['light'][0]
-    if precip_intensity >= intensities[unit]['very-light'][1]:
-        return intensities[unit]['very-light'][0]
-    return 'none'
+
+def precipitation_intensities(precip_intensities, unit):
+    """
+    Vectorized form of precipitation_intensity, using NumPy if it is installed
+    :type precip_intensities: list or numpy.ndarray
+    :param precip_intensities: precipIntensity rates, all in the same unit
+    :type unit: str
+    :param unit: unit for precipIntensity rate ('in/h' or 'mm/h')
+    :return: list of str of precipitation rates
+    """
+    if numpy is None:
+        return [precipitation_intensity(value, unit) for value in precip_intensities]
+    precip_intensities = numpy.asarray(precip_intensities, dtype=float)
+    indexes = numpy.where(numpy.isnan(precip_intensities), 0,
+                          numpy.searchsorted(INTENSITY_THRESHOLDS[unit], precip_intensities, side='right'))
+    return [INTENSITY_NAMES[index] for index in indexes.tolist()]
 
 
 def parse_time_string(raw_string):
@@ -0,0 +1,199 @@
+"""
+weatherBot watcher
+
+Copyright 2015-2019 Brian Mitchell under the MIT license
+See the GitHub repository: https://github.com/BrianMitchL/weatherBot
+"""
+
+import configparser
+import logging
+import os
+import signal
+import threading
+
+import models
+import templates
+
+# settings only read when weatherBot starts, by CONFIG section, None for the whole section. A reload keeps them as they
+# were until the next start.
+RESTART_SETTINGS = {'basic': ['workers', 'state_path'], 'log': None, 'forecast_cache': None, 'tweet_queue': None,
+                    'metrics': None, 'reload': None, 'adaptive_polling': None}
+
+
+def file_stat(path):
+    """
+    :type path: str
+    :return: tuple of the modification time in nanoseconds and size of the file, or None if it does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FileWatcher:
+    """
+    Notices when any of a list of files changed, by comparing their modification times and sizes each time it is
+    checked, or when a reload was asked for, such as with a SIGHUP
+    """
+
+    def __init__(self, paths, interval=30):
+        """
+        :type paths: list
+        :param paths: paths to the files to watch
+        :type interval: float
+        :param interval: most seconds to go without checking the files
+        """
+        self.interval = interval
+        self.paths = []
+        self.__stats = {}
+        self.__requested = threading.Event()
+        self.watch(paths)
+
+    def watch(self, paths):
+        """
+        Watch these files instead, as they are now
+        :type paths: list
+        :param paths: paths to the files to watch
+        """
+        self.paths = list(paths)
+        self.__stats = {path: file_stat(path) for path in self.paths}
+
+    def request(self, *_):
+        """
+        Ask for a reload the next time the files are checked. Takes any arguments, so it can be a signal handler.
+        """
+        self.__requested.set()
+
+    def changed(self):
+        """
+        :return: bool, True if any of the files changed or a reload was asked for since the last check
+        """
+        requested = self.__requested.is_set()
+        self.__requested.clear()
+        stats = {path: file_stat(path) for path in self.paths}
+        changed = stats != self.__stats
+        self.__stats = stats
+        return requested or changed
+
+
+def start_watcher(path, strings_path, reload_settings):
+    """
+    Watch the conf and strings files for changes, and reload them on SIGHUP where there is one
+    :type path: str
+    :param path: path to the conf file
+    :type strings_path: str
+    :param strings_path: path to the strings YAML file
+    :type reload_settings: dict
+    :param reload_settings: CONFIG['reload']
+    :return: FileWatcher, or None if reloading is disabled
+    """
+    if not reload_settings['enabled']:
+        return None
+    file_watcher = FileWatcher([path, strings_path], interval=reload_settings['interval'])
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, file_watcher.request)
+    return file_watcher
+
+
+def keep_restart_settings(old_config, config):
+    """
+    Copy the settings that are only read when weatherBot starts from the running configuration to a reloaded one,
+    warning about any that changed
+    :type old_config: dict
+    :param old_config: running configuration
+    :type config: dict
+    :param config: reloaded configuration, changed in place
+    """
+    for section, names in RESTART_SETTINGS.items():
+        if names is None:
+            if config[section] != old_config[section]:
+                logging.warning('Restart weatherBot to apply the changed %s settings', section)
+                config[section] = old_config[section]
+            continue
+        for name in names:
+            if config[section][name] != old_config[section][name]:
+                logging.warning('Restart weatherBot to apply the changed %s %s setting', section, name)
+                config[section][name] = old_config[section][name]
+
+
+def apply_states(bot, new_states, events, states, now_utc):
+    """
+    Swap the runtime state of every location for the reloaded one. A location that is kept keeps its weather and
+    timezone, is polled right away if it moved, and has its scheduled tweets queued again if their times changed. New
+    locations are polled right away, and removed locations have their events cancelled. Throttles are kept in STATE
+    by location id, so they carry over.
+    :type bot: module
+    :param bot: the running weatherBot module
+    :type new_states: dict
+    :param new_states: runtime state of each location built from the reloaded configuration, by id
+    :type events: scheduler.Scheduler
+    :type states: dict
+    :param states: runtime state of each location, by id, changed in place
+    :type now_utc: datetime.datetime
+    """
+    for location_id in [location_id for location_id in states if location_id not in new_states]:
+        for kind in ('poll', 'locate', 'forecast', 'conditions'):
+            events.cancel(location_id, kind)
+        del states[location_id]
+    for location_id, location_state in new_states.items():
+        old = states.get(location_id)
+        states[location_id] = location_state
+        if old is None:
+            events.push(now_utc, 'poll', location_id)
+            continue
+        location_state['weather_data'] = old['weather_data']
+        location_state['timezone'] = old['timezone']
+        settings = location_state['settings']
+        if settings['location'] != old['settings']['location']:
+            events.cancel(location_id, 'poll')
+            events.push(now_utc, 'poll', location_id)
+        if location_state['timezone'] is not None and settings['scheduled_times'] != old['settings']['scheduled_times']:
+            bot.schedule_tweets(events, settings, location_state['timezone'], now_utc)
+
+
+def reload_config(bot, path, events, states, now_utc):
+    """
+    Reload the conf and strings files between cycles. Both are read and checked before anything is swapped, so if
+    either is not valid, weatherBot keeps running with what it had. Connection pools, cached forecasts, and
+    throttles are kept. The running module is passed in, so the globals of weatherBot run as a script are the ones
+    swapped.
+    :type bot: module
+    :param bot: the running weatherBot module
+    :type path: str
+    :param path: path to the conf file
+    :type events: scheduler.Scheduler
+    :type states: dict
+    :param states: runtime state of each location, by id, changed in place
+    :type now_utc: datetime.datetime
+    :return: bool, True if the files were reloaded
+    """
+    try:
+        config = bot.parse_config(path)
+        weatherbot_strings = models.load_strings(config['basic']['strings'], config['basic']['strings_snapshot'],
+                                                 parse=models.check_strings)
+    except (configparser.Error, KeyError, ValueError, OSError, models.yaml.YAMLError, templates.TemplateError) as err:
+        logging.error('Could not reload the conf and strings files, keeping the running ones: %r', err)
+        bot.METRICS.inc('weatherbot_reloads_total', outcome='failed')
+        return False
+    keep_restart_settings(bot.CONFIG, config)
+    if bot.POLLER is not None:
+        bot.POLLER.refresh = config['basic']['refresh']
+    # the tracker keeps the newest tweet read of each user, so only its setting is swapped
+    bot.TIMELINES.min_distance = config['variable_location']['min_distance']
+    new_states = bot.build_states(weatherbot_strings, config)
+    located = bot.uses_variable_location(bot.CONFIG), bot.uses_variable_location(config)
+    default_id = bot.DEFAULT_LOCATION_ID
+    if all(located) and config['default_location'] == bot.CONFIG['default_location']:
+        # keep the location last found on the timeline of the followed user
+        new_states[default_id]['settings']['location'] = states[default_id]['settings']['location']
+    bot.CONFIG = config
+    apply_states(bot, new_states, events, states, now_utc)
+    if located == (True, False):
+        events.cancel(default_id, 'locate')
+    elif located == (False, True):
+        events.push(now_utc, 'locate', default_id)
+    bot.METRICS.inc('weatherbot_reloads_total', outcome='applied')
+    logging.info('Reloaded %s and %s for %d locations', path, config['basic']['strings'], len(states))
+    return True
@@ -15,24 +15,58 @@ import os
 import pickle
 import sys
 import textwrap
-import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from datetime import timedelta
 
-import forecastio
-import pytz
-import requests.exceptions
-import tweepy
-import yaml
-
+import cache
+import clients
 import keys
+import lazy
+import logs
+import metrics
 import models
+import outbox
+import polling
+import scheduler
+import state
+import templates
+import timeline
 import utils
+import watcher
+
+# only imported when first used, so tools that never talk to Twitter start faster
+requests = lazy.lazy_import('requests')
+tweepy = lazy.lazy_import('tweepy')
 
 # Global variables
-CACHE = {'throttles': {}}
+# layout of the pickled cache file used by older versions, only read to import it into STATE
+CACHE = {'throttles': {}, 'locations': {}}
 CONFIG = {}
+# conf sections starting with this prefix each describe one extra location, ex: '[location morris]'
+LOCATION_SECTION_PREFIX = 'location '
+# id used for the default location when no location sections are configured
+DEFAULT_LOCATION_ID = 'default'
+# conf sections that older conf files may not have, missing ones are treated as empty
+OPTIONAL_SECTIONS = ['forecast cache', 'tweet queue', 'lookahead', 'metrics', 'reload', 'adaptive polling']
+# long lived Twitter and Dark Sky clients, reused for every call
+TWITTER = clients.TwitterClients()
+DARKSKY = clients.DarkSkyClient()
+# nothing is cached until main configures it, but concurrent fetches of the same location are always merged
+FORECASTS = cache.ForecastCache(ttl=0)
+# throttles and alert SHAs of every location, kept in memory until main opens the state file from the conf
+STATE = state.StateStore(':memory:')
+# newest status id and location of each followed Twitter user, so timelines are only read since the last poll
+TIMELINES = timeline.TimelineTracker()
+# queue of tweets posted in the background, tweets are posted right away until main starts it
+OUTBOX = None
+# picks when each location is polled again when adaptive polling is enabled, otherwise they are polled every refresh
+POLLER = None
+# source of the current time and of waiting, replaced by a simulated clock in a replay
+CLOCK = scheduler.SystemClock()
+# what each stage of a cycle costs, served over HTTP when enabled in the conf
+METRICS = metrics.Registry(metrics.DEFINITIONS)
 
 
 def load_config(path):
@@ -43,16 +77,32 @@ def load_config(path):
     :param path: path to the conf file
     """
     global CONFIG
+    CONFIG = parse_config(path)
+
+
+def parse_config(path):
+    """
+    Read the configuration file from path and set defaults if not given.
+    :type path: str
+    :param path: path to the conf file
+    :return: dict of the configuration, raises configparser.Error, KeyError, or ValueError if it is not valid
+    """
     conf = configparser.ConfigParser()
     conf.read(path)
-    CONFIG = {
+    for section in OPTIONAL_SECTIONS:
+        if not conf.has_section(section):
+            conf.add_section(section)
+    config = {
         'basic': {
             'dm_errors': conf['basic'].getboolean('dm_errors', True),
             'units': conf['basic'].get('units', 'us'),
             'tweet_location': conf['basic'].getboolean('tweet_location', True),
             'hashtag': conf['basic'].get('hashtag', '#MorrisWeather'),
             'refresh': conf['basic'].getint('refresh', 3),
-            'strings': conf['basic'].get('strings', 'strings.yml')
+            'strings': conf['basic'].get('strings', 'strings.yml'),
+            'workers': conf['basic'].getint('workers', 10),
+            'state_path': conf['basic'].get('state_path', '.wbstate.db'),
+            'strings_snapshot': conf['basic'].get('strings_snapshot', '.wbstrings.snapshot') or None
         },
         'scheduled_times': {
             'forecast': utils.parse_time_string(conf['scheduled times'].get('forecast', '6:00')),
@@ -65,11 +115,16 @@ def load_config(path):
         'variable_location': {
             'enabled': conf['variable location'].getboolean('enabled', False),
             'user': conf['variable location'].get('user', 'BrianMitchL'),
-            'unnamed_location_name': conf['variable location'].get('unnamed_location_name', 'The Wilderness')
+            'unnamed_location_name': conf['variable location'].get('unnamed_location_name', 'The Wilderness'),
+            'min_distance': conf['variable location'].getfloat('min_distance', 1.0)
         },
         'log': {
             'enabled': conf['log'].getboolean('enabled', True),
-            'log_path': conf['log'].get('log_path', os.path.expanduser('~') + '/weatherBot.log')
+            'log_path': conf['log'].get('log_path', os.path.expanduser('~') + '/weatherBot.log'),
+            'level': conf['log'].get('level', 'debug'),
+            'max_bytes': conf['log'].getint('max_bytes', 10485760),
+            'backups': conf['log'].getint('backups', 5),
+            'json_path': conf['log'].get('json_path', '') or None
         },
         'throttles': {
             'default': conf['throttles'].getint('default', 120),
@@ -96,48 +151,162 @@ def load_config(path):
             'moderate-hail': conf['throttles'].getint('moderate-hail', 15),
             'light-hail': conf['throttles'].getint('light-hail', 20),
             'very-light-hail': conf['throttles'].getint('very-light-hail', 30)
+        },
+        'forecast_cache': {
+            'ttl': conf['forecast cache'].getint('ttl', 60),
+            'precision': conf['forecast cache'].getint('precision', 3),
+            'size': conf['forecast cache'].getint('size', 1000)
+        },
+        'tweet_queue': {
+            'enabled': conf['tweet queue'].getboolean('enabled', True),
+            'limit': conf['tweet queue'].getint('limit', 300),
+            'window': conf['tweet queue'].getint('window', 180),
+            'retries': conf['tweet queue'].getint('retries', 8),
+            'retry_delay': conf['tweet queue'].getfloat('retry_delay', 5),
+            'max_retry_delay': conf['tweet queue'].getfloat('max_retry_delay', 900)
+        },
+        'lookahead': {
+            'enabled': conf['lookahead'].getboolean('enabled', False),
+            'minutes': conf['lookahead'].getint('minutes', 60)
+        },
+        'metrics': {
+            'enabled': conf['metrics'].getboolean('enabled', False),
+            'host': conf['metrics'].get('host', '127.0.0.1'),
+            'port': conf['metrics'].getint('port', 9187)
+        },
+        'reload': {
+            'enabled': conf['reload'].getboolean('enabled', True),
+            'interval': conf['reload'].getfloat('interval', 30)
+        },
+        'adaptive_polling': {
+            'enabled': conf['adaptive polling'].getboolean('enabled', False),
+            'min_refresh': conf['adaptive polling'].getfloat('min_refresh', 1),
+            'max_refresh': conf['adaptive polling'].getfloat('max_refresh', 15),
+            'precip_probability': conf['adaptive polling'].getfloat('precip_probability', 0.3),
+            'daily_budget': conf['adaptive polling'].getint('daily_budget', 1000)
         }
     }
+    config['locations'] = load_locations(conf, config)
+    return config
 
 
-def initialize_logger(log_enabled, log_pathname):
+def load_locations(conf, defaults):
     """
-    Initialize and start the logger. Logs to console, and if enabled, to a file at the given path.
-    :type log_enabled: bool
-    :param log_enabled: whether or not to write a log file
-    :type log_pathname: str
-    :param log_pathname: full path of where to write the log
+    Build the settings for every '[location <id>]' section in conf. Each section must have a lat and lng, and can
+    override the name, hashtag, scheduled times, and any throttle. Anything not overridden falls back to defaults.
+    :type conf: configparser.ConfigParser
+    :param conf: parsed configuration file
+    :type defaults: dict
+    :param defaults: CONFIG dict built from the rest of the configuration file
+    :return: list of location settings dicts, in the order they appear in the conf file
     """
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)  # global level of debug, so debug or anything less can be used
-    formatter = logging.Formatter('%(asctime)s %(levelname)-8s %(message)s')
-    # Console handler
-    console = logging.StreamHandler()
-    console.setLevel(logging.DEBUG)
-    console.setFormatter(formatter)
-    logger.addHandler(console)
-    # Log file handler
-    if log_enabled:
-        log = logging.FileHandler(log_pathname, 'a')
-        log.setLevel(logging.INFO)
-        log.setFormatter(formatter)
-        logger.addHandler(log)
-    logger.info('Starting weatherBot with Python %s', sys.version)
+    locations = []
+    for section in conf.sections():
+        if not section.startswith(LOCATION_SECTION_PREFIX):
+            continue
+        location_id = section[len(LOCATION_SECTION_PREFIX):].strip()
+        location_conf = conf[section]
+        forecast_time = defaults['scheduled_times']['forecast']
+        if 'forecast' in location_conf:
+            forecast_time = utils.parse_time_string(location_conf['forecast'])
+        conditions_times = defaults['scheduled_times']['conditions']
+        if 'conditions' in location_conf:
+            conditions_times = utils.get_times(location_conf['conditions'])
+        locations.append({
+            'id': location_id,
+            'location': models.WeatherLocation(lat=conf.getfloat(section, 'lat'),
+                                               lng=conf.getfloat(section, 'lng'),
+                                               name=location_conf.get('name', location_id)),
+            'hashtag': location_conf.get('hashtag', defaults['basic']['hashtag']),
+            'scheduled_times': {
+                'forecast': forecast_time,
+                'conditions': conditions_times
+            },
+            'throttles': {event: location_conf.getint(event, minutes)
+                          for event, minutes in defaults['throttles'].items()}
+        })
+    return locations
+
+
+def get_lookahead(config=None):
+    """
+    :type config: dict
+    :param config: configuration to read, defaults to CONFIG
+    :return: int, minutes of the forecast to check for special conditions that are about to start, 0 if disabled
+    """
+    config = CONFIG if config is None else config
+    if config['lookahead']['enabled']:
+        return config['lookahead']['minutes']
+    return 0
+
+
+def default_location_settings(config=None):
+    """
+    Return the location settings for the default location, built from the basic, scheduled times, and throttles
+    sections of CONFIG.
+    :type config: dict
+    :param config: configuration to read, defaults to CONFIG
+    :return: dict
+    """
+    config = CONFIG if config is None else config
+    return {
+        'id': DEFAULT_LOCATION_ID,
+        'location': config['default_location'],
+        'hashtag': config['basic']['hashtag'],
+        'scheduled_times': config['scheduled_times'],
+        'throttles': config['throttles']
+    }
+
+
+def get_locations(config=None):
+    """
+    Return the settings for every location to tweet about. If no location sections are configured, only the default
+    location is used.
+    :type config: dict
+    :param config: configuration to read, defaults to CONFIG
+    :return: list of location settings dicts
+    """
+    config = CONFIG if config is None else config
+    if config['locations']:
+        return config['locations']
+    return [default_location_settings(config)]
 
 
 def get_tweepy_api():
     """
-    Return a tweepy.API object using environmental variables for keys/tokens/secrets
+    Return a tweepy.API object using environmental variables for keys/tokens/secrets.
+    The object is built on first use and then reused, keeping its connections to Twitter alive between calls.
     :return: tweepy api object
     """
-    auth = tweepy.OAuthHandler(os.getenv('WEATHERBOT_CONSUMER_KEY'), os.getenv('WEATHERBOT_CONSUMER_SECRET'))
-    auth.set_access_token(os.getenv('WEATHERBOT_ACCESS_TOKEN'), os.getenv('WEATHERBOT_ACCESS_TOKEN_SECRET'))
-    return tweepy.API(auth)
+    return TWITTER.get(clients.env_account())
 
 
-def get_forecast_object(lat, lng, units='us', lang='en'):
+def report_tweepy_error(err):
+    """
+    Let the Twitter clients know a call failed, so the client is rebuilt after an auth or connection error
+    :type err: tweepy.TweepError
+    """
+    TWITTER.report_error(clients.env_account(), err)
+
+
+def get_excluded_blocks():
+    """
+    Return the Dark Sky response blocks that no enabled feature reads, so they can be left out of every request.
+    models.WeatherData only reads currently, daily, alerts, and flags, and minutely and hourly when the lookahead is
+    enabled. Adaptive polling also reads minutely, to poll more often when precipitation is coming.
+    :return: list of block names
+    """
+    if CONFIG.get('lookahead', {}).get('enabled'):
+        return []
+    if CONFIG.get('adaptive_polling', {}).get('enabled'):
+        return ['hourly']
+    return ['minutely', 'hourly']
+
+
+def get_forecast_object(lat, lng, units='us', lang='en', location_id=DEFAULT_LOCATION_ID):
     """
     Using the 'WEATHERBOT_DARKSKY_KEY' environmental variable, get the weather from Dark Sky at the given location.
+    Forecasts are shared through the forecast cache with other nearby locations using the same units and language.
     If there is an error, log it and return None.
     :type lat: float
     :param lat: latitude
@@ -147,67 +316,117 @@ def get_forecast_object(lat, lng, units='us', lang='en'):
     :param units: units standard, ex 'us', 'ca', 'uk2', 'si', 'auto'
     :type lang: str
     :param lang: language, ex: 'en', 'de'. See https://darksky.net/dev/docs/forecast for more
-    :return: Forecast object or None if HTTPError or ConnectionError
+    :type location_id: str
+    :param location_id: id of the location the forecast is for, used to label metrics
+    :return: dict with the parts of the response models.WeatherData reads, see models.trim_forecast, or None if
+             HTTPError, ConnectionError, or Timeout
     """
+    key = os.getenv('WEATHERBOT_DARKSKY_KEY')
+
+    def fetch():
+        if POLLER is not None:
+            POLLER.spend(key, CLOCK.now())
+        forecast = DARKSKY.load_forecast(key, lat, lng, units=units, lang=lang, exclude=get_excluded_blocks())
+        # recorded here, so forecasts from the cache or from a merged fetch are not counted again for other locations
+        content = getattr(getattr(forecast, 'response', None), 'content', None)
+        if content is not None:
+            METRICS.observe('weatherbot_payload_bytes', len(content), location=location_id)
+        # only the trimmed response is cached, so the rest of it is freed right away
+        return models.trim_forecast(forecast)
+
     try:
-        return forecastio.load_forecast(os.getenv('WEATHERBOT_DARKSKY_KEY'), lat, lng, units=units, lang=lang)
-    except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as err:
+        return FORECASTS.get(lat, lng, units, lang, fetch)
+    except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
         logging.error(err)
         logging.error('Error when getting Forecast object', exc_info=True)
         return None
 
 
+def poll_user_timeline(username):
+    """
+    Read the tweets a Twitter user posted since the last poll and find their most recent location. Only the first
+    poll reads the 20 most recent tweets, later polls ask for newer tweets with since_id.
+    :type username: str
+    :param username: twitter username to follow
+    :return: timeline.TimelinePoll, or None if the timeline could not be read
+    """
+    try:
+        poll = TIMELINES.poll(get_tweepy_api(), username, CONFIG['variable_location']['unnamed_location_name'])
+    except tweepy.TweepError as err:
+        logging.error(err)
+        report_tweepy_error(err)
+        return None
+    logging.debug('Read %d new tweets (%d bytes) from %s, saved %d bytes', poll.tweets, poll.bytes, username,
+                  poll.saved_bytes)
+    if poll.location is not None and poll.moved:
+        logging.debug('Found %s: %f, %f', poll.location.name, poll.location.lat, poll.location.lng)
+    return poll
+
+
 def get_location_from_user_timeline(username, fallback):
     """
-    Load the 20 most recent tweets of a given twitter handle and return a models.WeatherLocation object of the most
-    recent location. This function will find a tweet with coordinates or a place, preferring coordinates. If a location
-    is not found in the most recent 20 tweets, the given fallback location will be returned.
+    Return a models.WeatherLocation object of the most recent location of a given twitter handle. This function will
+    find a tweet with coordinates or a place, preferring coordinates. If none of the 20 most recent tweets has a
+    location, the given fallback location will be returned.
     :type username: str
     :param username: twitter username to follow
     :type fallback: models.WeatherLocation
     :param fallback: a fallback in case no location can be found
     :return: models.WeatherLocation
     """
-    api = get_tweepy_api()
-    # gets the 20 most recent tweets from the given profile
-    try:
-        timeline = api.user_timeline(screen_name=username, include_rts=False, count=20)
-        for tweet in timeline:
-            # if tweet has coordinates (from a smartphone)
-            if tweet.coordinates is not None:
-                lat = tweet.coordinates['coordinates'][1]
-                lng = tweet.coordinates['coordinates'][0]
-                name = CONFIG['variable_location']['unnamed_location_name']
-                # sometimes a tweet contains a coordinate, but is not in a Twitter place
-                # for example, https://twitter.com/BrianMitchL/status/982664157857271810 has coordinates, but no place
-                if tweet.place is not None:
-                    name = tweet.place.full_name
-                logging.debug('Found %s: %f, %f', name, lat, lng)
-                return models.WeatherLocation(lat=lat, lng=lng, name=name)
-            # if the location is a place, not coordinates
-            if tweet.place is not None:
-                point = utils.centerpoint(tweet.place.bounding_box.coordinates[0])
-                lat = point[0]
-                lng = point[1]
-                name = tweet.place.full_name
-                logging.debug('Found the center of bounding box at %s: %f, %f', name, lat, lng)
-                return models.WeatherLocation(lat=lat, lng=lng, name=name)
+    poll = poll_user_timeline(username)
+    if poll is None or poll.location is None:
         # fallback to hardcoded location if there is no valid data
         logging.warning('Could not find tweet with location, falling back to hardcoded location')
         return fallback
-    except tweepy.TweepError as err:
-        logging.error(err)
-        logging.warning('Could not find tweet with location, falling back to hardcoded location')
-        return fallback
+    return poll.location
 
 
-def do_tweet(text, weather_location, tweet_location, variable_location, hashtag=None):
+def locate_locations(pool, events, states, location_ids, now_utc):
+    """
+    Poll the timeline of each followed user once, at the same time, and give the result to every location following
+    them; every location follows the configured user. A location whose user moved more than the min_distance, or falls
+    back to the default location once none of the latest tweets has a location, has its queued poll cancelled so it can
+    be polled for new weather right away. Otherwise it keeps its location and forecast until its next poll.
+    :type pool: concurrent.futures.Executor
+    :type events: scheduler.Scheduler
+    :type states: dict
+    :param states: runtime state of each location, by id
+    :type location_ids: list
+    :param location_ids: ids of the locations to find
+    :type now_utc: datetime.datetime
+    :return: list of ids of the locations that moved
+    """
+    # pylint: disable=too-many-arguments
+    users = {CONFIG['variable_location']['user']: location_ids}
+    futures = {username: pool.submit(poll_user_timeline, username) for username in users}
+    moved = []
+    for username, user_location_ids in users.items():
+        poll = futures[username].result()
+        location = None if poll is None else poll.location
+        if poll is not None and location is None:
+            logging.warning('Could not find tweet with location, falling back to hardcoded location')
+            location = CONFIG['default_location']
+        for location_id in user_location_ids:
+            events.push(now_utc + timedelta(minutes=30), 'locate', location_id)
+            if poll is None:
+                logging.warning('Could not read the timeline, keeping the current location')
+                continue
+            if location != states[location_id]['settings']['location']:
+                states[location_id]['settings']['location'] = location
+                events.cancel(location_id, 'poll')
+                moved.append(location_id)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug('Timelines: %s', TIMELINES.stats())
+    return moved
+
+
+def build_status(text, weather_location, tweet_location, variable_location, hashtag=None):
     """
-    Post a tweet.
+    Build the keyword arguments for tweepy.API.update_status to post a tweet.
     If set in the config, a hashtag will be applied to the end of the tweet.
     If variable_location is True, prepend the tweet with the location name.
     If tweet_location is True, the coordinates of the the location will be embedded in the tweet.
-    If successful, the status id is returned, otherwise None.
     :type text: str
     :param text: text for the tweet
     :type weather_location: models.WeatherLocation
@@ -218,9 +437,8 @@ def do_tweet(text, weather_location, tweet_location, variable_location, hashtag=
     :param variable_location: determines whether or not to prefix the tweet with the location
     :type hashtag: str
     :param hashtag:
-    :return: a tweepy status object
+    :return: dict with the status text, and lat and long if tweet_location is True
     """
-    api = get_tweepy_api()
     body = text
     # account for space before hashtag
     max_length = 279 - len(hashtag) if hashtag else 280
@@ -236,53 +454,140 @@ def do_tweet(text, weather_location, tweet_location, variable_location, hashtag=
 
     if hashtag:
         body += ' ' + hashtag
-    try:
-        if tweet_location:
-            status = api.update_status(status=body, lat=weather_location.lat, long=weather_location.lng)
-        else:
-            status = api.update_status(status=body)
-        logging.info('Tweet success: %s', body)
-        return status
-    except tweepy.TweepError as err:
-        logging.error('Tweet failed: %s', err.reason)
-        logging.warning('Tweet skipped due to error: %s', body)
-        return None
+    if tweet_location:
+        return {'status': body, 'lat': weather_location.lat, 'long': weather_location.lng}
+    return {'status': body}
 
 
-def timed_tweet(tweet_at, now, content, weather_location):
+def do_tweet(text, weather_location, tweet_location, variable_location, hashtag=None, location_id=DEFAULT_LOCATION_ID):
     """
-    If the current time falls within the given time and given time plus the refresh rate, post a tweet using the
-    do_tweet function.
-    :type tweet_at: datetime.datetime
-    :param tweet_at: when a tweet is supposed to be tweeted in UTC
-    :type now: datetime.datetime
-    :param now: current time in UTC
-    :type content: str
-    :param content: text for tweet
+    Post a tweet right away, see build_status for how the text is changed.
+    If successful, the status id is returned, otherwise None.
+    :type text: str
+    :param text: text for the tweet
+    :type weather_location: models.WeatherLocation
+    :param weather_location: location information used for the tweet location and inline location name
+    :type tweet_location: bool
+    :param tweet_location: determines whether or not to include Twitter location
+    :type variable_location: bool
+    :param variable_location: determines whether or not to prefix the tweet with the location
+    :type hashtag: str
+    :param hashtag:
+    :type location_id: str
+    :param location_id: id of the location the tweet is for, used to label metrics
+    :return: a tweepy status object
+    """
+    # pylint: disable=too-many-arguments
+    api = get_tweepy_api()
+    status = build_status(text, weather_location, tweet_location, variable_location, hashtag=hashtag)
+    with METRICS.time('weatherbot_tweet_seconds', location=location_id, outcome='error') as labels:
+        try:
+            tweet = api.update_status(**status)
+        except tweepy.TweepError as err:
+            logging.error('Tweet failed: %s', err.reason)
+            logging.warning('Tweet skipped due to error: %s', status['status'])
+            report_tweepy_error(err)
+            return None
+        labels['outcome'] = 'success'
+    logging.info('Tweet success: %s', status['status'])
+    return tweet
+
+
+def queue_tweet(text, weather_location, tweet_location, variable_location, hashtag=None,
+                location_id=DEFAULT_LOCATION_ID):
+    """
+    Queue a tweet to be posted by OUTBOX in the background, so checking the weather never waits on Twitter.
+    The tweet is posted right away with do_tweet if the queue is not running.
+    :type text: str
+    :param text: text for the tweet
     :type weather_location: models.WeatherLocation
+    :param weather_location: location information used for the tweet location and inline location name
+    :type tweet_location: bool
+    :param tweet_location: determines whether or not to include Twitter location
+    :type variable_location: bool
+    :param variable_location: determines whether or not to prefix the tweet with the location
+    :type hashtag: str
+    :param hashtag:
+    :type location_id: str
+    :param location_id: id of the location the tweet is for, used to label metrics
+    :return: a tweepy status object if posted right away, otherwise None
+    """
+    # pylint: disable=too-many-arguments
+    if OUTBOX is None:
+        return do_tweet(text, weather_location, tweet_location, variable_location, hashtag=hashtag,
+                        location_id=location_id)
+    status = build_status(text, weather_location, tweet_location, variable_location, hashtag=hashtag)
+    # queued with the status, and taken out again by send_status before it is posted
+    status['location_id'] = location_id
+    OUTBOX.put(clients.account_id(clients.env_account()), status)
+    logging.debug('Tweet queued, %d waiting', OUTBOX.depth())
+    return None
+
+
+def send_status(account, status):
+    """
+    Post a status queued in OUTBOX with the account it was queued for. Errors are reported to the Twitter clients and
+    raised again, so OUTBOX can decide whether to retry. Credentials are never queued, so a status queued for an
+    account whose credentials are no longer in the environment raises LookupError and is dropped.
+    :type account: str
+    :param account: clients.account_id of the account the status was queued for
+    :type status: dict
+    :param status: keyword arguments for tweepy.API.update_status, and the location_id queue_tweet adds for metrics
     """
-    if tweet_at <= now < tweet_at + timedelta(minutes=CONFIG['basic']['refresh']):
-        logging.debug('Timed tweet or forecast')
-        do_tweet(content,
-                 weather_location,
-                 CONFIG['basic']['tweet_location'],
-                 CONFIG['variable_location']['enabled'],
-                 hashtag=CONFIG['basic']['hashtag'])
+    if clients.account_id(clients.env_account()) != account:
+        raise LookupError('No credentials for the account {0} the tweet was queued for'.format(account))
+    status = dict(status)
+    # tweets queued before location_id was added to them are counted under the default location
+    location_id = status.pop('location_id', DEFAULT_LOCATION_ID)
+    with METRICS.time('weatherbot_tweet_seconds', location=location_id, outcome='error') as labels:
+        try:
+            get_tweepy_api().update_status(**status)
+        except tweepy.TweepError as err:
+            logging.error('Tweet failed for %s: %s', account, err.reason)
+            report_tweepy_error(err)
+            raise
+        labels['outcome'] = 'success'
+    logging.info('Tweet success: %s', status['status'])
+
+
+def scheduled_tweet(kind, weather_data, wb_string, settings):
+    """
+    Tweet the forecast or the current conditions for a location at one of its scheduled times.
+    :type kind: str
+    :param kind: 'forecast' or 'conditions'
+    :type weather_data: models.WeatherData
+    :param weather_data: most recent weather data for the location
+    :type wb_string: models.WeatherBotString
+    :type settings: dict
+    :param settings: location settings
+    :return: a tweepy status object
+    """
+    with METRICS.time('weatherbot_render_seconds', location=settings['id'], kind=kind):
+        wb_string.set_weather(weather_data)
+        if kind == 'forecast':
+            text = wb_string.forecast()
+        else:
+            text = wb_string.normal()
+    logging.debug('Timed tweet or forecast')
+    return queue_tweet(text,
+                       weather_data.location,
+                       CONFIG['basic']['tweet_location'],
+                       CONFIG['variable_location']['enabled'],
+                       hashtag=settings['hashtag'],
+                       location_id=settings['id'])
 
 
 def cleanse_throttles(throttles, now):
     """
-    If the expiration time of a throttle has passed, remove it from the throttles dict, then return the throttles dict.
-    :type throttles: dict
-    :param throttles: throttles, throttle type as the key, datetime as the value
+    If the expiration time of a throttle or alert has passed, remove it from the throttles, then return the throttles.
+    The 'default' throttle is never removed. Only expired entries are looked at, not every throttle.
+    :type throttles: state.Throttles
+    :param throttles: throttles of a location
     :type now: datetime.datetime
     :param now: the current time to check against a throttle expirey time
-    :return: throttles dictionary with expired keys deleted
+    :return: throttles with expired keys deleted
     """
-    to_delete = [key for key, expires in throttles.items() if expires <= now]
-    for key in to_delete:
-        if key != 'default':
-            del throttles[key]
+    throttles.expire(now)
     return throttles
 
 
@@ -311,70 +616,331 @@ def get_cache(file='.wbcache.p'):
         return CACHE
 
 
-def tweet_logic(weather_data, wb_string):
+def get_throttles(location_id):
+    """
+    Return the throttles for the given location from STATE. Other locations are seeded with the default
+    location's 'default' throttle the first time they are used.
+    :type location_id: str
+    :param location_id: id of the location, as found in the location settings
+    :return: state.Throttles
+    """
+    throttles = STATE.throttles(location_id)
+    if location_id != DEFAULT_LOCATION_ID and 'default' not in throttles.conditions:
+        throttles.conditions['default'] = STATE.throttles(DEFAULT_LOCATION_ID).conditions['default']
+    return throttles
+
+
+def tweet_logic(weather_data, wb_string, settings=None, throttles=None):
     """
     Core logic for tweets once initialization and configuration has been set and weather data fetched.
+    This tweets new weather alerts and special conditions. Forecasts and scheduled conditions are tweeted by
+    scheduled_tweet at their scheduled times.
     :type weather_data: models.WeatherData
     :type wb_string: models.WeatherBotString
+    :type settings: dict
+    :param settings: location settings, defaults to the settings of the default location
+    :type throttles: state.Throttles
+    :param throttles: throttles for the location, defaults to the default location's throttles
     """
-    # pylint: disable=global-variable-not-assigned
-    # CACHE is being modified here, pylint doesn't see that
-    global CACHE
-    wb_string.set_weather(weather_data)
-    special = wb_string.special()
-    normal_text = wb_string.normal()
+    if settings is None:
+        settings = default_location_settings()
+    if throttles is None:
+        throttles = get_throttles(DEFAULT_LOCATION_ID)
+    with METRICS.time('weatherbot_render_seconds', location=settings['id'], kind='special'):
+        wb_string.set_weather(weather_data)
+        special = wb_string.special()
 
-    now = datetime.utcnow()
-    now_utc = utils.datetime_to_utc('UTC', now)
-    now_local = utils.localize_utc_datetime(weather_data.timezone, now)
+    now_utc = CLOCK.now()
 
     # weather alerts
     for alert in weather_data.alerts:
-        if alert.sha() not in CACHE['throttles'] and not alert.expired(now_utc):
+        if alert.sha() not in throttles.alerts and not alert.expired(now_utc):
             try:
-                CACHE['throttles'][alert.sha()] = alert.expires
+                throttles.alerts[alert.sha()] = alert.expires
             except AttributeError:
                 # most alerts are probably done after 3 days
-                CACHE['throttles'][alert.sha()] = alert.time + timedelta(days=3)
-            do_tweet(wb_string.alert(alert, weather_data.timezone),
-                     weather_data.location,
-                     CONFIG['basic']['tweet_location'],
-                     CONFIG['variable_location']['enabled'],
-                     hashtag=CONFIG['basic']['hashtag'])
-
-    # forecast
-    forecast_dt = now_local.replace(hour=CONFIG['scheduled_times']['forecast'].hour,
-                                    minute=CONFIG['scheduled_times']['forecast'].minute,
-                                    second=0, microsecond=0).astimezone(pytz.utc)
-    timed_tweet(forecast_dt, now_utc, wb_string.forecast(), weather_data.location)
-
-    # scheduled tweet
-    for scheduled_time in CONFIG['scheduled_times']['conditions']:
-        scheduled_dt = now_local.replace(hour=scheduled_time.hour,
-                                         minute=scheduled_time.minute,
-                                         second=0, microsecond=0).astimezone(pytz.utc)
-        timed_tweet(scheduled_dt, now_utc, normal_text, weather_data.location)
+                throttles.alerts[alert.sha()] = alert.time + timedelta(days=3)
+            queue_tweet(wb_string.alert(alert, weather_data.timezone),
+                        weather_data.location,
+                        CONFIG['basic']['tweet_location'],
+                        CONFIG['variable_location']['enabled'],
+                        hashtag=settings['hashtag'],
+                        location_id=settings['id'])
 
     # special condition
     if special.type != 'normal':
         logging.debug('Special event')
         try:
-            next_allowed = CACHE['throttles'][special.type]
+            next_allowed = throttles.conditions[special.type]
         except KeyError:
-            next_allowed = CACHE['throttles']['default']
+            next_allowed = throttles.conditions['default']
 
         if now_utc >= next_allowed:
             try:
-                minutes = CONFIG['throttles'][special.type]
+                minutes = settings['throttles'][special.type]
             except KeyError:
-                minutes = CONFIG['throttles']['default']
-            do_tweet(special.text,
-                     weather_data.location,
-                     CONFIG['basic']['tweet_location'],
-                     CONFIG['variable_location']['enabled'],
-                     hashtag=CONFIG['basic']['hashtag'])
-            CACHE['throttles'][special.type] = now_utc + timedelta(minutes=minutes)
-        logging.debug(CACHE)
+                minutes = settings['throttles']['default']
+            queue_tweet(special.text,
+                        weather_data.location,
+                        CONFIG['basic']['tweet_location'],
+                        CONFIG['variable_location']['enabled'],
+                        hashtag=settings['hashtag'],
+                        location_id=settings['id'])
+            throttles.conditions[special.type] = now_utc + timedelta(minutes=minutes)
+        # formatted only if a debug record is written
+        logging.debug('Throttles: %r', throttles)
+
+
+def process_location(settings, wb_string, throttles, now_utc):
+    """
+    Fetch the weather for a single location, run the tweet logic on it, and cleanse its throttles.
+    This is run on a worker thread, so it must only touch state belonging to its own location.
+    :type settings: dict
+    :param settings: location settings
+    :type wb_string: models.WeatherBotString
+    :param wb_string: strings used only by this location
+    :type throttles: state.Throttles
+    :param throttles: throttles used only by this location
+    :type now_utc: datetime.datetime
+    :param now_utc: start of the current cycle in UTC
+    :return: models.WeatherData, or None if no forecast could be fetched
+    """
+    location = settings['location']
+    with METRICS.time('weatherbot_forecast_seconds', location=settings['id']):
+        forecast = get_forecast_object(location.lat, location.lng, CONFIG['basic']['units'], wb_string.language,
+                                       location_id=settings['id'])
+    if forecast is None:
+        METRICS.inc('weatherbot_forecast_errors_total', location=settings['id'])
+        return None
+    with METRICS.time('weatherbot_parse_seconds', location=settings['id']):
+        weather_data = models.WeatherData(forecast, location)
+    if weather_data.valid:
+        tweet_logic(weather_data, wb_string, settings, throttles)
+    cleanse_throttles(throttles, now_utc)
+    METRICS.set('weatherbot_throttles', len(throttles.conditions), location=settings['id'], namespace='conditions')
+    METRICS.set('weatherbot_throttles', len(throttles.alerts), location=settings['id'], namespace='alerts')
+    return weather_data
+
+
+def run_cycle(pool, jobs, now_utc):
+    """
+    Process every location at the same time using the given pool, and wait for all of them to finish.
+    Any exception raised while processing a location is raised again here.
+    :type pool: concurrent.futures.Executor
+    :param pool: bounded pool of workers
+    :type jobs: list
+    :param jobs: list of (settings, wb_string, throttles) tuples, one per location
+    :type now_utc: datetime.datetime
+    :param now_utc: start of the current cycle in UTC
+    :return: list with the models.WeatherData for each location, or None if no forecast could be fetched
+    """
+    futures = [pool.submit(process_location, settings, wb_string, throttles, now_utc)
+               for settings, wb_string, throttles in jobs]
+    return [future.result() for future in futures]
+
+
+def schedule_tweets(events, settings, timezone_id, after):
+    """
+    Replace any queued forecast and conditions events of a location with ones at their next local times.
+    :type events: scheduler.Scheduler
+    :type settings: dict
+    :param settings: location settings
+    :type timezone_id: str
+    :param timezone_id: timezone of the location, ex: 'Europe/Copenhagen'
+    :type after: datetime.datetime
+    :param after: the events are scheduled for the first of their times after this
+    """
+    events.cancel(settings['id'], 'forecast')
+    events.cancel(settings['id'], 'conditions')
+    forecast_time = settings['scheduled_times']['forecast']
+    events.push(utils.next_fire_time(timezone_id, forecast_time, after), 'forecast', settings['id'], forecast_time)
+    for conditions_time in settings['scheduled_times']['conditions']:
+        events.push(utils.next_fire_time(timezone_id, conditions_time, after), 'conditions', settings['id'],
+                    conditions_time)
+
+
+def poll_locations(pool, events, states, location_ids, now_utc):
+    """
+    Fetch the weather for the given locations at the same time, then queue each location's next poll. A location is
+    polled again after the refresh time, or after a minute if its forecast could not be fetched. When a location's
+    timezone is first known or changes, its scheduled tweets are queued again.
+    :type pool: concurrent.futures.Executor
+    :type events: scheduler.Scheduler
+    :type states: dict
+    :param states: runtime state of each location, by id
+    :type location_ids: list
+    :param location_ids: ids of the locations to poll
+    :type now_utc: datetime.datetime
+    """
+    # pylint: disable=too-many-arguments
+    jobs = [(states[location_id]['settings'], states[location_id]['wb_string'], get_throttles(location_id))
+            for location_id in location_ids]
+    results = run_cycle(pool, jobs, now_utc)
+    # only throttles and alerts that changed during the cycle are written
+    with METRICS.time('weatherbot_state_flush_seconds'):
+        written = STATE.flush()
+    if written:
+        logging.debug('Saved %d throttle changes', written)
+    for location_id, weather_data in zip(location_ids, results):
+        location_state = states[location_id]
+        if weather_data is None:
+            events.push(now_utc + timedelta(minutes=1), 'poll', location_id)
+            continue
+        if not weather_data.valid:
+            events.push(now_utc + timedelta(minutes=CONFIG['basic']['refresh']), 'poll', location_id)
+            continue
+        minutes = CONFIG['basic']['refresh'] if POLLER is None else POLLER.next_interval(
+            location_id, weather_data, now_utc, len(states), os.getenv('WEATHERBOT_DARKSKY_KEY'))
+        events.push(now_utc + timedelta(minutes=minutes), 'poll', location_id)
+        location_state['weather_data'] = weather_data
+        if location_state['timezone'] != weather_data.timezone:
+            # on the first poll, also catch up on anything scheduled within the last refresh period
+            after = now_utc
+            if location_state['timezone'] is None:
+                after -= timedelta(minutes=CONFIG['basic']['refresh'])
+            location_state['timezone'] = weather_data.timezone
+            schedule_tweets(events, location_state['settings'], weather_data.timezone, after)
+
+
+def handle_events(pool, events, states, due, now_utc):
+    """
+    Handle events that are due. Variable location lookups come first, then every due poll, along with any location
+    that moved, is run together on the pool, and finally scheduled tweets are sent using each location's most recent
+    weather.
+    :type pool: concurrent.futures.Executor
+    :type events: scheduler.Scheduler
+    :type states: dict
+    :param states: runtime state of each location, by id
+    :type due: list
+    :param due: list of scheduler.Event that are due
+    :type now_utc: datetime.datetime
+    """
+    # pylint: disable=too-many-arguments
+    locates = [event.location_id for event in due if event.kind == 'locate']
+    moved = locate_locations(pool, events, states, locates, now_utc) if locates else []
+    polls = [event.location_id for event in due if event.kind == 'poll' or event.location_id in moved]
+    polls = list(dict.fromkeys(polls))
+    if polls:
+        poll_locations(pool, events, states, polls, now_utc)
+    for event in due:
+        if event.kind in ('forecast', 'conditions'):
+            location_state = states[event.location_id]
+            scheduled_tweet(event.kind, location_state['weather_data'], location_state['wb_string'],
+                            location_state['settings'])
+            events.push(utils.next_fire_time(location_state['timezone'], event.tweet_time, event.due), event.kind,
+                        event.location_id, event.tweet_time)
+
+
+def build_states(weatherbot_strings, config=None):
+    """
+    Build the runtime state of every location. WeatherBotString holds the weather it was last set with, so each
+    location gets its own. Exits if a string can not be compiled.
+    :type weatherbot_strings: dict
+    :type config: dict
+    :param config: configuration to read the locations from, defaults to CONFIG
+    :return: dict of the runtime state of each location, by id
+    """
+    lookahead = get_lookahead(config)
+    try:
+        return {settings['id']: {'settings': settings,
+                                 'wb_string': models.WeatherBotString(weatherbot_strings, lookahead=lookahead),
+                                 'weather_data': None,
+                                 'timezone': None}
+                for settings in get_locations(config)}
+    except templates.TemplateError as err:
+        logging.error(err)
+        logging.error('Could not compile a string in the YAML file, please correct it and try again.')
+        sys.exit()
+
+
+def uses_variable_location(config=None):
+    """
+    :type config: dict
+    :param config: configuration to read, defaults to CONFIG
+    :return: bool, True if the default location follows the location of a Twitter user, which is only used when
+             there are no location sections
+    """
+    config = CONFIG if config is None else config
+    return config['variable_location']['enabled'] and not config['locations']
+
+
+def start_events(states, now_utc):
+    """
+    :type states: dict
+    :param states: runtime state of each location, by id
+    :type now_utc: datetime.datetime
+    :return: scheduler.Scheduler with the first poll of every location, and the first variable location lookup
+    """
+    events = scheduler.Scheduler()
+    if uses_variable_location():
+        # check for a new location every 30 minutes
+        events.push(now_utc, 'locate', DEFAULT_LOCATION_ID)
+    for location_id in states:
+        events.push(now_utc, 'poll', location_id)
+    return events
+
+
+def run_events(pool, events, states, until=None, file_watcher=None):
+    """
+    Handle events as they become due, sleeping on CLOCK exactly until the next one is due. With a watcher, the conf
+    and strings files are reloaded between cycles when they change, and the sleep is cut short to check them.
+    :type pool: concurrent.futures.Executor
+    :type events: scheduler.Scheduler
+    :type states: dict
+    :param states: runtime state of each location, by id
+    :type until: datetime.datetime
+    :param until: return once CLOCK reaches this, or never if None
+    :type file_watcher: watcher.FileWatcher
+    :param file_watcher: watches the conf file, first, and the strings file, or None to never reload them
+    :return: int, number of times events were handled
+    """
+    cycles = 0
+    while True:
+        now_utc = CLOCK.now()
+        if until is not None and now_utc >= until:
+            return cycles
+        if file_watcher is not None and file_watcher.changed():
+            if watcher.reload_config(sys.modules[__name__], file_watcher.paths[0], events, states, now_utc):
+                file_watcher.watch([file_watcher.paths[0], CONFIG['basic']['strings']])
+        due = events.pop_due(now_utc)
+        if due:
+            with METRICS.time('weatherbot_cycle_seconds'):
+                handle_events(pool, events, states, due, now_utc)
+            cycles += 1
+            # the stats are only gathered when debug records are written
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug('Dark Sky fetches: %s', DARKSKY.stats())
+                logging.debug('Forecast cache: %s', FORECASTS.stats())
+                if OUTBOX is not None:
+                    logging.debug('Tweet queue: %s', OUTBOX.stats())
+                if POLLER is not None:
+                    logging.debug('Adaptive polling: %s', POLLER.stats())
+        next_due = events.next_due()
+        if until is not None and (next_due is None or next_due > until):
+            next_due = until
+        if file_watcher is not None:
+            check = CLOCK.now() + timedelta(seconds=file_watcher.interval)
+            if next_due is None or next_due > check:
+                next_due = check
+        CLOCK.sleep(max((next_due - CLOCK.now()).total_seconds(), 0))
+
+
+def collect_metrics(registry):
+    """
+    Set the metrics kept in the stats of the Dark Sky client, forecast cache, and tweet queue
+    :type registry: metrics.Registry
+    """
+    registry.set('weatherbot_darksky_fetches_total', DARKSKY.stats()['fetches'])
+    forecasts = FORECASTS.stats()
+    registry.set('weatherbot_forecast_cache_entries', forecasts['entries'])
+    registry.set('weatherbot_forecast_cache_hits_total', forecasts['hits'])
+    registry.set('weatherbot_forecast_cache_misses_total', forecasts['misses'])
+    registry.set('weatherbot_forecast_fetches_merged_total', forecasts['merged'])
+    registry.set('weatherbot_outbox_depth', OUTBOX.depth() if OUTBOX is not None else 0)
+    if POLLER is not None:
+        registry.set('weatherbot_polls_saved', POLLER.stats()['saved'])
+        registry.set('weatherbot_darksky_budget_remaining',
+                     POLLER.call_budget(os.getenv('WEATHERBOT_DARKSKY_KEY')).remaining(CLOCK.now()))
 
 
 def main(path):
@@ -384,44 +950,30 @@ def main(path):
     :param path: path to configuration file
     """
     # pylint: disable=broad-except,no-member
-    global CACHE
+    global DARKSKY, FORECASTS, STATE, OUTBOX, POLLER, TIMELINES
     load_config(os.path.abspath(path))
-    initialize_logger(CONFIG['log']['enabled'], CONFIG['log']['log_path'])
+    # keep a pooled connection alive for each worker
+    DARKSKY = clients.DarkSkyClient(pool_size=CONFIG['basic']['workers'])
+    FORECASTS = cache.ForecastCache(**CONFIG['forecast_cache'])
+    log_writer = logs.initialize_logger(CONFIG['log']['enabled'], CONFIG['log']['log_path'],
+                                        level=CONFIG['log']['level'], max_bytes=CONFIG['log']['max_bytes'],
+                                        backups=CONFIG['log']['backups'], json_path=CONFIG['log']['json_path'])
     logging.debug(CONFIG)
     keys.set_twitter_env_vars()
     keys.set_darksky_env_vars()
-    CACHE['throttles']['default'] = pytz.utc.localize(datetime.utcnow()).astimezone(pytz.utc)
-    with open(CONFIG['basic']['strings'], 'r') as file_stream:
-        try:
-            weatherbot_strings = yaml.safe_load(file_stream)
-            logging.debug(weatherbot_strings)
-            wb_string = models.WeatherBotString(weatherbot_strings)
-        except yaml.YAMLError as err:
-            logging.error(err, exc_info=True)
-            logging.error('Could not read YAML file, please correct, run yamllint, and try again.')
-            sys.exit()
-
-    location = CONFIG['default_location']
-    updated_time = utils.datetime_to_utc('UTC', datetime.utcnow()) - timedelta(minutes=30)
+    STATE = state.open_state(CONFIG['basic']['state_path'])
+    OUTBOX = outbox.open_outbox(send_status, clients.is_retryable_error, CONFIG['basic']['state_path'],
+                                CONFIG['tweet_queue'])
+    TIMELINES = timeline.start_tracker(CONFIG['variable_location'])
+    POLLER = polling.start_poller(CONFIG['adaptive_polling'], CONFIG['basic']['refresh'], STATE, METRICS)
+    metrics_server = metrics.start_metrics(METRICS, CONFIG['metrics'], collect_metrics)
+    get_throttles(DEFAULT_LOCATION_ID).conditions['default'] = CLOCK.now()
+    states = build_states(models.load_strings(CONFIG['basic']['strings'], CONFIG['basic']['strings_snapshot']))
+    events = start_events(states, CLOCK.now())
+    file_watcher = watcher.start_watcher(os.path.abspath(path), CONFIG['basic']['strings'], CONFIG['reload'])
     try:
-        while True:
-            # check for new location every 30 minutes
-            now_utc = utils.datetime_to_utc('UTC', datetime.utcnow())
-            if CONFIG['variable_location']['enabled'] and updated_time + timedelta(minutes=30) < now_utc:
-                location = get_location_from_user_timeline(CONFIG['variable_location']['user'], location)
-                updated_time = now_utc
-            forecast = get_forecast_object(location.lat, location.lng, CONFIG['basic']['units'],
-                                           wb_string.language)
-            if forecast is not None:
-                weather_data = models.WeatherData(forecast, location)
-                if weather_data.valid:
-                    CACHE = get_cache()
-                    tweet_logic(weather_data, wb_string)
-                CACHE['throttles'] = cleanse_throttles(CACHE['throttles'], now_utc)
-                set_cache(CACHE)
-                time.sleep(CONFIG['basic']['refresh'] * 60)
-            else:
-                time.sleep(60)
+        with ThreadPoolExecutor(max_workers=CONFIG['basic']['workers']) as pool:
+            run_events(pool, events, states, file_watcher=file_watcher)
     except Exception as err:
         logging.error(err)
         logging.error('We got an exception!', exc_info=True)
@@ -429,6 +981,13 @@ def main(path):
             api = get_tweepy_api()
             api.send_direct_message(recipient_id=api.me().id,
                                     text=datetime.utcnow().isoformat() + '\n' + traceback.format_exc())
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+        if OUTBOX is not None:
+            OUTBOX.close()
+        STATE.close()
+        log_writer.stop()
 
 
 if __name__ == '__main__':